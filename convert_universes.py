@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import argparse, qm_shared
+from sys import exit
+from os.path import exists
+
+#UNIVERSE FILE CONVERTER - text <=> binary
+
+def convert():
+	parser = argparse.ArgumentParser(
+						prog='Quantumafia Universe File Converter',
+						description='This converts universe files between the text format and the compact binary format. Text files become binary files, and binary files become text files. The original file is left alone.')
+
+	parser.add_argument('files', help="One or more universe files to convert (e.g. universes-D1.txt universes-N1.txt).", nargs='+')
+	args = parser.parse_args()
+
+	for filename in args.files:
+		if not exists(filename):
+			print(f"Can't find the universe file {filename}. Skipping it.")
+			continue
+
+		universe_file = qm_shared.UniverseFile(filename)
+		to_binary = not universe_file.is_binary
+		output_filename = (filename[:-4] if filename.endswith(('.txt', '.bin')) else filename) + ('.bin' if to_binary else '.txt')
+
+		print(f"Converting {filename} ({universe_file.num_universes:,} universes) to {'binary' if to_binary else 'text'} as {output_filename}...")
+		try:
+			with open(output_filename, 'xb' if to_binary else 'x') as output_universes:
+				qm_shared.write_universe_header(output_universes, to_binary, universe_file.liveness, universe_file.setup, universe_file.num_universes, universe_file.actions, universe_file.num_digits, universe_file.is_canonical, universe_file.is_implicit)
+				if not universe_file.is_implicit: #an implicit D1 set stays just the header
+					qm_shared.write_universe_records(output_universes, universe_file.universes(), to_binary, universe_file.num_digits, universe_file.num_players)
+		except FileExistsError:
+			print(f"Error - Can't write to {output_filename} - it already exists.")
+			exit()
+		finally:
+			universe_file.close()
+
+	print("All done! Note that if both a text and binary version of a universe file exist, the binary version is the one that gets used. Delete or move the old files once you're happy with the new ones.")
+
+if __name__ == "__main__":
+	convert()
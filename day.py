@@ -1,18 +1,166 @@
 #!/usr/bin/env python3
 
-import argparse, random, qm_shared
+import argparse, collections, random, qm_shared, qm_permutations, qm_vector, qm_parallel, qm_cluster, qm_speculate
 from sys import exit
 
 #DAY PRECESSION
 
-def day():
+def vote_pass(universe_file, vote, num_players, vectorized=False, stream=False, workers=1, cluster=None): #marks the voted player V in every universe, collapsing the ones where that can't happen. Returns the surviving universes and the collapse counts.
+	if vectorized:
+		output_buffer, entangler_subsidiary_buffer, universes_collapsed, unknown_role = qm_vector.vote_pass(universe_file, vote, qm_shared.universe_chunk_size)
+	elif workers > 1 or cluster is not None:
+		output_buffer, entangler_subsidiary_buffer, universes_collapsed, unknown_role = qm_parallel.sharded_pass(universe_file, vote_universes, (vote,), 2, workers, num_players, stream, cluster)
+	else:
+		output_buffer = qm_shared.new_universe_buffer(num_players, stream=stream)
+		entangler_subsidiary_buffer = qm_shared.new_universe_buffer(num_players, stream=stream)
+		universes_collapsed = [0, 0] #already dead, vote entangler
+		unknown_role = vote_universes(universe_file.universes(), vote, output_buffer, entangler_subsidiary_buffer, universes_collapsed)
+	if unknown_role is not None:
+		print(f"The voted target player was found with an unknown role ({unknown_role}). Giving up.")
+		exit()
+	return vote_pass_result(output_buffer, entangler_subsidiary_buffer, universes_collapsed)
+
+def vote_universes(universes, vote, output_buffer, entangler_subsidiary_buffer, universes_collapsed): #the vote pass proper, over any run of universes. Returns the first unknown role the vote hits (stopping there), or None.
+	vote_hit_nonentangler_in_some_universe = False
+
+	#track scum action
+	for universe_chunk in universes:
+		universe = universe_chunk[1]
+		universe_to_transform = [*universe]
+		
+		voted_player_role = universe[vote]
+	
+		if voted_player_role == 'X':
+			universes_collapsed[0] += 1
+			continue
+	
+		universe_to_transform[vote] = 'V' #mark dead
+	
+		if voted_player_role == 'E':
+			if not vote_hit_nonentangler_in_some_universe:
+				entangler_subsidiary_buffer.append([universe_chunk[0],universe_to_transform])
+			else:
+				universes_collapsed[1] += 1
+				continue
+		elif voted_player_role in qm_permutations.SCUM_ROLES + 'DFGT':
+			vote_hit_nonentangler_in_some_universe = True	
+			output_buffer.append([universe_chunk[0],universe_to_transform])
+			continue
+		else:
+			return voted_player_role
+
+	return None
+
+def vote_pass_result(output_buffer, entangler_subsidiary_buffer, universes_collapsed): #if the vote hit the entangler in every universe, the entangler universes are all we have left
+	if len(output_buffer) == 0:
+		if len(entangler_subsidiary_buffer) == 0:
+			qm_shared.paradox("voting") #will exit
+		output_buffer = entangler_subsidiary_buffer
+		print("It is my sad duty to announce that the Entangler has been killed in every surviving universe.")
+	else:
+		universes_collapsed[1] += len(entangler_subsidiary_buffer)
+	del entangler_subsidiary_buffer #maybe reclaim memory space
+	return output_buffer, universes_collapsed
+
+what_if_table = str.maketrans({role: '.' for role in qm_permutations.SCUM_ROLES + 'DFGT'} | {'V': 'X'}) #keeps the entangler and deaths (and any role vote_universes wouldn't know), blanks out the rest
+
+def what_if_patterns(universe_file): #how many universes there are of each pattern of deaths and entangler. That's all the vote pass looks at, and there are far fewer patterns than universes, so every candidate can be worked out from one scan.
+	return collections.Counter(roles.translate(what_if_table) for _, roles in universe_file.universes())
+
+def unknown_vote_roles(patterns, vote): #roles vote_universes would give up on
+	return sorted({pattern[vote] for pattern in patterns if pattern[vote] not in '.EX'})
+
+def what_if_vote(patterns, vote, player_liveness): #the vote pass and the first round of cascade deaths if vote was voted out, worked out from the patterns. Returns the collapse counts (already dead, vote entangler) and surviving count like vote_pass, whether the entangler universes are the survivors, and who'd be dead in every surviving universe.
+	already_dead = sum(count for pattern, count in patterns.items() if pattern[vote] == 'X')
+	entangler = sum(count for pattern, count in patterns.items() if pattern[vote] == 'E')
+	surviving = sum(count for pattern, count in patterns.items() if pattern[vote] == '.')
+	entangler_survives = surviving == 0 and entangler > 0 #if the vote hit the entangler in every universe, the entangler universes are all we have left
+	if entangler_survives:
+		surviving, entangler = entangler, 0
+	survivor_patterns = [pattern for pattern in patterns if pattern[vote] == ('E' if entangler_survives else '.')]
+	cascade_deaths = [idx for idx, item in enumerate(player_liveness) if idx != vote and item[1] == '#' and len(survivor_patterns) > 0 and all(pattern[idx] == 'X' for pattern in survivor_patterns)]
+	return [already_dead, entangler], surviving, entangler_survives, cascade_deaths
+
+def print_what_if(universe_file, candidates, player_liveness, player_names): #day.py --what-if
+	print("Counting universes...")
+	patterns = what_if_patterns(universe_file)
+	multiplicity = universe_file.multiplicity()
+	print("If each of these players was voted out today (nothing has been written):")
+	for vote in candidates:
+		unknown_roles = unknown_vote_roles(patterns, vote)
+		if len(unknown_roles) > 0:
+			print(f"{player_names[vote]}: found with an unknown role ({', '.join(unknown_roles)}). The vote would give up.")
+			continue
+		universes_collapsed, surviving, entangler_survives, cascade_deaths = what_if_vote(patterns, vote, player_liveness)
+		universes_collapsed = [count * multiplicity for count in universes_collapsed]
+		print("{}: {:,} universes collapse ({:,} target already dead, {:,} target was entangler), {:,} remain.".format(player_names[vote], sum(universes_collapsed), *universes_collapsed, surviving * multiplicity))
+		if surviving == 0:
+			print(f"{tab()}*** TIME PARADOX *** Every universe would collapse.")
+			continue
+		if entangler_survives:
+			print(f"{tab()}The Entangler would be killed in every surviving universe.")
+		if len(cascade_deaths) > 0:
+			print(f"{tab()}CASCADE: {qm_shared.oxford_comma([player_names[idx] for idx in cascade_deaths], 'and')} would be dead in every surviving universe, and flip.")
+	print("The flips can collapse more universes and cascade further, depending on which universe each flip is picked from. That isn't included here.")
+
+def tab():
+	return "        " #8 spaces
+
+def confirm_write():
+	try:
+		input("Press ENTER to write results to a file.")
+	except (KeyboardInterrupt, EOFError):
+		print()
+		print("Goodbye!")
+		exit()
+
+def promote_scum(universe): #will mutate universe
+	if 'A' not in universe[1]: #no alpha scum
+		try:
+			c_index = universe[1].index('C')
+		except ValueError:
+			c_index = None
+		try:
+			b_index = universe[1].index('B')
+		except ValueError:
+			b_index = None
+		if b_index is None and c_index is None: #only extra scum left. The lowest-seated one takes over - nothing else tells them apart, so a canonical set promotes the same player in every ordering of the full set it stands for.
+			extra_index = next((idx for idx, role in enumerate(universe[1]) if role in qm_permutations.EXTRA_SCUM_ROLES), None)
+			if extra_index is not None:
+				universe[1][extra_index] = 'A'
+		elif b_index is None:
+			universe[1][c_index] = 'A'
+		else:
+			universe[1][b_index] = 'A'
+			if c_index is not None:
+				universe[1][c_index] = 'B'
+
+def day(argv=None): #argv is the command line arguments, if not sys.argv's (see run_phase.py). Returns whether it wrote the night's phase file - --what-if and --speculate don't.
 	parser = argparse.ArgumentParser(
 						prog='Quantumafia Day Processor',
 						description='This processes the end-of-day transition in a match of Quantumafia.')
 					
 	parser.add_argument('day', type=int, help="Indicates which game day (1, 2, 3...) is to be transitioned.")
-	parser.add_argument('vote', help="One or more letters, from A, B, C... which indicates which player was voted out. Separate successive letters by spaces if more than one. If more than one player is supplied one of them will be picked randomly.", nargs='+', type=qm_shared.single_letter)
-	args = parser.parse_args()
+	parser.add_argument('vote', help="One or more letters, from A, B, C... which indicates which player was voted out. Separate successive letters by spaces if more than one. If more than one player is supplied one of them will be picked randomly. With --what-if, the players to report on (all the living players if none are given).", nargs='*', type=qm_shared.single_letter)
+	buffer_mode = parser.add_mutually_exclusive_group()
+	buffer_mode.add_argument('--vectorized', action='store_true', help="Hold the surviving universes in a numpy matrix instead of a Python list, and process the vote a column at a time. Much less memory and faster on big games. Needs numpy.")
+	buffer_mode.add_argument('--stream', action='store_true', help="Spill the surviving universes to a temporary file in the current directory and process them a chunk at a time, so memory use stays flat no matter how big the game is. Slower, but it won't run out of RAM.")
+	parser.add_argument('--checkpoint', action='store_true', help="Save a checkpoint after each stage of the transition (the vote pass, each round of flips, the liveness transformation), so an interrupted run can be picked up with --resume. Each checkpoint is a full copy of the surviving universes, written and synced to disk before the phase file is - on a set of gigabytes, that's several extra writes of that size per run, so it's off unless asked for.")
+	parser.add_argument('--resume', action='store_true', help="Pick up from the last checkpoint of an interrupted --checkpoint run of this day, instead of starting over. Use the same day and vote arguments as before. It carries on checkpointing.")
+	parser.add_argument('--chunk-size', type=int, default=qm_shared.universe_chunk_size, help=f"How many universes to read or process at a time (default {qm_shared.universe_chunk_size}).")
+	parser.add_argument('--workers', type=int, default=1, help="Split the vote pass across this many worker processes, each taking a range of the universe file. The results are the same as a single process run. Can't be combined with --vectorized.")
+	parser.add_argument('--cluster', type=qm_cluster.cluster_addresses, help="Like --workers, but run the vote pass on cluster workers (qm_cluster.py): a comma separated list of their host:port or socket path addresses. They need this game's directory at the same path, e.g. on a shared filesystem. Can't be combined with --vectorized.")
+	parser.add_argument('--what-if', action='store_true', help="Don't transition anything. Instead, report what voting out each candidate would do - how many universes collapse, and who'd die in the cascade - from one scan of the universe file. Nothing is written.")
+	parser.add_argument('--speculate', action='store_true', help="While voting is still open: work out the whole day for each of the vote letters given, in the background, so that when day.py is run for one of them, it can use the results straight away. They're kept in speculate-D<day>, a phase file's worth of disk for each vote. Each one runs with this run's --vectorized, --stream, --chunk-size and --workers.")
+	parser.add_argument('--jobs', type=int, default=1, help="With --speculate, how many of the vote letters to work out at once (default 1). Each one takes as much memory as a normal day transition.")
+	parser.add_argument('--yes', action='store_true', help="Don't wait for ENTER before writing the results, e.g. when run_phase.py or a script is driving the day.")
+	args = parser.parse_args(argv)
+	if args.vectorized:
+		qm_vector.require_numpy()
+	if (args.workers > 1 or args.cluster is not None) and args.vectorized:
+		print("--workers and --cluster can't be used with --vectorized. Pick one.")
+		exit()
+	qm_shared.universe_chunk_size = args.chunk_size
 
 	#this block is the same as night's block
 	game_setup, random_source, _ = qm_shared.read_game_info(args.day, False)
@@ -45,6 +193,33 @@ def day():
 	if any(player_liveness[qm_shared.player_to_pos(char)][1] != '#' for char in args.vote):
 		print("One or more targeted players have been voted out or are 100% dead already. Remove them from the vote list and try again.")
 	
+	if args.what_if:
+		candidates = [idx for idx, item in enumerate(player_liveness) if item[1] == '#' and (len(args.vote) == 0 or qm_shared.pos_to_player(idx) in args.vote)]
+		print_what_if(qm_shared.get_universe_file(args.day, True), candidates, player_liveness, player_names)
+		qm_shared.close_universe_file()
+		return False
+	if len(args.vote) == 0:
+		print("Who was voted out? Give me at least one player letter. (Or use --what-if to see what voting out each of them would do.)")
+		exit()
+	if args.speculate:
+		qm_shared.close_universe_file()
+		transition_args = (["--vectorized"] if args.vectorized else []) + (["--stream"] if args.stream else []) + ["--chunk-size", str(args.chunk_size), "--workers", str(args.workers)]
+		qm_speculate.speculate(args.day, list(dict.fromkeys(args.vote)), transition_args, args.jobs)
+		return False
+	
+	speculation = qm_speculate.cached_speculation(args.day, args.vote) if not args.resume else None
+	if speculation is not None:
+		speculation_dir, speculation = speculation
+		qm_shared.close_universe_file()
+		print(f"Voting out {player_names[qm_shared.player_to_pos(args.vote[0])]} was already worked out while voting was open (day.py --speculate).")
+		if not args.yes:
+			confirm_write()
+		qm_speculate.commit_speculation(args.day, speculation_dir)
+		print(speculation['output'], end='')
+		if not qm_shared.universe_file_exists(f"N{args.day}"): #the game's over (or the transition gave up), same as the run itself
+			exit()
+		return True
+	
 	if len(args.vote) > 1:
 		vote = random_source.choice(args.vote)
 		print("More than one vote candidate. Choosing one randomly...")
@@ -54,79 +229,42 @@ def day():
 	vote = qm_shared.player_to_pos(vote)
 	print(f"Voting out {player_names[vote]}.")
 	
-	output_buffer = []
-	entangler_subsidiary_buffer = []
-	vote_hit_nonentangler_in_some_universe = False
-
-	universes_collapsed = [0, 0] #already dead, vote entangler
+	if args.checkpoint or args.resume:
+		qm_shared.checkpoint_phase = f"D{args.day}"
+		qm_shared.checkpoint_args = ["day", args.day, args.vote]
 	
 	universe_file = qm_shared.get_universe_file(args.day, True)
-	universe_file.seek(0)
-	universe_file.readline()
-	universe_file.readline()
-	universe_file.readline()
-	universe_file.readline() #skip header
 
-	#track scum action
-	for _ in range(num_universes):
-		universe_chunk = qm_shared.parse_universe(universe_file.readline())
-		universe = universe_chunk[1]
-		universe_to_transform = [*universe]
-		
-		voted_player_role = universe[vote]
-	
-		if voted_player_role == 'X':
-			universes_collapsed[0] += 1
-			continue
-	
-		universe_to_transform[vote] = 'V' #mark dead
-	
-		if voted_player_role == 'E':
-			if not vote_hit_nonentangler_in_some_universe:
-				entangler_subsidiary_buffer.append([universe_chunk[0],universe_to_transform])
-			else:
-				universes_collapsed[1] += 1
-				continue
-		elif voted_player_role in 'ABCDFGT':
-			vote_hit_nonentangler_in_some_universe = True	
-			output_buffer.append([universe_chunk[0],universe_to_transform])
-			continue
-		else:
-			print(f"The voted target player was found with an unknown role ({voted_player_role}). Giving up.")
-			exit()
-
-
-	if len(output_buffer) == 0:
-		if len(entangler_subsidiary_buffer) == 0:
-			qm_shared.paradox("voting") #will exit
-		output_buffer = entangler_subsidiary_buffer
-		print("It is my sad duty to announce that the Entangler has been killed in every surviving universe.")
+	if args.resume:
+		checkpoint, output_buffer = qm_shared.load_checkpoint(f"D{args.day}", ["day", args.day, args.vote], args.vectorized, args.stream)
 	else:
-		universes_collapsed[1] += len(entangler_subsidiary_buffer)
-	del entangler_subsidiary_buffer #maybe reclaim memory space
-
-	print("Voting phase complete. {} universes collapsed in the phase ({} target already dead, {} target was entangler).".format(sum(universes_collapsed),*universes_collapsed))
+		checkpoint = None
+		output_buffer, universes_collapsed = vote_pass(universe_file, vote, num_players, args.vectorized, args.stream, args.workers, args.cluster)
+		print("Voting phase complete. {} universes collapsed in the phase ({} target already dead, {} target was entangler).".format(sum(universes_collapsed),*universes_collapsed))
+		qm_shared.save_checkpoint("vote", output_buffer)
 		
 		
 	#update liveness and state, and cascade. pretty much the same as for Night.
 	
-	updated_liveness = qm_shared.cascade(output_buffer, player_liveness, voted_player_id=vote)
-	updated_liveness = qm_shared.transform_liveness_roles(output_buffer, updated_liveness)
+	if checkpoint is not None and checkpoint['stage'] == "transform":
+		qm_shared.flip_setup() #cascade would normally do this. We'll need it for writing.
+		updated_liveness = checkpoint['liveness']
+	else:
+		resuming_cascade = checkpoint is not None and checkpoint['stage'] == "cascade"
+		updated_liveness = qm_shared.cascade(output_buffer, checkpoint['liveness'] if resuming_cascade else player_liveness, voted_player_id=vote)
+		updated_liveness = qm_shared.transform_liveness_roles(output_buffer, updated_liveness)
+		qm_shared.save_checkpoint("transform", output_buffer, liveness=updated_liveness)
 	qm_shared.close_universe_file()
 
-	try:
-		input("Press ENTER to write results to a file.")
-	except (KeyboardInterrupt, EOFError):
-		print()
-		print("Goodbye!")
-		exit()
+	if not args.yes:
+		confirm_write()
 	
 	#we also need to update current_setup.
 	new_setup = [0, num_scum, has_detective_right_now, has_entangler_right_now, has_follower_right_now, has_guard_right_now]
 	for player in updated_liveness:
 		if player[1] == '#': #alive
 			new_setup[0] += 1
-		elif player[0] in 'ABC': #dead detective
+		elif player[0] in qm_permutations.SCUM_ROLES: #dead scum
 			new_setup[1] -= 1
 		elif player[0] == 'D': #dead detective
 			new_setup[2] = False
@@ -160,18 +298,21 @@ def day():
 		min_living_players = num_players_left
 		max_living_players = 0
 		
-		for universe in output_buffer:
-			players_in_this_univ = 0
-			for idx, player in enumerate(universe[1]):
-				if player not in 'XV':
-					sometimes_alive[idx] = True
-					players_in_this_univ += 1
-				else:
-					always_alive[idx] = False
-			min_living_players = min(min_living_players, players_in_this_univ)
-			max_living_players = max(max_living_players, players_in_this_univ)
+		if qm_shared.is_vectorized(output_buffer):
+			always_alive, sometimes_alive, min_living_players, max_living_players = output_buffer.alive_scan(num_players_left)
+		else:
+			for universe in output_buffer:
+				players_in_this_univ = 0
+				for idx, player in enumerate(universe[1]):
+					if player not in 'XV':
+						sometimes_alive[idx] = True
+						players_in_this_univ += 1
+					else:
+						always_alive[idx] = False
+				min_living_players = min(min_living_players, players_in_this_univ)
+				max_living_players = max(max_living_players, players_in_this_univ)
 
-		qm_shared.write_final_universe_file(output_buffer, "universes-final.txt")
+		qm_shared.write_final_universe_file(output_buffer, qm_shared.universe_file_name("final"), updated_liveness, new_setup)
 		if not any(sometimes_alive):
 			print("*** DRAW ***")
 			print("Everybody dies. The game is over!")
@@ -191,25 +332,17 @@ def day():
 			exit()
 	else:
 		#check for scum victory (if scum didn't die, we can't have a TOWN victory or DRAW because one scum is still alive.)
-		qm_shared.check_scum_victory(output_buffer, num_scum_left) #may exit
+		qm_shared.check_scum_victory(output_buffer, num_scum_left, updated_liveness, new_setup) #may exit
 		
 	#now maybe promote scum	
-	for universe in output_buffer:
-		if 'A' not in universe[1]: #no alpha scum
-			try:
-				c_index = universe[1].index('C')
-			except ValueError:
-				c_index = None
-			try:
-				b_index = universe[1].index('B')
-			except ValueError:
-				b_index = None
-			if b_index is None:
-				universe[1][c_index] = 'A'
-			else:
-				universe[1][b_index] = 'A'
-				if c_index is not None:
-					universe[1][c_index] = 'B'
+	if qm_shared.is_vectorized(output_buffer):
+		output_buffer.promote_scum()
+	elif args.stream:
+		output_buffer.transform(promote_scum)
+	else:
+		for universe in output_buffer:
+			promote_scum(universe)
+	qm_shared.universes_changed(output_buffer)
 	
 	#possibly, reap masonries at this point
 	
@@ -223,10 +356,11 @@ def day():
 		qm_shared.write_masonry_file(existing_masonries, f"masonries-N{args.day}.txt")
 		
 	#now, write output universes
-	qm_shared.write_universe_file(output_buffer,  f"universes-N{args.day}.txt", updated_liveness, new_setup, qm_shared.pos_to_player(vote))
+	qm_shared.write_universe_file(output_buffer,  qm_shared.universe_file_name(f"N{args.day}"), updated_liveness, new_setup, qm_shared.pos_to_player(vote))
 	
 	print("All done!")	
 	print(f"*** NEXT (after sending DMs): RUN NIGHT.PY FOR NIGHT {args.day} ***")
+	return True
 	
 	#go through all universes. In universes where player is X, do nothing. In universes where player is E, add to E-buffer *UNLESS* we have seen our player as alive and non-E in at least one universe (we can throw out E-buffer in this case). Also skip if there is no entangler in the active setup.
 	#In universes where player is alive, mark as V and add to output buffer.
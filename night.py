@@ -1,18 +1,178 @@
 #!/usr/bin/env python3
 
-import argparse, random, qm_shared
+import argparse, random, qm_shared, qm_vector, qm_parallel, qm_cluster, qm_permutations, qm_combinatorics, qm_outcomes, qm_targets
 from sys import exit
 from os.path import exists
 from functools import cmp_to_key #for sorting
 
-def night():
+class NightkillDecisions:
+	#a universe's nightkill/guard/detective outcome only depends on where the alpha scum, detective and guard sit, and on the nightkill target's role. There are only a few thousand seatings against millions of universes, so we work the rules out once per seating and every other universe is a lookup.
+	def __init__(self, player_action_blocs, action_indexes, has_detective_right_now, has_guard_right_now):
+		self.player_action_blocs = player_action_blocs
+		self.scum_index, self.detective_index, self.guard_index = action_indexes
+		self.has_detective_right_now = has_detective_right_now
+		self.has_guard_right_now = has_guard_right_now
+		self.decisions = {}
+
+	def lookup(self, scum_pos, detective_pos, guard_pos): #positions are -1 when that role isn't in the universe. Returns the nightkill target's position and {target role: outcome}, or None if one of the actions has no target.
+		seating = (scum_pos, detective_pos, guard_pos)
+		if seating not in self.decisions:
+			self.decisions[seating] = self.decide(*seating)
+		return self.decisions[seating]
+
+	def action_target(self, player_idx, action_index): #None for '#'
+		target = self.player_action_blocs[player_idx][action_index]
+		return None if target == '#' else qm_shared.player_to_pos(target)
+
+	def decide(self, scum_pos, detective_pos, guard_pos):
+		#order of operations: scum kill goes first.
+		scum_target_index = self.action_target(scum_pos, self.scum_index)
+		if scum_target_index is None:
+			return None
+
+		guard_blocking_nk = False
+		guard_blocking_det = False
+
+		guard_target_index = None #no guard in this universe unless we find one
+		if self.has_guard_right_now and guard_pos >= 0:
+			guard_target_index = self.action_target(guard_pos, self.guard_index)
+			if guard_target_index is None:
+				return None
+			if scum_target_index == guard_target_index:
+				guard_blocking_nk = True
+
+		if self.has_detective_right_now and detective_pos >= 0:
+			det_target_index = self.action_target(detective_pos, self.detective_index)
+			if det_target_index is None:
+				return None
+			if self.has_guard_right_now and guard_target_index == det_target_index:
+				guard_blocking_det = True
+
+		outcomes = {} #anything not in here (V, or an unknown role) is a bad target
+		for scum_target_role in 'DFGTX': #we are assuming the guard cannot guard themself in the overall game rules, but we don't check for it anywhere in this program. You'll need to filter for it before entering actions into this program.
+			if guard_blocking_det and (scum_target_role != 'D' or guard_blocking_nk): #that is, if the detective is able to investigate while the guard blocks them, and the detective was not nightkilled...
+				outcomes[scum_target_role] = qm_vector.NK_DET_MEETS_GUARD #...then the universe collapses and we mulligan
+			elif guard_blocking_nk:
+				outcomes[scum_target_role] = qm_vector.NK_SURVIVES
+			else:
+				outcomes[scum_target_role] = qm_vector.NK_SURVIVES_KILLED #mark nightkill (does nothing if player already NKd in this universe)
+
+		if guard_blocking_det: #the investigation will always start because scum didn't nk the detective
+			outcomes['E'] = qm_vector.NK_DET_MEETS_GUARD
+		elif guard_blocking_nk: #it's an edge case. There is one universe where the nightkill did not kill the entangler, so that's good enough for quantum immortality!
+			outcomes['E'] = qm_vector.NK_SURVIVES
+		else:
+			outcomes['E'] = qm_vector.NK_HITS_ENTANGLER
+
+		for scum_target_role in qm_permutations.SCUM_ROLES: #scum targeting other scum - impossible - universe collapses - guard targeting does _not_ affect this because mafia couldn't target other mafia in the first place
+			outcomes[scum_target_role] = qm_vector.NK_SCUM_TARGETS_SCUM
+		return scum_target_index, outcomes
+
+def bad_nightkill_target(scum_target_role): #will exit
+	if scum_target_role == '#':
+		qm_shared.player_to_pos(scum_target_role) #an action with no target
+	if scum_target_role == 'V':
+		print("A scum player tried to target someone voted out. This should have been caught earlier and rejected.")
+		exit()
+	print(f"A scum player targeted someone with an unknown role ({scum_target_role}). Please check that everything is correctly set up.")
+	exit()
+
+def nightkill_pass(universe_file, player_action_blocs, action_indexes, has_detective_right_now, has_guard_right_now, num_players, vectorized=False, stream=False, workers=1, cluster=None): #the scum kill, guard and detective in every universe, collapsing the ones where they clash. Returns the surviving universes, the collapse counts, and their LivenessCounters (or None - see below).
+	#the surviving universes are counted as they're made, so the cascade, role settling, victory check and entangler tiebreaker after this don't each scan them again. Not the vectorized ones, which are quick to count when they're needed.
+	decisions = NightkillDecisions(player_action_blocs, action_indexes, has_detective_right_now, has_guard_right_now)
+	counters = None if vectorized else qm_shared.LivenessCounters()
+	if vectorized:
+		universes_collapsed = [0, 0, 0] #nightkill scum, nightkill entangler, det-guard - same order as the qm_vector.NK_* collapse outcomes
+		output_buffer, entangler_subsidiary_buffer, bad_target = qm_vector.nightkill_pass(universe_file, decisions.lookup, universes_collapsed, qm_shared.universe_chunk_size)
+	elif workers > 1 or cluster is not None:
+		output_buffer, entangler_subsidiary_buffer, universes_collapsed, bad_target = qm_parallel.sharded_pass(universe_file, nightkill_universes, (decisions,), 3, workers, num_players, stream, cluster, [counters])
+	else:
+		output_buffer = qm_shared.new_universe_buffer(num_players, stream=stream)
+		entangler_subsidiary_buffer = qm_shared.new_universe_buffer(num_players, stream=stream)
+		universes_collapsed = [0, 0, 0]
+		bad_target = nightkill_universes(universe_file.universes(), decisions, qm_shared.CountedBuffer(output_buffer, [counters]), entangler_subsidiary_buffer, universes_collapsed)
+	if bad_target is not None:
+		bad_nightkill_target(bad_target)
+
+	if len(output_buffer) == 0:
+		if len(entangler_subsidiary_buffer) == 0:
+			qm_shared.paradox("nightkill/investigation") #will exit
+		output_buffer = entangler_subsidiary_buffer
+		counters = None #we only counted the main output
+		print("It is my sad duty to announce that the Entangler has been killed in every surviving universe.")
+	else:	
+		#print(f"Marking {len(entangler_subsidiary_buffer)} dead-entangler universes as collapsed.")
+		universes_collapsed[1] += len(entangler_subsidiary_buffer)
+	del entangler_subsidiary_buffer #maybe reclaim memory space
+	if counters is not None:
+		counters.universe_buffer = output_buffer
+	return output_buffer, universes_collapsed, counters
+
+def nightkill_universes(universes, decisions, output_buffer, entangler_subsidiary_buffer, universes_collapsed): #the nightkill pass proper, over any run of universes. Returns the first bad nightkill target ('#' or its role), stopping there, or None.
+	nk_hit_nonentangler_in_some_universe = False
+
+	#track scum action
+	for universe_chunk in universes:
+		universe = universe_chunk[1]
+		decision = decisions.lookup(universe.index('A'), universe.find('D'), universe.find('G'))
+		if decision is None:
+			return '#'
+		scum_target_index, outcomes = decision
+		scum_target_role = universe[scum_target_index] #that is, the role of the player who is the NK target
+		outcome = outcomes.get(scum_target_role, qm_vector.NK_BAD_TARGET)
+
+		if outcome == qm_vector.NK_SURVIVES or outcome == qm_vector.NK_SURVIVES_KILLED:
+			nk_hit_nonentangler_in_some_universe = True
+			universe_to_transform = [*universe]
+			if outcome == qm_vector.NK_SURVIVES_KILLED:
+				universe_to_transform[scum_target_index] = 'X'
+			output_buffer.append([universe_chunk[0],universe_to_transform]) #copy to out
+		elif outcome == qm_vector.NK_HITS_ENTANGLER:
+			if not nk_hit_nonentangler_in_some_universe:
+				#print(f"Universe {universe_chunk} moved to entangler subsidiary list as nightkill hits entangler.")
+				universe_to_transform = [*universe]
+				universe_to_transform[scum_target_index] = 'X' #mark nightkill (exigent)
+				entangler_subsidiary_buffer.append([universe_chunk[0],universe_to_transform])
+			else:
+				#print(f"Universe {universe_chunk} collapses as nightkill hits entangler.") #debug
+				universes_collapsed[1] += 1
+		elif outcome == qm_vector.NK_BAD_TARGET:
+			return scum_target_role
+		else:
+			universes_collapsed[outcome] += 1 #scum targets scum, or detective meets guard
+	return None
+
+def write_night_outcomes(night_num, output_buffer, universe_filename, player_liveness, player_liveness_then, nightkill_requests, detective_requests, guard_requests): #tallies the night's results over the surviving universes for print_dms.py (see qm_outcomes.py)
+	tally = qm_outcomes.DayTally(player_liveness, player_liveness_then, False, qm_outcomes.request_positions(nightkill_requests), qm_outcomes.request_positions(detective_requests), qm_outcomes.request_positions(guard_requests))
+	universe_then_file = qm_shared.UniverseFile(qm_shared.find_universe_file(f"N{night_num}"))
+	for universe_now, universe_then in qm_outcomes.join_universes(output_buffer, universe_then_file):
+		tally.count(universe_now, universe_then)
+	universe_then_file.close()
+	qm_outcomes.write_night_outcomes(universe_filename, tally, len(output_buffer))
+
+def night(argv=None): #argv is the command line arguments, if not sys.argv's (see run_phase.py). Returns whether it wrote the next day's phase file, like day() does.
 	parser = argparse.ArgumentParser(
 						prog='Quantumafia Night Processor',
 						description='This processes the end-of-night transition in a match of Quantumafia.')
 					
 	parser.add_argument('night', type=int, help="Indicates which game night (0, 1, 2, 3...) is to be transitioned. In Night 0, only entangler actions are considered")
 	parser.add_argument('actions', help="A string of actions for each player, in the order [scum][detective][entangler][follower][guard], then different players separated by dashes in unrandomized roster order. Remove sections of that that aren't currently present in the game at ALL (if detective is dead remove the detective section, etc). Sample string will look like EGHNA-BBCDB-ANTQL-... or E-N-B-D-H on N0 when only entangler. If a particular player doesn't have a role that place in the string, that place will be ignored.")
-	args = parser.parse_args()
+	buffer_mode = parser.add_mutually_exclusive_group()
+	buffer_mode.add_argument('--vectorized', action='store_true', help="Hold the surviving universes in a numpy matrix instead of a Python list, and resolve the nightkill, guard and detective for a whole chunk of universes at once. Much less memory and a much faster night on big games. Needs numpy.")
+	buffer_mode.add_argument('--stream', action='store_true', help="Spill the surviving universes to a temporary file in the current directory and process them a chunk at a time, so memory use stays flat no matter how big the game is. Slower, but it won't run out of RAM.")
+	parser.add_argument('--checkpoint', action='store_true', help="Save a checkpoint after each stage of the transition (the nightkill pass, each round of flips, the liveness transformation), so an interrupted run can be picked up with --resume. Each checkpoint is a full copy of the surviving universes, written and synced to disk before the phase file is - on a set of gigabytes, that's several extra writes of that size per run, so it's off unless asked for.")
+	parser.add_argument('--resume', action='store_true', help="Pick up from the last checkpoint of an interrupted --checkpoint run of this night, instead of starting over. Use the same night and actions arguments as before. It carries on checkpointing.")
+	parser.add_argument('--chunk-size', type=int, default=qm_shared.universe_chunk_size, help=f"How many universes to read or process at a time (default {qm_shared.universe_chunk_size}).")
+	parser.add_argument('--workers', type=int, default=1, help="Split the nightkill pass across this many worker processes, each taking a range of the universe file. The results are the same as a single process run. Can't be combined with --vectorized.")
+	parser.add_argument('--cluster', type=qm_cluster.cluster_addresses, help="Like --workers, but run the nightkill pass on cluster workers (qm_cluster.py): a comma separated list of their host:port or socket path addresses. They need this game's directory at the same path, e.g. on a shared filesystem. Can't be combined with --vectorized.")
+	parser.add_argument('--yes', action='store_true', help="Don't wait for ENTER before transforming the universes, e.g. when run_phase.py or a script is driving the night.")
+	args = parser.parse_args(argv)
+	if args.vectorized:
+		qm_vector.require_numpy()
+	if (args.workers > 1 or args.cluster is not None) and args.vectorized:
+		print("--workers and --cluster can't be used with --vectorized. Pick one.")
+		exit()
+	qm_shared.universe_chunk_size = args.chunk_size
 	
 	#further arg parsing will be required - but first, load game info
 	#also check if output files	
@@ -59,8 +219,8 @@ def night():
 		print(f"The masonries file I'd have to write to, masonries-D{args.night+1}.txt, already exists. Delete the old file if you want me to overwrite it.")
 		exit()
 	
-	if not entangler_only and exists(f"universes-D{args.night+1}.txt"):
-		print(f"The universe file I'd have to write to, universes-D{args.night+1}.txt, already exists. Delete the old file if you want me to overwrite it.")
+	if not entangler_only and qm_shared.universe_file_exists(f"D{args.night+1}"):
+		print(f"The universe file I'd have to write to, {qm_shared.universe_file_name(f'D{args.night+1}')}, already exists. Delete the old file if you want me to overwrite it.")
 		exit()
 	
 	if entangler_only and exists("actions-D1.txt"):
@@ -119,6 +279,7 @@ def night():
 	
 	#STEP -1: PARSE OUT EVERYONE'S REQUESTS.
 	
+	nightkill_requests = detective_requests = follower_requests = guard_requests = None #only the roles still in the game get requests
 	if entangler_only:
 		entangler_index = 0
 	else:
@@ -155,183 +316,113 @@ def night():
 	if not entangler_only:
 	
 		universe_file = qm_shared.get_universe_file(args.night, False) #should return existing file pointer
-		universe_file.seek(0)
-		universe_file.readline() #skip 4 lines to get to actual universes
-		universe_file.readline()
-		universe_file.readline()
-		universe_file.readline()
-	
-		target_checking = []
-		targets_to_check = 0
-		for idx in range(num_players):
-			next_target_block = {}
-			if player_liveness[idx][1] == '#': #we're relying on the input to be correctly formatted, that is: that if a player isn't a role their submission for that role won't be recorded. If this does not hold true, it'll still work properly, just we'll have to check every universe when we may not necessarily have to.
-				this_player_bloc = player_action_blocs[idx]
-				if this_player_bloc[scum_index] != '#':
-					next_target_block['A'] = this_player_bloc[scum_index]
-					targets_to_check += 1
-				if has_detective_right_now and this_player_bloc[detective_index] != '#':
-					next_target_block['D'] = this_player_bloc[detective_index]
-					targets_to_check += 1
-				if has_guard_right_now and this_player_bloc[guard_index] != '#':
-					next_target_block['G'] = this_player_bloc[guard_index]
-					targets_to_check += 1
-		
-			target_checking.append(next_target_block)	
-		
-		#now go universe by universe
-		for _ in range(num_universes):
-			if targets_to_check <= 0:
-				break
-		
-			next_universe = qm_shared.parse_universe(universe_file.readline())[1] #get second half of universe - the part with the letters	
-			#check scum
-			thisuni_scum_index = next_universe.index('A')
-			if 'A' in target_checking[thisuni_scum_index]:
-				#find scum target
-				if next_universe[qm_shared.player_to_pos(target_checking[thisuni_scum_index]['A'])] not in 'XV': #i.e. if not dead, or voted out...
-					del target_checking[thisuni_scum_index]['A']
-					targets_to_check -= 1
-			if has_detective_right_now and 'D' in next_universe:
-				thisuni_det_index = next_universe.index('D')
-				if 'D' in target_checking[thisuni_det_index]:
-					#find det target
-					if next_universe[qm_shared.player_to_pos(target_checking[thisuni_det_index]['D'])] not in 'XV':
-						del target_checking[thisuni_det_index]['D']
-						targets_to_check -= 1
-			if has_guard_right_now and 'G' in next_universe:
-				thisuni_guard_index = next_universe.index('G')
-				if 'G' in target_checking[thisuni_guard_index]:
-					#find guard target
-					if next_universe[qm_shared.player_to_pos(target_checking[thisuni_guard_index]['G'])] not in 'XV':
-						del target_checking[thisuni_guard_index]['G']
-						targets_to_check -= 1
-		
-			
-		if targets_to_check > 0:
-			print("Uh-oh. Some players are targeting other players who are dead in every universe where the first player holds a role. They are:")
-			for idx, player_targets in enumerate(target_checking):
-				for (key, value) in player_targets.items():
-					print(f"{player_names[idx]} {('nightkilling' if key == 'A' else ('investigating' if key == 'D' else ('guarding' if key == 'G' else 'ERROR!!!!!')))} {player_names[qm_shared.player_to_pos(value)]}.")
-			exit()
-		
-		else:
-			print("Targets validated. Ready!")
-			input("Press ENTER to begin transforming universes.")
 	
+		if args.checkpoint or args.resume:
+			qm_shared.checkpoint_phase = f"N{args.night}"
+			qm_shared.checkpoint_args = ["night", args.night, args.actions]
+	
+		pass_counters = None #a resumed run counts the universes when it needs to, like before the fused pass
+		if args.resume:
+			checkpoint, output_buffer = qm_shared.load_checkpoint(f"N{args.night}", ["night", args.night, args.actions], args.vectorized, args.stream)
+		else:
+			checkpoint = None
+	
+			target_checking = []
+			targets_to_check = 0
+			for idx in range(num_players):
+				next_target_block = {}
+				if player_liveness[idx][1] == '#': #we're relying on the input to be correctly formatted, that is: that if a player isn't a role their submission for that role won't be recorded. If this does not hold true, it'll still work properly, just we'll have to check every universe when we may not necessarily have to.
+					this_player_bloc = player_action_blocs[idx]
+					if this_player_bloc[scum_index] != '#':
+						next_target_block['A'] = this_player_bloc[scum_index]
+						targets_to_check += 1
+					if has_detective_right_now and this_player_bloc[detective_index] != '#':
+						next_target_block['D'] = this_player_bloc[detective_index]
+						targets_to_check += 1
+					if has_guard_right_now and this_player_bloc[guard_index] != '#':
+						next_target_block['G'] = this_player_bloc[guard_index]
+						targets_to_check += 1
 		
-		#1. The Guard and Follower take up their positions, if they are alive.	
-		#(we already determined follower, detective, and guard requests tbh)
-	
-		#before we continue, though, we need to track results for each player.
-		#results are of the form:
-		#[death_results, scum_result, detective_result, entangler_result, follower_result, guard_result, town_result]
-		#death_results: an array indicating the number of times you died last night broken down by who you were:
-			#[died_as_town, died_as_detective, died_as_entangler
-		# note that all of these can be determined by scanning the list later EXCEPT the 'died when', as that requires the previous => next state change.
-		# maybe we just leave all of it to the DM generator?
-		# 
-		# post night dm format = "Last night, # universes collapsed. In the remaining #:"  #measure this by new univcount vs old univcount
-		# "You died in # universes. You were the detective in #, the entangler in #
-		universe_file.seek(0)		
-		universe_file.readline() #skip 4 lines to get to actual universes
-		universe_file.readline()
-		universe_file.readline()
-		universe_file.readline()
-	
-		output_buffer = []
-		entangler_subsidiary_buffer = []
-		nk_hit_nonentangler_in_some_universe = False
-	
-		universes_collapsed = [0, 0, 0] #nightkill scum, nightkill entangler, det-guard
-	
-		#track scum action
-		for _ in range(num_universes):
-			universe_chunk = qm_shared.parse_universe(universe_file.readline())
-			universe = universe_chunk[1]
-			universe_to_transform = [*universe]
-		
-			#order of operations: scum kill goes first.
-			thisuni_scum_index = universe.index('A')
-			scum_target_index = qm_shared.player_to_pos(player_action_blocs[thisuni_scum_index][scum_index])
-			scum_target_role = universe[scum_target_index] #that is, the role of the player who is the NK target
-			is_nking_entangler = False
-		
-			guard_blocking_nk = False
-			guard_blocking_det = False
+				target_checking.append(next_target_block)	
 		
-			if has_guard_right_now and 'G' in universe:
-				thisuni_guard_index = universe.index('G')
-				guard_target_index = qm_shared.player_to_pos(player_action_blocs[thisuni_guard_index][guard_index])
-				if scum_target_index ==  guard_target_index:
-					guard_blocking_nk = True
+			matrix = qm_targets.saved_target_matrix(universe_file) #if check_night_targets.py has worked it out, the answers are all in there
+			if matrix is not None:
+				for idx, player_targets in enumerate(target_checking):
+					for role, target in list(player_targets.items()):
+						if qm_targets.target_valid(matrix, idx, role, qm_shared.player_to_pos(target)):
+							del player_targets[role]
+							targets_to_check -= 1
+			else:
+				#now go universe by universe
+				for _, next_universe in universe_file.universes(): #we only need the second half of universe - the part with the letters
+					if targets_to_check <= 0:
+						break
 		
-			if has_detective_right_now and 'D' in universe:
-				thisuni_det_index = universe.index('D')
-				det_target_index = qm_shared.player_to_pos(player_action_blocs[thisuni_det_index][detective_index])
-				if has_guard_right_now and guard_target_index ==  det_target_index:
-					guard_blocking_det = True
-
-			if scum_target_role in 'DFGTX': #we are assuming the guard cannot guard themself in the overall game rules, but we don't check for it anywhere in this program. You'll need to filter for it before entering actions into this program.
-				if guard_blocking_det and (scum_target_role != 'D' or guard_blocking_nk): #that is, if the detective is able to investigate while the guard blocks them, and the detective was not nightkilled...
-					#print(f"Universe {universe_chunk} collapses as detective meets guard.") #debug
-					universes_collapsed[2] += 1
-					continue #...then the universe collapses and we mulligan
-				
-				nk_hit_nonentangler_in_some_universe = True
-				if not guard_blocking_nk:
-					universe_to_transform[scum_target_index] = 'X' #mark nightkill (does nothing if player already NKd in this universe)
-				output_buffer.append([universe_chunk[0],universe_to_transform]) #copy to out
-				continue
-	
-			if scum_target_role == 'E':
-				if guard_blocking_det: #the investigation will always start because scum didn't nk the detective
-					#print(f"Universe {universe_chunk} collapses as detective meets guard. (E)") #debug
-					universes_collapsed[2] += 1
-					continue #this universe collapses, never mind
-				elif guard_blocking_nk:
-					nk_hit_nonentangler_in_some_universe = True #it's an edge case. There is one universe where the nightkill did not kill the entangler, so that's good enough for quantum immortality!
-					output_buffer.append([universe_chunk[0],universe_to_transform]) #add to normal list
-					continue
-			
-				if not nk_hit_nonentangler_in_some_universe:
-					#print(f"Universe {universe_chunk} moved to entangler subsidiary list as nightkill hits entangler.")
-					universe_to_transform[scum_target_index] = 'X' #mark nightkill (exigent)
-					entangler_subsidiary_buffer.append([universe_chunk[0],universe_to_transform])
-				else:
-					#print(f"Universe {universe_chunk} collapses as nightkill hits entangler.") #debug
-					universes_collapsed[1] += 1
-				continue
+					#check scum
+					thisuni_scum_index = next_universe.index('A')
+					if 'A' in target_checking[thisuni_scum_index]:
+						#find scum target
+						if next_universe[qm_shared.player_to_pos(target_checking[thisuni_scum_index]['A'])] not in 'XV': #i.e. if not dead, or voted out...
+							del target_checking[thisuni_scum_index]['A']
+							targets_to_check -= 1
+					if has_detective_right_now and 'D' in next_universe:
+						thisuni_det_index = next_universe.index('D')
+						if 'D' in target_checking[thisuni_det_index]:
+							#find det target
+							if next_universe[qm_shared.player_to_pos(target_checking[thisuni_det_index]['D'])] not in 'XV':
+								del target_checking[thisuni_det_index]['D']
+								targets_to_check -= 1
+					if has_guard_right_now and 'G' in next_universe:
+						thisuni_guard_index = next_universe.index('G')
+						if 'G' in target_checking[thisuni_guard_index]:
+							#find guard target
+							if next_universe[qm_shared.player_to_pos(target_checking[thisuni_guard_index]['G'])] not in 'XV':
+								del target_checking[thisuni_guard_index]['G']
+								targets_to_check -= 1
 		
-			if scum_target_role in 'ABC': #scum targeting other scum - impossible - universe collapses - guard targeting does _not_ affect this because mafia couldn't target other mafia in the first place
-				#print(f"Universe {universe_chunk} collapses as scum targets other scum.") #debug - this happens before the other collapse notifs
-				universes_collapsed[0] += 1
-				continue	
 			
-			if scum_target_role == 'V':
-				print("A scum player tried to target someone voted out. This should have been caught earlier and rejected.")
+			if targets_to_check > 0:
+				print("Uh-oh. Some players are targeting other players who are dead in every universe where the first player holds a role. They are:")
+				for idx, player_targets in enumerate(target_checking):
+					for (key, value) in player_targets.items():
+						print(f"{player_names[idx]} {('nightkilling' if key == 'A' else ('investigating' if key == 'D' else ('guarding' if key == 'G' else 'ERROR!!!!!')))} {player_names[qm_shared.player_to_pos(value)]}.")
 				exit()
 		
-			print(f"A scum player targeted someone with an unknown role ({scum_target_role}). Please check that everything is correctly set up.")
-			exit()
-
-		if len(output_buffer) == 0:
-			if len(entangler_subsidiary_buffer) == 0:
-				qm_shared.paradox("nightkill/investigation") #will exit
-			output_buffer = entangler_subsidiary_buffer
-			print("It is my sad duty to announce that the Entangler has been killed in every surviving universe.")
-		else:	
-			#print(f"Marking {len(entangler_subsidiary_buffer)} dead-entangler universes as collapsed.")
-			universes_collapsed[1] += len(entangler_subsidiary_buffer)
-		del entangler_subsidiary_buffer #maybe reclaim memory space
-	
-		print("Nightkill phase complete. {} universes collapsed in the phase ({} scum target scum, {} entangler immortality, {} detective meets guard).".format(sum(universes_collapsed),*universes_collapsed))
+			else:
+				print("Targets validated. Ready!")
+				if not args.yes:
+					input("Press ENTER to begin transforming universes.")
+	
+		
+			#1. The Guard and Follower take up their positions, if they are alive.	
+			#(we already determined follower, detective, and guard requests tbh)
+	
+			#before we continue, though, we need to track results for each player.
+			#results are of the form:
+			#[death_results, scum_result, detective_result, entangler_result, follower_result, guard_result, town_result]
+			#death_results: an array indicating the number of times you died last night broken down by who you were:
+				#[died_as_town, died_as_detective, died_as_entangler
+			# note that all of these can be determined by scanning the list later EXCEPT the 'died when', as that requires the previous => next state change.
+			# maybe we just leave all of it to the DM generator?
+			# 
+			# post night dm format = "Last night, # universes collapsed. In the remaining #:"  #measure this by new univcount vs old univcount
+			# "You died in # universes. You were the detective in #, the entangler in #
+			output_buffer, universes_collapsed, pass_counters = nightkill_pass(universe_file, player_action_blocs, (scum_index, detective_index, guard_index), has_detective_right_now, has_guard_right_now, num_players, args.vectorized, args.stream, args.workers, args.cluster)
+	
+			print("Nightkill phase complete. {} universes collapsed in the phase ({} scum target scum, {} entangler immortality, {} detective meets guard).".format(sum(universes_collapsed),*universes_collapsed))
+			qm_shared.save_checkpoint("nightkill", output_buffer)
 	
 		#so now we've done steps 1-3. Now we check for deadness and flip if need be. This is done by [S] Cascade.
-		updated_liveness = qm_shared.cascade(output_buffer, player_liveness)
+		if checkpoint is not None and checkpoint['stage'] == "transform":
+			qm_shared.flip_setup() #cascade would normally do this. We'll need it for writing.
+			updated_liveness = checkpoint['liveness']
+		else:
+			resuming_cascade = checkpoint is not None and checkpoint['stage'] == "cascade"
+			updated_liveness = qm_shared.cascade(output_buffer, checkpoint['liveness'] if resuming_cascade else player_liveness, counters=pass_counters)
 
-		#we will also need to update liveness again for 100% roles.
-		updated_liveness = qm_shared.transform_liveness_roles(output_buffer, updated_liveness)
+			#we will also need to update liveness again for 100% roles.
+			updated_liveness = qm_shared.transform_liveness_roles(output_buffer, updated_liveness)
+			qm_shared.save_checkpoint("transform", output_buffer, liveness=updated_liveness)
 		qm_shared.close_universe_file()
 	
 		#we also need to update current_setup.
@@ -368,10 +459,11 @@ def night():
 		#for a scum victory to be declared, if N scum survive, there must be at most N-1 other players - in every surviving universe.
 		#we do not need to check for a draw or town victory at night, as scum can't die here, and both of those conditions occur when the last scum dies. (this works because nothing can stop a vote so scum are never alive in some universes as scum and dead in others as scum)
 	
-		qm_shared.check_scum_victory(output_buffer, num_scum_left)
+		qm_shared.check_scum_victory(output_buffer, num_scum_left, updated_liveness, new_setup)
 		#possible cases: 
 			#all scum determinate: "The surviving scum players, #, #, and #, have won.
 			#most scum determinate 1 indeterminate 
+		player_liveness_then = player_liveness #for the night outcomes
 		player_liveness = updated_liveness #we'll need this for the entangler calculations in a moment
 		current_setup = new_setup #and we'll need this for writing the universe file
 	# ### NOT ENTANGLER_ONLY BLOCK ENDS HERE
@@ -406,17 +498,17 @@ def night():
 			entangler_request_list[request_idx][2].append(idx) #note requesting entangler
 
 		#now we need to compute the other two tie breakers: number of masonries currently in, and number of universes currently in.
-		#if night == 0, we skip the number-of-universes tiebreaker, as it's a bear to compute AND we don't have access to the universe list.
+		#if night == 0, we don't have the universe list - but it's the whole D1 set, so the number-of-universes tiebreaker can be counted rather than scanned.
 		for masonry in existing_masonries:
 			entangler_request_list[masonry[0]][1] += 1
 			entangler_request_list[masonry[1]][1] += 1
 		
-		if args.night != 0: #universes tiebreaker	
-			for universe in output_buffer:
-				for idx, player in enumerate(universe[1]):
-					if player in 'XV': 
-						continue
-					entangler_request_list[idx][3] += 1
+		if args.night == 0: #universes tiebreaker
+			for idx, alive_count in enumerate(qm_combinatorics.alive_counts(num_players, qm_permutations.power_roles(game_setup))):
+				entangler_request_list[idx][3] += alive_count
+		else:
+			for idx, alive_count in enumerate(qm_shared.alive_counts(output_buffer)):
+				entangler_request_list[idx][3] += alive_count
 		#OK, all done. Now we sort the list.
 		entangler_request_list = [x for x in entangler_request_list if x[0] and len(x[2]) > 0] #remove invalid option
 		entangler_request_list.sort(key=cmp_to_key(compare_masonry_objects))
@@ -515,7 +607,9 @@ def night():
 
 	if not entangler_only:
 		print(f"Writing {len(output_buffer)} universe(s) to universe file...")
-		qm_shared.write_universe_file(output_buffer,  f"universes-D{args.night+1}.txt", player_liveness, current_setup, args.actions)
+		qm_shared.write_universe_file(output_buffer,  qm_shared.universe_file_name(f"D{args.night+1}"), player_liveness, current_setup, args.actions)
+		print("Writing night outcomes for the DMs...")
+		write_night_outcomes(args.night, output_buffer, qm_shared.universe_file_name(f"D{args.night+1}"), player_liveness, player_liveness_then, nightkill_requests, detective_requests, guard_requests)
 	else:
 		print(f"Writing supplementary actions file.")
 		with open("actions-D1.txt", 'x') as actionfile:
@@ -527,6 +621,7 @@ def night():
 		
 	print("All done!")	
 	print(f"*** NEXT (after sending DMs): RUN DAY.PY FOR DAY {args.night+1} ***")
+	return True
 	
 	
 	#for later - if a NK would kill an entangler, they can't have been the entangler, so mark those universes as contradictory (collapse them).
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import argparse, qm_shared, os, mmap
+import argparse, qm_shared, qm_parallel, qm_cluster, qm_permutations, qm_combinatorics, qm_outcomes
 from sys import exit
 
 masonries_now = None
@@ -60,17 +60,80 @@ def and_or_all(counts, terms, include_percents=False, override_total=None):
 		return output # "scum in #, the detective in #, and vanilla town in #"
 	return "ERROR!"
 
-def read_to_universe_with_id(universe_file, target_id):
-	while True:
-		line = universe_file.readline()
-		if len(line) == 0:
-			return None #give up
-		universe = qm_shared.parse_universe(line)
-		if int(universe[0]) == target_id:
-			return universe
-		elif int(universe[0]) > target_id:
-			print("Warning: Skipped target universe in read-to.")
-			return #give up
+def scale_counts(counts, multiplicity): #counts/results lists (None for dead players) from a canonical set, scaled up to the full set
+	return [scale_counts(item, multiplicity) if isinstance(item, list) else (item * multiplicity if item is not None else None) for item in counts]
+
+class NightTally: #night mode's per-player role counts. Sums, so they merge like DayTally's do.
+	def __init__(self, player_liveness):
+		self.counts = [[0,[0,0],0,0,0,0,0] if item[1] == '#' else None for item in player_liveness] #dead, [alpha scum, backup scum], det, ent, follower, guard, town
+		self.live_indexes = [idx for idx, item in enumerate(player_liveness) if item[1] == '#']
+
+	def add_role_counts(self, role_counts): #see DayTally. Also takes the phase file's statistics, which can have dead players.
+		for player_idx in self.live_indexes:
+			player_roles = role_counts[player_idx]
+			self.counts[player_idx][0] += player_roles.get('X', 0) + player_roles.get('V', 0)
+			self.counts[player_idx][1][0] += player_roles.get('A', 0)
+			self.counts[player_idx][1][1] += sum(player_roles.get(role, 0) for role in qm_permutations.SCUM_ROLES[1:])
+			for counts_idx, role in enumerate('DEFGT', start=2):
+				self.counts[player_idx][counts_idx] += player_roles.get(role, 0)
+
+	def count(self, universe_now, universe_then=None):
+		for player_idx in self.live_indexes:
+			role = universe_now[player_idx]
+			if role in 'XV':
+				self.counts[player_idx][0] += 1
+				continue
+			if role == 'A':
+				self.counts[player_idx][1][0] += 1
+				continue
+			if role in qm_permutations.SCUM_ROLES[1:]:
+				self.counts[player_idx][1][1] += 1
+				continue
+			if role == 'D':
+				self.counts[player_idx][2] += 1
+				continue
+			if role == 'E':
+				self.counts[player_idx][3] += 1
+				continue
+			if role == 'F':
+				self.counts[player_idx][4] += 1
+				continue
+			if role == 'G':
+				self.counts[player_idx][5] += 1
+				continue
+			if role == 'T':
+				self.counts[player_idx][6] += 1
+				continue
+
+	def merge(self, other):
+		self.counts = qm_outcomes.merge_tallies(self.counts, other.counts)
+
+def count_universes(tally, universe_now_file, universe_then_file=None, start=0, stop=None): #tallies universe records [start, stop) of the 'now' file, each joined to the same universe in the 'then' file if there is one
+	universes_now = universe_now_file.universes(start, stop)
+	if universe_then_file is None: #D1: no previous universe to go back to
+		for _, universe_now in universes_now:
+			tally.count(universe_now, universe_now)
+		return
+	for universe_now, universe_then in qm_outcomes.join_universes(universes_now, universe_then_file):
+		tally.count(universe_now, universe_then)
+
+def count_shard(shard): #runs in a --workers process
+	tally, now_filename, then_filename, start, stop = shard
+	universe_now_file = qm_shared.UniverseFile(now_filename)
+	universe_then_file = qm_shared.UniverseFile(then_filename) if then_filename is not None else None
+	count_universes(tally, universe_now_file, universe_then_file, start, stop)
+	universe_now_file.close()
+	if universe_then_file is not None:
+		universe_then_file.close()
+	return tally
+
+def count_all_universes(tally, universe_now_file, universe_then_file, workers, cluster=None): #the counting pass, split across worker processes (or cluster workers) if asked. tally must be fresh.
+	if workers <= 1 and cluster is None:
+		count_universes(tally, universe_now_file, universe_then_file)
+		return
+	shards = [(tally, universe_now_file.filename, universe_then_file.filename if universe_then_file is not None else None, start, stop) for start, stop in qm_parallel.shard_ranges(universe_now_file.num_universes, workers if cluster is None else len(cluster))]
+	for shard_tally in qm_parallel.map_shards(count_shard, shards, workers, cluster):
+		tally.merge(shard_tally)
 
 def read_masonry_differences():
 	global args
@@ -216,7 +279,7 @@ def print_codeword(player_idx):
 	print()
 	print(f"Remember, your codeword is {qm_shared.get_player_codeword(player_idx)}.")
 
-def print_dms():
+def print_dms(argv=None): #argv is the command line arguments, if not sys.argv's (see run_phase.py)
 	global args, masonries_now
 	parser = argparse.ArgumentParser(
 		prog='Quantumafia DM Printer',
@@ -224,7 +287,11 @@ def print_dms():
 					
 	parser.add_argument('daynight', help="Either 'day' or 'night', without quotes. Indicates whether to print start-of-day or start-of-night PMs.")
 	parser.add_argument('num', type=int, help="The day (or night) to print DMs for.")
-	args = parser.parse_args()
+	parser.add_argument('--workers', type=int, default=1, help="Split the counting pass over the universe file across this many worker processes. The DMs come out the same.")
+	parser.add_argument('--chunk-size', type=int, default=qm_shared.universe_chunk_size, help=f"How many universes to read at a time, and the smallest share of the file a worker gets (default {qm_shared.universe_chunk_size}).")
+	parser.add_argument('--cluster', type=qm_cluster.cluster_addresses, help="Run the counting pass on cluster workers (qm_cluster.py) instead of here: a comma separated list of their host:port or socket path addresses. They need this game's directory at the same path, e.g. on a shared filesystem.")
+	args = parser.parse_args(argv)
+	qm_shared.universe_chunk_size = args.chunk_size
 	
 	is_day = None
 	if args.daynight == 'day':
@@ -237,17 +304,14 @@ def print_dms():
 	
 	
 	if not is_day and args.num == 0:
-		universe_now_filedesc = os.open(f"universes-D1.txt", os.O_RDONLY) #if N0, read D1 anyway
-		universe_now_file = mmap.mmap(universe_now_filedesc, 0, access=mmap.ACCESS_READ)
+		universe_now_file = qm_shared.UniverseFile(qm_shared.find_universe_file("D1")) #if N0, read D1 anyway
 	else:
-		universe_now_filedesc = os.open(f"universes-{'D' if is_day else 'N'}{args.num}.txt", os.O_RDONLY)	#NOT the same as regular open()
-		universe_now_file = mmap.mmap(universe_now_filedesc, 0, access=mmap.ACCESS_READ)
+		universe_now_file = qm_shared.UniverseFile(qm_shared.find_universe_file(qm_shared.phase_name(args.num, is_day)))
 	
 	
 	if not ((is_day and args.num == 1) or (not is_day and args.num == 0)):
 		#no 'then' file if N0/D1
-		universe_then_filedesc = os.open(f"universes-{'N' if is_day else 'D'}{args.num - (1 if is_day else 0)}.txt", os.O_RDONLY)	#NOT the same as regular open()
-		universe_then_file = mmap.mmap(universe_then_filedesc, 0, access=mmap.ACCESS_READ)
+		universe_then_file = qm_shared.UniverseFile(qm_shared.find_universe_file(qm_shared.phase_name(args.num - (1 if is_day else 0), not is_day)))
 	else:
 		universe_then_file = None
 	
@@ -263,14 +327,11 @@ def print_dms():
 	has_follower = game_setup[4]
 	has_guard = game_setup[5]
 	
-	universe_now_file.seek(0)
-	current_setup_string = universe_now_file.readline().decode('utf-8').rstrip('\n')
-	setup_string_list = current_setup_string.split(sep="-", maxsplit=2)
-	current_setup = [int(setup_string_list[0]), int(setup_string_list[1]), *[char == '1' for char in setup_string_list[2]]] #num players, num mafia, detective, entangler, follower, guard
-	player_liveness_string = universe_now_file.readline().decode('utf-8').rstrip('\n')
-	player_liveness = [player_liveness_string[x*2:(x+1)*2] for x in range(num_players)]
-	num_universes = int(universe_now_file.readline().decode('utf-8').rstrip('\n'))
-	actions = universe_now_file.readline().decode('utf-8').rstrip('\n') #assume these are correct - were validated in night. Not used elsewhere.
+	current_setup = universe_now_file.setup #num players, num mafia, detective, entangler, follower, guard
+	player_liveness = universe_now_file.liveness[:num_players]
+	multiplicity = universe_now_file.multiplicity() #a canonical set is counted as if every ordering of the extra scum was there
+	num_universes = universe_now_file.num_universes * multiplicity
+	actions = universe_now_file.actions #assume these are correct - were validated in night. Not used elsewhere.
 	
 	if is_day and args.num == 1 and has_entangler:
 		with open("actions-D1.txt", 'r') as actionfile:
@@ -292,25 +353,19 @@ def print_dms():
 		has_follower_right_then = has_follower_right_now
 		has_guard_right_then = has_guard_right_now
 	else:
-		universe_then_file.seek(0)
 		#we need current setup before transition to be able to parse actions.
-		current_setup_string_then = universe_then_file.readline().decode('utf-8').rstrip('\n')
-		setup_string_list_then = current_setup_string_then.split(sep="-", maxsplit=2)
-		current_setup_then = [int(setup_string_list_then[0]), int(setup_string_list_then[1]), *[char == '1' for char in setup_string_list_then[2]]]
+		current_setup_then = universe_then_file.setup
 		has_detective_right_then = current_setup_then[2]
 		has_entangler_right_then = current_setup_then[3]
 		has_follower_right_then = current_setup_then[4]
 		has_guard_right_then = current_setup_then[5]
-		player_liveness_then_string = universe_then_file.readline().decode('utf-8').rstrip('\n')
-		player_liveness_then = [player_liveness_then_string[x*2:(x+1)*2] for x in range(num_players)]
-		num_universes_then = int(universe_then_file.readline().decode('utf-8').rstrip('\n'))
-		universe_then_file.readline() #skip actions string
+		player_liveness_then = universe_then_file.liveness[:num_players]
+		num_universes_then = universe_then_file.num_universes * universe_then_file.multiplicity()
 
 		num_universes_disappeared = num_universes_then - num_universes
 		
 		if not is_day:
 			universe_then_file.close() #clean up
-			os.close(universe_then_filedesc)
 	
 	#remember that liveness is two characters: first is role if 100%, second is liveness (# alive, X 100% dead, V voted out)
 	
@@ -327,6 +382,7 @@ def print_dms():
 		#parse player actions (same way as night.py. this could totally be more efficient but what-ever)
 		player_action_blocs = [st for st in actions.split(sep="-", maxsplit=num_players-1)]
 		
+		nightkill_requests = detective_requests = follower_requests = guard_requests = None #only the roles still in the game last night get requests
 		if not entangler_only:
 			scum_index = 0
 			detective_index = scum_index + (1 if has_detective_right_then else 0)
@@ -353,151 +409,28 @@ def print_dms():
 	
 	
 		#set up tracking lists
-		results = [[[0,0,0], [0,0,0,0,0], [0,0,0]] if item[1] == '#' else None for item in player_liveness] #scum results [success, already dead, fought off by guard], det results [town align, town power, entangler, scum, dead], guard results [no activity, fought off scum, target was already dead]
-		#entangler results are tracked separately by masonry, so we compute them later
-		#follower result matrix separate (tracking who visited who)
-		#follower stuff explained: the follower tracks when anyone VISITS another player. That's alpha scum doing a NK, guard taking up their position, and detective investigating.
-		#so we track for each living player, T/F for each of those modes. Then we can parse out who visited who and yield the results to anyone who asks and could have been follower during THEN.
-		follower_visits = [[False, False, False] if item[1] == '#' else None for item in player_liveness_then] #this tracks players actively visiting, not being visited. We boil that down later.
+		tally = qm_outcomes.DayTally(player_liveness, player_liveness_then, entangler_only, nightkill_requests, detective_requests, guard_requests)
 		who_visited_them = [[] if item[1] == '#' else None for item in player_liveness_then] #this tracks being visited.
-		can_have_been_entangler = [False for item in player_liveness]
-		can_have_been_follower = [False for item in player_liveness]
-		counts = [[[0,0,0,0,0],0,[0,0],0,0,0,0,0] if item[1] == '#' else None for item in player_liveness] #dead now as [det, ent, follower, guard, town], dead before, [alpha scum, backup scum], det, ent, follower, guard, town (can't die from nightkill as scum)
-		live_indexes_then = [idx for idx, item in enumerate(player_liveness_then) if item[1] == '#']
 		live_indexes = [idx for idx, item in enumerate(player_liveness) if item[1] == '#']
 		
-		for _ in range(num_universes):
-			universe_now_block = qm_shared.parse_universe(universe_now_file.readline())
-			universe_now = universe_now_block[1]
-			if universe_then_file is not None:
-				universe_then = read_to_universe_with_id(universe_then_file, int(universe_now_block[0]))[1]
-			else:
-				universe_then = universe_now #D1: no previous universe to go back to
-
-			for player_idx in live_indexes_then:
-				#so unlike the night version, we need to track BOTH the role count AND the result.
-				role = universe_now[player_idx]
-				if role in 'XV':
-					#dead. so did they JUST die?
-					#we don't bother to track results in this case, because if they died just now, obviously they were scum, they failed as the guard, and get no results as the detective.
-					role_then = universe_then[player_idx]
-					#this bit has guardrails. We need to track if the player was the guard last night, because then their visit is added to the follower list. Else do nothing. Can throw an error if trying to update their result counts.
-					player_cidx = None
-					if role_then in 'XV':
-						#they were dead before.	
-						if counts[player_idx] is not None:
-							counts[player_idx][1] += 1
-						continue
-					elif role_then == 'D':
-						player_cidx = 0
-					elif role_then == 'E':
-						player_cidx = 1
-					elif role_then == 'F':
-						player_cidx = 2
-						if counts[player_idx] is not None:
-							can_have_been_follower[player_idx] = True
-					elif role_then == 'G':
-						#mark guard visit even if the guard is dead now
-						guard_target = guard_requests[player_idx]
-						gtarget_role_then = universe_then[guard_target]
-						if gtarget_role_then != 'X':
-							#guard visits if the player was alive before
-							follower_visits[player_idx][2] = True
-						player_cidx = 3
-					elif role_then == 'T':
-						player_cidx = 4
-					if counts[player_idx] is not None:
-						counts[player_idx][0][player_cidx] += 1
-					continue
-				if role == 'A':
-					#alpha scum.
-					counts[player_idx][2][0] += 1
-					#track nightkill result also
-					if not entangler_only:
-						nk_target = nightkill_requests[player_idx]
-						target_role_now = universe_now[nk_target]
-						target_role_then = universe_then[nk_target]
-						if target_role_now == 'X':
-							#successful nightkill - or the target was dead already
-							if target_role_then == 'X':
-								#target was dead already
-								results[player_idx][0][1] += 1
-							else:
-								#successful nightkill
-								follower_visits[player_idx][0] = True
-								results[player_idx][0][0] += 1
-						else:
-							#failed nightkill - assume fought off by guard
-							follower_visits[player_idx][0] = True
-							results[player_idx][0][2] += 1
-					continue
-				if role in 'BC':
-					counts[player_idx][2][1] += 1
-					#no results to update, no follower visits
-					continue
-				if role == 'D':
-					counts[player_idx][3] += 1
-					if not entangler_only:
-						#track detective result also, and follower visits
-						det_target = detective_requests[player_idx]
-						itarget_role_now = universe_now[det_target]
-						itarget_role_then = universe_then[det_target]
-						if itarget_role_then != 'X':
-							#detective visits if the player was alive before
-							follower_visits[player_idx][1] = True
-						if itarget_role_now == 'X': #dead
-							results[player_idx][1][4] += 1
-						elif itarget_role_now in 'ABC': #scum
-							results[player_idx][1][3] += 1
-						#we don't check for detective. WE'RE the detective!
-						elif itarget_role_now == 'E': #entangler
-							results[player_idx][1][2] += 1
-						elif itarget_role_now in 'FG': #follower or guard (town power)
-							#results[player_idx][1][0] += 1
-							results[player_idx][1][1] += 1
-						elif itarget_role_now == 'T':
-							results[player_idx][1][0] += 1
-					continue
-				if role == 'E':
-					can_have_been_entangler[player_idx] = True
-					counts[player_idx][4] += 1
-					#no visits to track, results not computed here
-					continue
-				if role == 'F':
-					can_have_been_follower[player_idx] = True
-					#no visits to track, results computed everywhere else
-					counts[player_idx][5] += 1
-					continue
-				if role == 'G':
-					counts[player_idx][6] += 1
-					if not entangler_only:
-						guard_target = guard_requests[player_idx]
-						gtarget_role_then = universe_then[guard_target]
-						if gtarget_role_then != 'X':
-							#guard visits if the player was alive before
-							follower_visits[player_idx][2] = True
-							#now we need to get last night's nightkill target so we can check if we fought someone off
-							alpha_scum_idx = universe_now.index('A')
-							nk_target = nightkill_requests[alpha_scum_idx]
-							if nk_target == guard_target:
-								#successfully fought off
-								results[player_idx][2][1] += 1
-							else:
-								#guard whiffed - uneventful night
-								results[player_idx][2][0] += 1
-						else:
-							results[player_idx][2][2] += 1 #never mind, they were dead before
-					continue
-				if role == 'T':
-					counts[player_idx][7] += 1
-					#no visits or results
-					continue
+		d1_counts = qm_combinatorics.d1_role_counts(universe_now_file) if entangler_only else None
+		night_outcomes = qm_outcomes.read_night_outcomes(universe_now_file) if not entangler_only else None
+		if d1_counts is not None: #D1: nobody is dead and there are no results to track, so the role counts are everything
+			tally.add_role_counts(d1_counts)
+		elif night_outcomes is not None: #night.py tallied them when it wrote the file
+			tally.add_outcomes(night_outcomes)
+		else:
+			count_all_universes(tally, universe_now_file, universe_then_file, args.workers, args.cluster)
 
 		universe_now_file.close()
-		os.close(universe_now_filedesc)
 		if not entangler_only:
 			universe_then_file.close()
-			os.close(universe_then_filedesc)
+		
+		counts, results, follower_visits = tally.counts, tally.results, tally.follower_visits
+		can_have_been_entangler, can_have_been_follower = tally.can_have_been_entangler, tally.can_have_been_follower
+		if multiplicity > 1:
+			counts = scale_counts(counts, multiplicity)
+			results = scale_counts(results, multiplicity)
 
 		#now track follower visits			
 		if not entangler_only:
@@ -585,7 +518,7 @@ def print_dms():
 						#fought off
 						result = f"Last night, **you were fought off by the Guard** as you tried to kill **{nk_target}**."
 					if num_scum_left > 1:
-						other_scum_names = [qm_shared.get_player_name(idx) for idx, item in enumerate(player_liveness) if item[0] in 'ABC' and idx != player_idx]
+						other_scum_names = [qm_shared.get_player_name(idx) for idx, item in enumerate(player_liveness) if item[0] in qm_permutations.SCUM_ROLES and idx != player_idx]
 						print(f'You are **scum**, along with {qm_shared.oxford_comma(other_scum_names,"and")}.\n{tab()}{result}')
 					else:
 						print(f"You are **scum** - the last one left!\n{tab()}{result}")
@@ -821,9 +754,9 @@ def print_dms():
 							if player_results[2][0] > 0:
 								guard_result += f'**had an uneventful night** in {percent(player_results[2][0], player_counts[6], square_brackets=True)} of them.'
 							else: #implies must have fought off
-								f"**fought off someone trying to kill {guard_target}** in {percent(player_results[2][1], player_counts[6], square_brackets=True)} of them."
+								guard_result += f"**fought off someone trying to kill {guard_target}** in {percent(player_results[2][1], player_counts[6], square_brackets=True)} of them."
 						else:
-							guard_result += 'You '+and_or_all(player_results[2], ["**had an uneventful night**", f"**fought off someone trying to kill {guard_target}**"], include_percents=True, override_total=player_counts[6])+'.'
+							guard_result += 'You '+and_or_all(player_results[2][:2], ["**had an uneventful night**", f"**fought off someone trying to kill {guard_target}**"], include_percents=True, override_total=player_counts[6])+'.'
 						if player_results[2][2] > 0:
 							guard_result += f' {guard_target} **was already dead when you got there** in {percent(player_results[2][2], player_counts[6], square_brackets=True)} universe{plural(player_results[2][2])}.'
 					print(guard_result)
@@ -846,40 +779,22 @@ def print_dms():
 	else:
 		#if it's night mode, we don't need to track anything between universes except how many universes there were then vs now
 		
-		counts = [[0,[0,0],0,0,0,0,0] if item[1] == '#' else None for item in player_liveness] #dead, [alpha scum, backup scum], det, ent, follower, guard, town
+		tally = NightTally(player_liveness)
 		live_indexes = [idx for idx, item in enumerate(player_liveness) if item[1] == '#']
 		
-		for _ in range(num_universes): #calculate counts
-			universe = qm_shared.parse_universe(universe_now_file.readline())[1]
-			for player_idx in live_indexes:
-				role = universe[player_idx]
-				if role in 'XV':
-					counts[player_idx][0] += 1
-					continue
-				if role == 'A':
-					counts[player_idx][1][0] += 1
-					continue
-				if role in 'BC':
-					counts[player_idx][1][1] += 1
-					continue
-				if role == 'D':
-					counts[player_idx][2] += 1
-					continue
-				if role == 'E':
-					counts[player_idx][3] += 1
-					continue
-				if role == 'F':
-					counts[player_idx][4] += 1
-					continue
-				if role == 'G':
-					counts[player_idx][5] += 1
-					continue
-				if role == 'T':
-					counts[player_idx][6] += 1
-					continue
-	
+		d1_counts = qm_combinatorics.d1_role_counts(universe_now_file) if args.num == 0 else None
+		universe_stats = qm_shared.read_universe_stats(universe_now_file) if d1_counts is None else None
+		if d1_counts is not None: #N0 reads the D1 set, so the counts can be worked out without a scan
+			tally.add_role_counts(d1_counts)
+		elif universe_stats is not None: #day.py counted them when it wrote the file
+			tally.add_role_counts(universe_stats['role_counts'])
+		else:
+			count_all_universes(tally, universe_now_file, None, args.workers, args.cluster)
 		universe_now_file.close()
-		os.close(universe_now_filedesc)
+		
+		counts = tally.counts
+		if multiplicity > 1:
+			counts = scale_counts(counts, multiplicity)
 	
 		for player_idx in live_indexes:
 			print(f"DM for {qm_shared.get_player_name(player_idx)}:")
@@ -894,7 +809,7 @@ def print_dms():
 				print()
 				if sum(counts[player_idx][1]) > 0:
 					if num_scum_left > 1:
-						other_scum_names = [qm_shared.get_player_name(idx) for idx, item in enumerate(player_liveness) if item[0] in 'ABC' and idx != player_idx]
+						other_scum_names = [qm_shared.get_player_name(idx) for idx, item in enumerate(player_liveness) if item[0] in qm_permutations.SCUM_ROLES and idx != player_idx]
 						print(f'You are **scum**, along with {qm_shared.oxford_comma(other_scum_names,"and")}.')
 						night_actions.append("**Please** (collaboratively) **choose someone to nightkill,** and submit your target in scumchat.")
 					else:
@@ -1049,7 +964,7 @@ def print_dms():
 		player_idx = qm_shared.player_to_pos(player)
 		if aggregated_counts[player_idx] is None:
 			role_item = player_liveness[player_idx][0] 
-			if role_item in 'ABC':
+			if role_item in qm_permutations.SCUM_ROLES:
 				role = 'SCUM'
 			elif role_item == 'D':
 				role = 'DETECTIVE'
@@ -0,0 +1,56 @@
+#checkpoints for the long phase transitions (day.py/night.py --checkpoint). After each stage (the vote/nightkill pass, each round of flips in the cascade, the liveness transformation) they snapshot the surviving universes plus everything needed to carry on - liveness, counters, the RNG state - so --resume can pick up where a crashed or interrupted run left off and get identical results.
+#file format: magic, pickled state dict, then fixed width records (int64 universe ID + 1 byte per player).
+
+import os, pickle, struct
+from sys import exit
+
+CHECKPOINT_MAGIC = b'QMCK1'
+
+def checkpoint_file_name(phase):
+	return f"checkpoint-{phase}.qmc"
+
+def write_checkpoint(filename, state, universe_buffer, num_players, chunk_size):
+	#write to a temporary file then swap it in, so a crash mid-write leaves the previous checkpoint intact
+	temp_filename = filename + ".tmp"
+	with open(temp_filename, 'wb') as checkpoint_file:
+		checkpoint_file.write(CHECKPOINT_MAGIC)
+		pickle.dump({**state, 'num_players': num_players, 'num_universes': len(universe_buffer)}, checkpoint_file)
+		if getattr(universe_buffer, 'is_vectorized', False):
+			universe_buffer.write_records(checkpoint_file, True, 0, 8, chunk_size) #8 byte IDs - same layout as below
+		else:
+			record_struct = struct.Struct(f'<q{num_players}s')
+			chunk = []
+			for universe in universe_buffer:
+				chunk.append(record_struct.pack(universe[0], "".join(universe[1]).encode('ascii')))
+				if len(chunk) >= chunk_size:
+					checkpoint_file.write(b"".join(chunk))
+					chunk = []
+			checkpoint_file.write(b"".join(chunk))
+		checkpoint_file.flush()
+		os.fsync(checkpoint_file.fileno())
+	os.replace(temp_filename, filename)
+
+def read_checkpoint(filename): #returns the state dict and a generator over the saved (id, role string) universes
+	try:
+		checkpoint_file = open(filename, 'rb')
+	except OSError:
+		print(f"Couldn't find a checkpoint to resume from ({filename}). Run without --resume to start this phase from scratch.")
+		exit()
+	if checkpoint_file.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+		print(f"{filename} isn't a checkpoint file I can read. Delete it and run without --resume.")
+		exit()
+	state = pickle.load(checkpoint_file)
+	return state, read_checkpoint_universes(checkpoint_file, state['num_players'], state['num_universes'])
+
+def read_checkpoint_universes(checkpoint_file, num_players, num_universes, chunk_size=65536):
+	record_struct = struct.Struct(f'<q{num_players}s')
+	with checkpoint_file:
+		while num_universes > 0:
+			chunk_universes = min(chunk_size, num_universes)
+			for universe_id, roles in record_struct.iter_unpack(checkpoint_file.read(chunk_universes*record_struct.size)):
+				yield universe_id, roles.decode('ascii')
+			num_universes -= chunk_universes
+
+def remove_checkpoint(filename):
+	if os.path.exists(filename):
+		os.remove(filename)
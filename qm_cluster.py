@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+#cluster workers for the sharded passes (night.py/day.py/print_dms.py --cluster). Same shards as --workers (see qm_parallel.py), but run by worker processes that can be on other hosts.
+#start a worker on each host with: qm_cluster.py host:port (or a socket path). It runs shards one at a time for whoever connects. Every worker needs this code and the game's directory at the same path as the coordinator - a shared filesystem - because shards name the phase files rather than carry them.
+#coordinator and workers must share a key, in the QM_CLUSTER_KEY environment variable. Shards are pickles, so never run a worker where anyone without the key can reach it.
+#a worker that dies, hangs or can't be reached has its shard put back for the other workers, and gets reconnected after a short wait. Workers send a heartbeat while they run a shard, so a host that vanishes without closing the connection is noticed too.
+
+import argparse, os, sys, io, pickle, queue, threading, time, traceback, qm_shared
+from multiprocessing.connection import Listener, Client, AuthenticationError
+from sys import exit
+
+heartbeat_interval = 10 #seconds between a busy worker's heartbeats
+heartbeat_timeout = 60 #seconds of silence before the coordinator gives up on a worker
+retry_delay = 2 #seconds before reconnecting to a worker that failed
+worker_attempts = 5 #failures in a row before the coordinator stops using a worker
+shard_attempts = 3 #workers a shard can take down before we decide it's the shard's fault
+
+def cluster_addresses(string): #type checker for argparse. Comma separated host:port or socket paths.
+	addresses = []
+	for item in string.split(','):
+		if '/' in item or ':' not in item:
+			addresses.append(item) #local socket
+			continue
+		host, port = item.rsplit(':', maxsplit=1)
+		addresses.append((host, int(port)))
+	return addresses
+
+def address_name(address):
+	return address if isinstance(address, str) else f"{address[0]}:{address[1]}"
+
+def cluster_key():
+	key = os.environ.get('QM_CLUSTER_KEY')
+	if key is None or key == "":
+		print("Set the QM_CLUSTER_KEY environment variable to the cluster's shared key first (the same on the coordinator and every worker).")
+		exit()
+	return key.encode('utf-8')
+
+class ShardUnpickler(pickle.Unpickler):
+	#the coordinator's pass functions and tallies live in its __main__ (night.py, say), which is qm_cluster.py on a worker. So __main__ is sent as the script's module name, and turned back into __main__ when the results come home.
+	def __init__(self, data, module_renames):
+		super().__init__(io.BytesIO(data))
+		self.module_renames = module_renames
+
+	def find_class(self, module, name):
+		return super().find_class(self.module_renames.get(module, module), name)
+
+def main_module_name():
+	main_file = getattr(sys.modules['__main__'], '__file__', None)
+	return os.path.splitext(os.path.basename(main_file))[0] if main_file is not None else '__main__' #no script, e.g. python -c
+
+def receive_reply(connection, main_module): #a worker's reply to a shard, skipping heartbeats. Raises TimeoutError if the worker goes quiet.
+	while True:
+		if not connection.poll(heartbeat_timeout):
+			raise TimeoutError("no heartbeat")
+		status, payload = ShardUnpickler(connection.recv_bytes(), {main_module: '__main__'}).load()
+		if status != 'alive':
+			return status, payload
+
+def map_shards(addresses, shard_function, shards): #shard_function(shard) for every shard, on the cluster. Returns the results in shard order. Exits if the shards can't all be run.
+	key = cluster_key()
+	main_module = main_module_name()
+	task_header = (main_module, os.getcwd(), {'universe_chunk_size': qm_shared.universe_chunk_size})
+	results = [None for _ in shards]
+	failures = [0 for _ in shards]
+	shards_left = queue.Queue()
+	for shard_idx in range(len(shards)):
+		shards_left.put(shard_idx)
+	state = {'remaining': len(shards), 'error': None}
+	lock = threading.Lock()
+
+	def finished():
+		with lock:
+			return state['remaining'] == 0 or state['error'] is not None
+
+	def drive_worker(address): #one thread per worker, feeding it shards until there are none left
+		connection = None
+		failures_in_a_row = 0
+		while not finished():
+			try:
+				shard_idx = shards_left.get(timeout=0.1)
+			except queue.Empty:
+				continue
+			shard_sent = False
+			try:
+				if connection is None:
+					connection = Client(address, authkey=key)
+				shard_sent = True
+				connection.send_bytes(pickle.dumps((*task_header, pickle.dumps((shard_function, shards[shard_idx])))))
+				status, payload = receive_reply(connection, main_module)
+			except (OSError, EOFError, AuthenticationError) as error:
+				if connection is not None:
+					connection.close()
+					connection = None
+				with lock:
+					failures[shard_idx] += 1 if shard_sent else 0 #not getting through to a worker is no reflection on the shard
+					if failures[shard_idx] >= shard_attempts and state['error'] is None:
+						state['error'] = f"Shard {shard_idx+1} of {len(shards)} failed on {failures[shard_idx]} cluster workers. Giving up."
+				shards_left.put(shard_idx)
+				failures_in_a_row += 1
+				print(f"Lost cluster worker {address_name(address)} ({type(error).__name__}: {error}). Its shard goes back in the queue.")
+				if failures_in_a_row >= worker_attempts:
+					print(f"Giving up on cluster worker {address_name(address)}.")
+					return
+				time.sleep(retry_delay)
+				continue
+			if status == 'error': #the shard itself raised, so it would on any worker
+				with lock:
+					state['error'] = f"Cluster worker {address_name(address)} failed on shard {shard_idx+1} of {len(shards)}:\n{payload}"
+				break
+			results[shard_idx] = payload
+			failures_in_a_row = 0
+			with lock:
+				state['remaining'] -= 1
+		if connection is not None:
+			connection.close()
+
+	threads = [threading.Thread(target=drive_worker, args=(address,), daemon=True) for address in addresses]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	if state['error'] is not None:
+		print(state['error'])
+		exit()
+	if state['remaining'] > 0:
+		print(f"Ran out of cluster workers with {state['remaining']} of {len(shards)} shards still to run. Giving up.")
+		exit()
+	return results
+
+def run_tasks(connection): #a worker's side of one coordinator connection. Each task is the coordinator's main module name, working directory and qm_shared settings, then the pickled shard function and shard - pickled separately, since unpickling them needs the main module name.
+	while True:
+		try:
+			data = connection.recv_bytes()
+		except EOFError:
+			return
+		send_lock = threading.Lock()
+		shard_done = threading.Event()
+		def heartbeat():
+			while not shard_done.wait(heartbeat_interval):
+				try:
+					with send_lock:
+						connection.send_bytes(pickle.dumps(('alive', None)))
+				except OSError:
+					return
+		heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+		heartbeat_thread.start()
+		try:
+			main_module, working_dir, settings, task = pickle.loads(data)
+			shard_function, shard = ShardUnpickler(task, {'__main__': main_module}).load()
+			os.chdir(working_dir)
+			for name, value in settings.items():
+				setattr(qm_shared, name, value)
+			reply = ('done', shard_function(shard))
+		except Exception:
+			reply = ('error', traceback.format_exc())
+		shard_done.set()
+		heartbeat_thread.join()
+		with send_lock:
+			connection.send_bytes(pickle.dumps(reply))
+
+def worker():
+	parser = argparse.ArgumentParser(
+						prog='Quantumafia Cluster Worker',
+						description='This runs shards of the night, day and DM passes for a coordinator on another host (night.py, day.py or print_dms.py with --cluster).')
+	parser.add_argument('address', help="Where to listen: host:port, or a local socket path.")
+	args = parser.parse_args()
+	address = cluster_addresses(args.address)[0]
+	key = cluster_key()
+	with Listener(address, authkey=key) as listener:
+		print(f"Cluster worker listening on {address_name(address)}.")
+		while True:
+			try:
+				connection = listener.accept()
+			except (OSError, EOFError, AuthenticationError) as error:
+				print(f"Refused a connection ({type(error).__name__}: {error}).")
+				continue
+			with connection:
+				try:
+					run_tasks(connection)
+				except OSError as error:
+					print(f"Lost the coordinator ({type(error).__name__}: {error}).")
+
+if __name__ == "__main__":
+	worker()
@@ -0,0 +1,86 @@
+#exact universe counts for the Day 1 universe set, without reading it. The D1 set is every k-permutation of the players over the power roles (see qm_permutations.py), so how many universes give a player a role is a counting problem, not a scanning one.
+#facts narrow the set down: each is (player idx, role letter, holds), i.e. "player X is role R" (holds True) or "player X isn't role R" (holds False). 'T' is vanilla town. Role letters are the exact D1 letters, so scum are A, B, C, H, I...
+#nobody is dead in a D1 set, so no X/V counts turn up here.
+
+from collections import defaultdict
+import qm_permutations
+
+def count_universes(num_players, roles, facts=()): #how many universes in the D1 set agree with every fact
+	fixed = {} #player idx -> the power role they hold
+	forbidden = set() #(player idx, power role) pairs
+	must_be_power = set()
+	must_be_town = set()
+	for player_idx, role, holds in facts:
+		if holds and role == 'T':
+			must_be_town.add(player_idx)
+		elif holds:
+			if role not in roles or fixed.get(player_idx, role) != role:
+				return 0 #not a role in this game, or two roles at once
+			fixed[player_idx] = role
+		elif role == 'T':
+			must_be_power.add(player_idx)
+		else:
+			forbidden.add((player_idx, role))
+	if len(set(fixed.values())) < len(fixed):
+		return 0 #two players holding the same role
+	if any(player_idx in must_be_town or (player_idx, role) in forbidden for player_idx, role in fixed.items()) or len(must_be_town & must_be_power) > 0:
+		return 0
+	open_roles = [role for role in roles if role not in fixed.values()]
+	open_players = [player_idx for player_idx in range(num_players) if player_idx not in fixed and player_idx not in must_be_town]
+	#players no fact mentions are interchangeable, so we only track how many of them have been handed a role. The rest get a bit each.
+	forbidden_players = {player_idx for player_idx, _ in forbidden}
+	constrained = [player_idx for player_idx in open_players if player_idx in must_be_power or player_idx in forbidden_players]
+	num_free = len(open_players) - len(constrained)
+	required_mask = sum(1 << bit for bit, player_idx in enumerate(constrained) if player_idx in must_be_power)
+	ways = {(0, 0): 1} #(constrained players used as a bitmask, free players used) -> number of ways to get there
+	for role in open_roles: #hand out the roles one at a time
+		new_ways = defaultdict(int)
+		for (used_mask, free_used), count in ways.items():
+			if free_used < num_free:
+				new_ways[(used_mask, free_used + 1)] += count * (num_free - free_used)
+			for bit, player_idx in enumerate(constrained):
+				if not used_mask & (1 << bit) and (player_idx, role) not in forbidden:
+					new_ways[(used_mask | (1 << bit), free_used)] += count
+		ways = new_ways
+	return sum(count for (used_mask, _), count in ways.items() if used_mask & required_mask == required_mask)
+
+def mentioned_players(facts):
+	return {player_idx for player_idx, _, _ in facts}
+
+def role_counts(num_players, roles, facts=()): #per player, {role letter: number of universes they hold it in}, town included. Same shape as LivenessCounters.role_counts.
+	total = count_universes(num_players, roles, facts)
+	mentioned = mentioned_players(facts)
+	free_player_counts = None #every player no fact mentions gets the same counts, so we only work them out once
+	counts = []
+	for player_idx in range(num_players):
+		if player_idx not in mentioned and free_player_counts is not None:
+			counts.append(dict(free_player_counts))
+			continue
+		player_counts = {role: count_universes(num_players, roles, [*facts, (player_idx, role, True)]) for role in roles}
+		player_counts['T'] = total - sum(player_counts.values())
+		if player_idx not in mentioned:
+			free_player_counts = player_counts
+		counts.append(player_counts)
+	return counts
+
+def pair_counts(num_players, roles, player_1, player_2, facts=()): #{(player 1's role, player 2's role): number of universes}, town included
+	counts = {}
+	for role_1 in roles:
+		for role_2 in roles:
+			counts[(role_1, role_2)] = count_universes(num_players, roles, [*facts, (player_1, role_1, True), (player_2, role_2, True)]) if role_1 != role_2 else 0
+	single_counts = role_counts(num_players, roles, facts)
+	for role in roles: #town pairs are whatever's left over
+		counts[(role, 'T')] = single_counts[player_1][role] - sum(counts[(role, role_2)] for role_2 in roles)
+		counts[('T', role)] = single_counts[player_2][role] - sum(counts[(role_1, role)] for role_1 in roles)
+	counts[('T', 'T')] = single_counts[player_1]['T'] - sum(counts[('T', role)] for role in roles)
+	return counts
+
+def alive_counts(num_players, roles, facts=()): #number of universes each player is alive in - all of them, on D1
+	total = count_universes(num_players, roles, facts)
+	return [total for _ in range(num_players)]
+
+def d1_role_counts(universe_file): #per player {role letter: count} for a D1 file, worked out instead of scanned. None if the file isn't the whole D1 set.
+	roles = qm_permutations.power_roles(universe_file.setup)
+	if universe_file.num_universes != qm_permutations.count_universes(universe_file.num_players, len(roles)) or any(item != '##' for item in universe_file.liveness):
+		return None
+	return role_counts(universe_file.num_players, roles)
@@ -0,0 +1,226 @@
+#what happened last night, for the day DMs. Working it out means pairing every surviving universe with what it was before the night, so night.py does it once while it still has the surviving universes in memory, and saves the tallies next to the phase file it writes (universes-D2.outcomes, say). print_dms.py day mode reads them from there, and only falls back to joining the two phase files itself if they're missing.
+#file format: plain JSON, num_universes plus DayTally.outcomes(). Counts are of records, so a canonical set still needs scaling by its multiplicity.
+
+import json, itertools
+import qm_shared, qm_permutations
+
+sparse_join_ratio = 12 #join_universes looks universes up by ID once fewer than 1 in this many of the earlier file's records are wanted
+
+def read_to_universe_with_id(universes, target_id): #universes is an iterator over a universe file
+	for universe in universes:
+		if universe[0] == target_id:
+			return universe
+		elif universe[0] > target_id:
+			print("Warning: Skipped target universe in read-to.")
+			return #give up
+	return None #give up
+
+def join_universes(universes_now, universe_then_file): #pairs each universe (any iterable of id, roles in ID order) with its roles in an earlier phase file. Yields (roles now, roles then).
+	#a chunk at a time: where the chunk's universes are most of that stretch of the earlier file, reading the stretch straight through is quickest. Where most of it has collapsed away, we look each one up by ID instead.
+	universes_now = iter(universes_now)
+	record_idx = 0
+	while True:
+		universe_chunk = list(itertools.islice(universes_now, qm_shared.universe_chunk_size))
+		if len(universe_chunk) == 0:
+			return
+		first_record_idx = universe_then_file.find_id(universe_chunk[0][0], record_idx)
+		record_idx = universe_then_file.find_id(universe_chunk[-1][0], first_record_idx) + 1
+		if record_idx - first_record_idx <= sparse_join_ratio * len(universe_chunk):
+			universes_then = universe_then_file.universes(first_record_idx, record_idx)
+			for universe_id, universe_now in universe_chunk:
+				yield universe_now, read_to_universe_with_id(universes_then, universe_id)[1]
+		else:
+			for (_, universe_now), universe_then in zip(universe_chunk, universe_then_file.universes_with_ids([universe[0] for universe in universe_chunk])):
+				yield universe_now, universe_then[1]
+
+def request_positions(requests): #night.py's target letters ('#' for none) -> player positions (None for none), the way DayTally takes them
+	if requests is None:
+		return None
+	return [qm_shared.player_to_pos(target) if target != '#' else None for target in requests]
+
+class DayTally:
+	#day mode's per-player accumulators, over the surviving universes and what each of them was last night. Everything in here is a sum or an OR, so the tallies of separate runs of universes merge into the tally of all of them (print_dms.py --workers).
+	def __init__(self, player_liveness, player_liveness_then, entangler_only, nightkill_requests=None, detective_requests=None, guard_requests=None):
+		self.entangler_only = entangler_only
+		self.nightkill_requests = nightkill_requests
+		self.detective_requests = detective_requests
+		self.guard_requests = guard_requests
+		self.results = [[[0,0,0], [0,0,0,0,0], [0,0,0]] if item[1] == '#' else None for item in player_liveness] #scum results [success, already dead, fought off by guard], det results [town align, town power, entangler, scum, dead], guard results [no activity, fought off scum, target was already dead]
+		#entangler results are tracked separately by masonry, so we compute them later
+		#follower result matrix separate (tracking who visited who)
+		#follower stuff explained: the follower tracks when anyone VISITS another player. That's alpha scum doing a NK, guard taking up their position, and detective investigating.
+		#so we track for each living player, T/F for each of those modes. Then we can parse out who visited who and yield the results to anyone who asks and could have been follower during THEN.
+		self.follower_visits = [[False, False, False] if item[1] == '#' else None for item in player_liveness_then] #this tracks players actively visiting, not being visited. We boil that down later.
+		self.can_have_been_entangler = [False for item in player_liveness]
+		self.can_have_been_follower = [False for item in player_liveness]
+		self.counts = [[[0,0,0,0,0],0,[0,0],0,0,0,0,0] if item[1] == '#' else None for item in player_liveness] #dead now as [det, ent, follower, guard, town], dead before, [alpha scum, backup scum], det, ent, follower, guard, town (can't die from nightkill as scum)
+		self.live_indexes_then = [idx for idx, item in enumerate(player_liveness_then) if item[1] == '#']
+
+	def add_role_counts(self, role_counts): #D1's closed form counts (see qm_combinatorics.d1_role_counts). Nobody is dead and there are no results to track, so the role counts are everything.
+		for player_idx in self.live_indexes_then:
+			player_roles = role_counts[player_idx]
+			self.counts[player_idx][2][0] += player_roles.get('A', 0)
+			self.counts[player_idx][2][1] += sum(player_roles.get(role, 0) for role in qm_permutations.SCUM_ROLES[1:])
+			for counts_idx, role in enumerate('DEFGT', start=3):
+				self.counts[player_idx][counts_idx] += player_roles.get(role, 0)
+			self.can_have_been_entangler[player_idx] = player_roles.get('E', 0) > 0
+			self.can_have_been_follower[player_idx] = player_roles.get('F', 0) > 0
+
+	def count(self, universe_now, universe_then):
+		for player_idx in self.live_indexes_then:
+			#so unlike the night version, we need to track BOTH the role count AND the result.
+			role = universe_now[player_idx]
+			if role in 'XV':
+				#dead. so did they JUST die?
+				#we don't bother to track results in this case, because if they died just now, obviously they were scum, they failed as the guard, and get no self.results as the detective.
+				role_then = universe_then[player_idx]
+				#this bit has guardrails. We need to track if the player was the guard last night, because then their visit is added to the follower list. Else do nothing. Can throw an error if trying to update their result counts.
+				player_cidx = None
+				if role_then in 'XV':
+					#they were dead before.	
+					if self.counts[player_idx] is not None:
+						self.counts[player_idx][1] += 1
+					continue
+				elif role_then == 'D':
+					player_cidx = 0
+				elif role_then == 'E':
+					player_cidx = 1
+				elif role_then == 'F':
+					player_cidx = 2
+					if self.counts[player_idx] is not None:
+						self.can_have_been_follower[player_idx] = True
+				elif role_then == 'G':
+					#mark guard visit even if the guard is dead now
+					guard_target = self.guard_requests[player_idx]
+					gtarget_role_then = universe_then[guard_target]
+					if gtarget_role_then != 'X':
+						#guard visits if the player was alive before
+						self.follower_visits[player_idx][2] = True
+					player_cidx = 3
+				elif role_then == 'T':
+					player_cidx = 4
+				if self.counts[player_idx] is not None:
+					self.counts[player_idx][0][player_cidx] += 1
+				continue
+			if role == 'A':
+				#alpha scum.
+				self.counts[player_idx][2][0] += 1
+				#track nightkill result also
+				if not self.entangler_only:
+					nk_target = self.nightkill_requests[player_idx]
+					target_role_now = universe_now[nk_target]
+					target_role_then = universe_then[nk_target]
+					if target_role_now == 'X':
+						#successful nightkill - or the target was dead already
+						if target_role_then == 'X':
+							#target was dead already
+							self.results[player_idx][0][1] += 1
+						else:
+							#successful nightkill
+							self.follower_visits[player_idx][0] = True
+							self.results[player_idx][0][0] += 1
+					else:
+						#failed nightkill - assume fought off by guard
+						self.follower_visits[player_idx][0] = True
+						self.results[player_idx][0][2] += 1
+				continue
+			if role in qm_permutations.SCUM_ROLES[1:]:
+				self.counts[player_idx][2][1] += 1
+				#no results to update, no follower visits
+				continue
+			if role == 'D':
+				self.counts[player_idx][3] += 1
+				if not self.entangler_only:
+					#track detective result also, and follower visits
+					det_target = self.detective_requests[player_idx]
+					itarget_role_now = universe_now[det_target]
+					itarget_role_then = universe_then[det_target]
+					if itarget_role_then != 'X':
+						#detective visits if the player was alive before
+						self.follower_visits[player_idx][1] = True
+					if itarget_role_now == 'X': #dead
+						self.results[player_idx][1][4] += 1
+					elif itarget_role_now in qm_permutations.SCUM_ROLES: #scum
+						self.results[player_idx][1][3] += 1
+					#we don't check for detective. WE'RE the detective!
+					elif itarget_role_now == 'E': #entangler
+						self.results[player_idx][1][2] += 1
+					elif itarget_role_now in 'FG': #follower or guard (town power)
+						#self.results[player_idx][1][0] += 1
+						self.results[player_idx][1][1] += 1
+					elif itarget_role_now == 'T':
+						self.results[player_idx][1][0] += 1
+				continue
+			if role == 'E':
+				self.can_have_been_entangler[player_idx] = True
+				self.counts[player_idx][4] += 1
+				#no visits to track, results not computed here
+				continue
+			if role == 'F':
+				self.can_have_been_follower[player_idx] = True
+				#no visits to track, results computed everywhere else
+				self.counts[player_idx][5] += 1
+				continue
+			if role == 'G':
+				self.counts[player_idx][6] += 1
+				if not self.entangler_only:
+					guard_target = self.guard_requests[player_idx]
+					gtarget_role_then = universe_then[guard_target]
+					if gtarget_role_then != 'X':
+						#guard visits if the player was alive before
+						self.follower_visits[player_idx][2] = True
+						#now we need to get last night's nightkill target so we can check if we fought someone off
+						alpha_scum_idx = universe_now.index('A')
+						nk_target = self.nightkill_requests[alpha_scum_idx]
+						if nk_target == guard_target:
+							#successfully fought off
+							self.results[player_idx][2][1] += 1
+						else:
+							#guard whiffed - uneventful night
+							self.results[player_idx][2][0] += 1
+					else:
+						self.results[player_idx][2][2] += 1 #never mind, they were dead before
+				continue
+			if role == 'T':
+				self.counts[player_idx][7] += 1
+				#no visits or results
+				continue
+
+	def outcomes(self): #everything we've tallied, as plain lists (what night.py saves - see write_night_outcomes)
+		return {
+			'counts': self.counts,
+			'results': self.results,
+			'follower_visits': self.follower_visits,
+			'can_have_been_entangler': self.can_have_been_entangler,
+			'can_have_been_follower': self.can_have_been_follower,
+		}
+
+	def add_outcomes(self, outcomes): #merges in the outcomes() of another tally over the same night
+		self.counts = merge_tallies(self.counts, outcomes['counts'])
+		self.results = merge_tallies(self.results, outcomes['results'])
+		self.follower_visits = merge_tallies(self.follower_visits, outcomes['follower_visits'])
+		self.can_have_been_entangler = merge_tallies(self.can_have_been_entangler, outcomes['can_have_been_entangler'])
+		self.can_have_been_follower = merge_tallies(self.can_have_been_follower, outcomes['can_have_been_follower'])
+
+	def merge(self, other):
+		self.add_outcomes(other.outcomes())
+
+def merge_tallies(mine, theirs): #nested lists of counts (summed) and flags (ORed), None for dead players
+	if isinstance(mine, list):
+		return [merge_tallies(my_item, their_item) for my_item, their_item in zip(mine, theirs)]
+	if mine is None or isinstance(mine, bool):
+		return mine or theirs
+	return mine + theirs
+
+def outcomes_file_name(universe_filename):
+	return qm_shared.sidecar_file_name(universe_filename, ".outcomes")
+
+def write_night_outcomes(universe_filename, tally, num_universes):
+	with open(outcomes_file_name(universe_filename), 'w') as outcomes_file: #overwrite - anything already there is from an earlier run of this night
+		json.dump({'num_universes': num_universes, **tally.outcomes()}, outcomes_file)
+
+def read_night_outcomes(universe_file): #the saved outcomes for an open day phase file, or None if there aren't any we can trust
+	outcomes = qm_shared.read_sidecar(universe_file, ".outcomes")
+	if outcomes is None or len(outcomes.get('counts', [])) != universe_file.num_players:
+		return None
+	return outcomes
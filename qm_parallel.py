@@ -0,0 +1,68 @@
+#sharded transition passes (day.py/night.py --workers, or --cluster for workers on other hosts - see qm_cluster.py). The phase file is split into record ranges, and a pool of worker processes runs the per-universe pass over one range each. Every worker opens the phase file itself - it's mmapped, so they all share the same pages - and the shards are merged back in file order.
+#the only state the vote and nightkill passes carry from one universe to the next is whether they've hit a non-entangler yet: entangler universes before that go to the subsidiary buffer, and after it they collapse. Each shard keeps its own subsidiary buffer, and we merge them all. If anything hit a non-entangler the subsidiary universes are all counted as collapsed anyway, and if nothing did, every entangler universe was before the first non-entangler - so the totals come out the same as a serial run.
+
+import multiprocessing, struct
+from math import ceil
+import qm_shared, qm_cluster
+
+shards_per_worker = 4 #more shards than workers, so one slow shard doesn't hold everything up
+
+class PackedUniverses: #a worker's stand-in for the output list. Same fixed width records as qm_stream.SpillBuffer, so shards come back to the coordinator as one bytes object each rather than millions of lists.
+	def __init__(self, num_players):
+		self.record_struct = struct.Struct(f'<q{num_players}s')
+		self.records = bytearray()
+		self.num_universes = 0
+
+	def append(self, universe): #universe is [id, roles], same as the output lists
+		self.records += self.record_struct.pack(universe[0], "".join(universe[1]).encode('ascii'))
+		self.num_universes += 1
+
+	def __len__(self):
+		return self.num_universes
+
+def shard_ranges(num_universes, workers): #record ranges [start, stop) to split a phase file into
+	shard_size = max(qm_shared.universe_chunk_size, ceil(num_universes / (workers * shards_per_worker)))
+	return [(start, min(start + shard_size, num_universes)) for start in range(0, num_universes, shard_size)]
+
+def map_shards(shard_function, shards, workers, cluster=None): #yields shard_function(shard) for every shard, in shard order. shard_function must be a module-level function.
+	if cluster is not None:
+		yield from qm_cluster.map_shards(cluster, shard_function, shards)
+		return
+	with multiprocessing.Pool(workers) as pool:
+		yield from pool.imap(shard_function, shards)
+
+def run_shard(shard): #runs in a worker. Returns the shard's output and subsidiary records, its collapse counts, the first bad role it found (or None), and its accumulators
+	pass_function, filename, start, stop, pass_args, num_players, num_collapse_counters, accumulators = shard
+	universe_file = qm_shared.UniverseFile(filename)
+	output_buffer = PackedUniverses(num_players)
+	entangler_subsidiary_buffer = PackedUniverses(num_players)
+	universes_collapsed = [0 for _ in range(num_collapse_counters)]
+	bad_role = pass_function(universe_file.universes(start, stop), *pass_args, qm_shared.CountedBuffer(output_buffer, accumulators), entangler_subsidiary_buffer, universes_collapsed)
+	universe_file.close()
+	return bytes(output_buffer.records), bytes(entangler_subsidiary_buffer.records), universes_collapsed, bad_role, accumulators
+
+def add_records(universe_buffer, records, record_struct):
+	if hasattr(universe_buffer, 'append_records'):
+		universe_buffer.append_records(records)
+		return
+	for universe_id, roles in record_struct.iter_unpack(records):
+		universe_buffer.append([universe_id, [*roles.decode('ascii')]])
+
+def sharded_pass(universe_file, pass_function, pass_args, num_collapse_counters, workers, num_players, stream=False, cluster=None, accumulators=()):
+	#pass_function(universes, *pass_args, output_buffer, entangler_subsidiary_buffer, universes_collapsed) is the serial pass over an iterator of universes. It must be a module-level function, and return the first bad role it finds (stopping there) or None.
+	#accumulators (see qm_shared.CountedBuffer) must be empty. Each shard fills in its own copies, and they're merged into these.
+	#returns the merged output buffer, subsidiary buffer, collapse counts and first bad role, ready for the same tail as the serial pass
+	output_buffer = qm_shared.new_universe_buffer(num_players, stream=stream)
+	entangler_subsidiary_buffer = qm_shared.new_universe_buffer(num_players, stream=stream)
+	universes_collapsed = [0 for _ in range(num_collapse_counters)]
+	record_struct = struct.Struct(f'<q{num_players}s')
+	shards = [(pass_function, universe_file.filename, start, stop, pass_args, num_players, num_collapse_counters, list(accumulators)) for start, stop in shard_ranges(universe_file.num_universes, workers if cluster is None else len(cluster))]
+	for output_records, subsidiary_records, shard_collapsed, bad_role, shard_accumulators in map_shards(run_shard, shards, workers, cluster):
+		if bad_role is not None: #the serial pass would have stopped at the first one
+			return output_buffer, entangler_subsidiary_buffer, universes_collapsed, bad_role
+		add_records(output_buffer, output_records, record_struct)
+		add_records(entangler_subsidiary_buffer, subsidiary_records, record_struct)
+		universes_collapsed = [total + count for total, count in zip(universes_collapsed, shard_collapsed)]
+		for accumulator, shard_accumulator in zip(accumulators, shard_accumulators):
+			accumulator.merge(shard_accumulator)
+	return output_buffer, entangler_subsidiary_buffer, universes_collapsed, None
@@ -0,0 +1,117 @@
+#the Day 1 universe set is every k-permutation of the players, where k is the number of power roles, in lexicographic order (the order itertools.permutations produces them).
+#that means a universe ID *is* the lexicographic rank of its permutation, so we can compute any D1 universe straight from its ID (and vice versa) without touching the D1 file.
+
+#a canonical D1 set (universe_setup.py --canonical) hands the extra scum (H, I, J...) out as a combination instead: nothing tells them apart, so each universe gives them to their players in seat order and stands for every ordering of them at once.
+
+import itertools
+from functools import lru_cache
+from math import perm, comb, factorial
+
+EXTRA_SCUM_ROLES = 'HIJKLMNOPQRS' #4th mafia member onwards
+SCUM_ROLES = 'ABC' + EXTRA_SCUM_ROLES
+
+def power_roles(setup): #setup is # players, # mafia, power role T/Fs. order matters - it's the order roles are assigned in the permutation.
+	num_scum = setup[1]
+	return 'ABC'[0:min(3,num_scum)]  \
+		+ ('D' if setup[2] else '') 	\
+		+ ('E' if setup[3] else '') 	\
+		+ ('F' if setup[4] else '') 	\
+		+ ('G' if setup[5] else '') 	\
+		+ EXTRA_SCUM_ROLES[:max(0,num_scum-3)] #HIJKetc
+
+def count_universes(num_players, num_roles):
+	return perm(num_players, num_roles)
+
+@lru_cache(maxsize=None)
+def rank_weights(num_players, num_roles): #how many universes each choice at each position of the permutation is 'worth'
+	return tuple(perm(num_players-1-idx, num_roles-1-idx) for idx in range(num_roles))
+
+def packed_from_id(univ_id, num_players, num_roles): #returns the tuple of players holding each power role, like itertools.permutations would
+	remaining = list(range(num_players))
+	packed = []
+	for weight in rank_weights(num_players, num_roles):
+		choice, univ_id = divmod(univ_id, weight)
+		packed.append(remaining.pop(choice))
+	return tuple(packed)
+
+def id_from_packed(packed_universe, num_players):
+	remaining = list(range(num_players))
+	univ_id = 0
+	for weight, player_id in zip(rank_weights(num_players, len(packed_universe)), packed_universe):
+		choice = remaining.index(player_id)
+		del remaining[choice]
+		univ_id += choice * weight
+	return univ_id
+
+def universe_from_packed(packed_universe, num_players, roles):
+	universe_list = ['T' for _ in range(num_players)]
+	for power_role_id, player_id in enumerate(packed_universe):
+		universe_list[player_id] = roles[power_role_id]
+	return universe_list
+
+def universe_from_id(univ_id, num_players, roles): #returns the D1 universe as a list of role letters
+	return universe_from_packed(packed_from_id(univ_id, num_players, len(roles)), num_players, roles)
+
+def id_from_universe(universe, roles): #universe is a D1 universe (string or list of role letters). Returns its universe ID.
+	return id_from_packed([universe.index(role) for role in roles], len(universe))
+
+def role_in_universe(univ_id, player_idx, num_players, roles): #same as universe_from_id(...)[player_idx] but stops as soon as we find the player
+	remaining = list(range(num_players))
+	for role, weight in zip(roles, rank_weights(num_players, len(roles))):
+		choice, univ_id = divmod(univ_id, weight)
+		if remaining.pop(choice) == player_idx:
+			return role
+	return 'T'
+
+def packed_universes(players, num_roles, start=0): #k-permutations of players (which must be sorted), starting from rank 'start'
+	if start == 0:
+		yield from itertools.permutations(players, num_roles)
+		return
+	#skip whole blocks of permutations that share a first player, then recurse into the block we start in
+	block_size = perm(len(players)-1, num_roles-1)
+	first_choice, start = divmod(start, block_size)
+	for idx in range(first_choice, len(players)):
+		first_player = players[idx]
+		rest = players[:idx] + players[idx+1:]
+		for tail in packed_universes(rest, num_roles-1, start):
+			yield (first_player, *tail)
+		start = 0
+
+def universes(num_players, roles, start=0, stop=None): #streams (universe id, role string) pairs for D1 universes [start, stop), same as reading them from the D1 file
+	total = count_universes(num_players, len(roles))
+	if stop is None or stop > total:
+		stop = total
+	if start >= stop:
+		return
+	universe_base = ['T' for _ in range(num_players)]
+	for univ_id, packed_universe in zip(range(start, stop), packed_universes(tuple(range(num_players)), len(roles), start)):
+		universe_list = universe_base[:]
+		for power_role_id, player_id in enumerate(packed_universe):
+			universe_list[player_id] = roles[power_role_id]
+		yield univ_id, "".join(universe_list)
+
+def split_extra_scum(roles): #returns the roles that are handed out in order, and the extra scum
+	named_roles = ''.join(role for role in roles if role not in EXTRA_SCUM_ROLES)
+	return named_roles, roles[len(named_roles):]
+
+def count_canonical_universes(num_players, roles):
+	named_roles, extra_scum = split_extra_scum(roles)
+	return perm(num_players, len(named_roles)) * comb(num_players - len(named_roles), len(extra_scum))
+
+def canonical_universes(num_players, roles): #streams (universe id, role string) pairs for the canonical D1 set. With one extra scum or fewer, it's the same as universes().
+	named_roles, extra_scum = split_extra_scum(roles)
+	universe_base = ['T' for _ in range(num_players)]
+	univ_id = 0
+	for packed_universe in itertools.permutations(range(num_players), len(named_roles)):
+		named_universe = universe_base[:]
+		for power_role_id, player_id in enumerate(packed_universe):
+			named_universe[player_id] = named_roles[power_role_id]
+		for extra_players in itertools.combinations([player_id for player_id, role in enumerate(named_universe) if role == 'T'], len(extra_scum)):
+			universe_list = named_universe[:]
+			for extra_role, player_id in zip(extra_scum, extra_players):
+				universe_list[player_id] = extra_role
+			yield univ_id, "".join(universe_list)
+			univ_id += 1
+
+def canonical_multiplicity(num_scum): #how many universes of the full set each canonical universe stands for, num_scum being the game's mafia (dead or alive). The extra scum could have been handed out in any order.
+	return factorial(max(0, num_scum-3))
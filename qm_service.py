@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+#resident game state service. Run it in the game's directory (qm_service.py serve game.sock) and it keeps the current phase file open, with its role counts and target matrix in memory, so moderator queries don't each cold start and rescan a multi-GB file. It picks up the next phase by itself once day.py or night.py has finished writing it.
+#queries come in over a local socket (a Unix socket path, or a port number for localhost TCP): one JSON object per line, with a "query" and its arguments, and one JSON object per line back - the answer, or {"error": ...}. qm_service.py ask sends one from the command line.
+#the answers are moderator secrets, so if the QM_SERVICE_KEY environment variable is set (the same for serve and ask), every query has to carry it as "key". Every local user can reach a TCP port, so serving on one needs a key. A Unix socket is only reachable by us, so the key is optional there.
+#queries:
+#phase - which phase is loaded, its universe count, liveness and player names
+#probabilities - per player role counts, and their town/power/entangler/scum/dead split (the public probability table)
+#check (player, actions) - check_night_targets.py's verdict on one night submission
+#universes (ids) - universes by ID (null for any that aren't there)
+#vote_preview (player) - on a day phase, how the vote pass would go if that player was voted out: how many universes collapse and what they'd flip as. Cascade collapses and flips come after this and aren't included.
+#reload - load the latest phase now rather than waiting for the next poll
+
+import argparse, asyncio, hmac, json, os, re, socket, struct, qm_shared, qm_targets, qm_permutations, qm_combinatorics
+from sys import exit
+
+poll_interval = 2 #seconds between checks for a new phase file
+
+phase_file_pattern = re.compile(r'universes-([DN])(\d+)\.(txt|bin)$')
+
+def latest_phase(): #the newest D/N phase in the current directory, e.g. 'N2', or None
+	phases = set()
+	for filename in os.listdir('.'):
+		match = phase_file_pattern.match(filename)
+		if match is not None:
+			phases.add((int(match.group(2)), match.group(1) == 'N')) #D2 comes before N2
+	if len(phases) == 0:
+		return None
+	day_num, is_night = max(phases)
+	return qm_shared.phase_name(day_num, not is_night)
+
+def service_key(): #the shared key from QM_SERVICE_KEY, or None if there isn't one
+	key = os.environ.get('QM_SERVICE_KEY')
+	return key if key else None
+
+def service_address(string): #type checker for argparse. A port number means localhost TCP, anything else is a Unix socket path.
+	return ('127.0.0.1', int(string)) if string.isdigit() else string
+
+class GameState: #one phase file, loaded
+	def __init__(self, phase):
+		self.phase = phase
+		self.universe_file = qm_shared.UniverseFile(qm_shared.find_universe_file(phase))
+		self.multiplicity = self.universe_file.multiplicity()
+		stats = qm_shared.read_universe_stats(self.universe_file)
+		d1_counts = qm_combinatorics.d1_role_counts(self.universe_file) if stats is None else None
+		if stats is not None:
+			self.role_counts = stats['role_counts']
+		elif d1_counts is not None: #the D1 set from universe_setup.py, which has no stats - but its counts can be worked out without a scan
+			self.role_counts = d1_counts
+		else: #written before phase files had stats - count them ourselves, once
+			counters = qm_shared.LivenessCounters()
+			for universe in self.universe_file.universes():
+				counters.add(universe)
+			self.role_counts = counters.role_counts if counters.role_counts is not None else [{} for _ in range(self.universe_file.num_players)]
+		self.player_names = qm_shared.read_player_names()
+		self.is_night = phase.startswith('N')
+		self.matrix = qm_targets.target_matrix(self.universe_file) if self.is_night else None
+
+	def close(self):
+		self.universe_file.close()
+
+	def answer(self, request): #the reply to one query
+		query = request.get('query')
+		if query == 'phase':
+			return {
+				'phase': self.phase,
+				'num_universes': self.universe_file.num_universes * self.multiplicity,
+				'liveness': self.universe_file.liveness,
+				'players': [qm_shared.get_player_name(player_idx) for player_idx in range(self.universe_file.num_players)],
+			}
+		if query == 'probabilities':
+			return self.probabilities()
+		if query == 'check':
+			if not self.is_night:
+				return {'error': f"Target checks are for night phases. The current phase is {self.phase}."}
+			problems = qm_targets.check_submission(qm_shared.single_letter(request['player']), request['actions'], self.universe_file.num_players, self.universe_file.liveness, self.universe_file.setup, self.player_names, self.matrix)
+			return {'ok': len(problems) == 0, 'problems': problems}
+		if query == 'universes':
+			return {'universes': self.universe_file.universes_with_ids([int(universe_id) for universe_id in request['ids']])}
+		if query == 'vote_preview':
+			if self.is_night:
+				return {'error': f"Vote previews are for day phases. The current phase is {self.phase}."}
+			return self.vote_preview(qm_shared.player_to_pos(qm_shared.single_letter(request['player'])))
+		return {'error': f"Unknown query {query}."}
+
+	def scaled(self, count):
+		return count * self.multiplicity
+
+	def probabilities(self):
+		num_universes = self.scaled(self.universe_file.num_universes)
+		players = []
+		for player_counts in self.role_counts:
+			counts = {role: self.scaled(count) for role, count in player_counts.items()}
+			power = sum(counts.get(role, 0) for role in 'DFG')
+			split = {
+				'town': counts.get('T', 0) + power,
+				'power': power,
+				'entangler': counts.get('E', 0),
+				'scum': sum(count for role, count in counts.items() if role in qm_permutations.SCUM_ROLES),
+				'dead': counts.get('X', 0) + counts.get('V', 0),
+			}
+			players.append({'role_counts': counts, 'fractions': {key: value / num_universes for key, value in split.items()}})
+		return {'num_universes': num_universes, 'players': players}
+
+	def vote_preview(self, player_idx): #the vote pass (see day.py), worked out from the role counts
+		if self.universe_file.liveness[player_idx][1] != '#':
+			return {'error': "That player is already dead."}
+		counts = {role: self.scaled(count) for role, count in self.role_counts[player_idx].items()}
+		already_dead = counts.get('X', 0)
+		entangler = counts.get('E', 0)
+		nonentangler = sum(count for role, count in counts.items() if role not in 'EXV')
+		flips = {role: count for role, count in counts.items() if role not in 'XV' and (role != 'E' or nonentangler == 0)}
+		return {
+			'collapsed_already_dead': already_dead,
+			'collapsed_entangler': entangler if nonentangler > 0 else 0, #the entangler universes only survive if there's nothing else
+			'surviving': sum(flips.values()),
+			'flips': flips,
+		}
+
+class GameService:
+	def __init__(self, key=None):
+		self.key = key
+		self.state = None
+		self.pending = None #(phase, size, mtime) of a new phase file we're waiting to settle
+		self.load_lock = asyncio.Lock()
+
+	async def load_latest(self, force=False): #loads the newest phase if it's finished being written. Returns whether we have one loaded.
+		async with self.load_lock:
+			phase = latest_phase()
+			if phase is None:
+				return self.state is not None
+			if self.state is not None and self.state.phase == phase and not force:
+				return True
+			filename = qm_shared.find_universe_file(phase)
+			file_state = (phase, os.path.getsize(filename), os.path.getmtime(filename))
+			if not force and not self.finished_writing(filename) and self.pending != file_state:
+				self.pending = file_state #not done yet, as far as we can tell. If it's the same next poll, it's done.
+				return self.state is not None
+			self.pending = None
+			print(f"Loading {filename}...")
+			new_state = await asyncio.to_thread(GameState, phase) #scanning can take a while, and queries on the old phase can carry on meanwhile
+			if self.state is not None:
+				self.state.close()
+			self.state = new_state
+			print(f"Loaded {phase}: {new_state.universe_file.num_universes:,} universes.")
+			return True
+
+	def finished_writing(self, filename): #write_universe_file writes the stats last, so once they're there the phase file is done
+		universe_file = qm_shared.UniverseFile(filename)
+		try:
+			return qm_shared.read_universe_stats(universe_file) is not None
+		finally:
+			universe_file.close()
+
+	async def watch(self):
+		while True:
+			await asyncio.sleep(poll_interval)
+			try:
+				await self.load_latest()
+			except (OSError, ValueError, struct.error) as error: #a file half written, or vanishing under us - try again next poll
+				print(f"Couldn't load the latest phase yet ({type(error).__name__}: {error}).")
+
+	async def handle(self, reader, writer):
+		try:
+			while True:
+				line = await reader.readline()
+				if len(line) == 0:
+					break
+				try:
+					request = json.loads(line)
+					if self.key is not None and not hmac.compare_digest(str(request.get('key', '')).encode('utf-8'), self.key.encode('utf-8')):
+						writer.write(json.dumps({'error': "Wrong or missing key."}).encode('utf-8') + b'\n')
+						await writer.drain()
+						break #no second tries on this connection
+					if request.get('query') == 'reload':
+						await self.load_latest(force=True)
+						reply = {'phase': self.state.phase if self.state is not None else None}
+					elif self.state is None:
+						reply = {'error': "No phase file loaded yet."}
+					else:
+						reply = self.state.answer(request)
+				except (ValueError, KeyError, TypeError, IndexError) as error:
+					reply = {'error': f"Bad query ({type(error).__name__}: {error})."}
+				except (OSError, struct.error) as error: #a reload of a file that's still being written, say
+					reply = {'error': f"Couldn't load the latest phase ({type(error).__name__}: {error})."}
+				writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	async def serve(self, address):
+		qm_shared.read_game_info(0, True) #for the player names
+		await self.load_latest()
+		if isinstance(address, str):
+			if os.path.exists(address):
+				os.remove(address) #left over from an earlier run
+			old_umask = os.umask(0o077) #just us, from the moment it's made
+			try:
+				server = await asyncio.start_unix_server(self.handle, address)
+			finally:
+				os.umask(old_umask)
+		else:
+			server = await asyncio.start_server(self.handle, *address)
+		print(f"Game service listening on {address if isinstance(address, str) else f'{address[0]}:{address[1]}'}.")
+		async with server:
+			await asyncio.gather(server.serve_forever(), self.watch())
+
+def ask(address, request): #sends one query to a running service and returns its reply
+	with socket.socket(socket.AF_UNIX if isinstance(address, str) else socket.AF_INET, socket.SOCK_STREAM) as connection:
+		connection.connect(address)
+		connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+		reply = b''
+		while not reply.endswith(b'\n'):
+			data = connection.recv(65536)
+			if len(data) == 0:
+				break
+			reply += data
+	return json.loads(reply)
+
+def query_arguments(pairs): #key=value pairs from the command line. ids are comma separated.
+	request = {}
+	for pair in pairs:
+		key, _, value = pair.partition('=')
+		request[key] = value.split(',') if key == 'ids' else value
+	return request
+
+def main():
+	parser = argparse.ArgumentParser(
+						prog='Quantumafia Game Service',
+						description="This keeps the current phase of a game loaded and answers queries about it (see the top of qm_service.py), so each query doesn't rescan the universe file.")
+	subparsers = parser.add_subparsers(dest='command', required=True)
+	serve_parser = subparsers.add_parser('serve', help="Run the service in the game's directory.")
+	serve_parser.add_argument('address', type=service_address, help="Where to listen: a Unix socket path, or a port number for localhost TCP (which needs QM_SERVICE_KEY set).")
+	ask_parser = subparsers.add_parser('ask', help="Send a query to a running service and print the reply.")
+	ask_parser.add_argument('address', type=service_address, help="The service's socket path or port number.")
+	ask_parser.add_argument('query', help="phase, probabilities, check, universes, vote_preview or reload.")
+	ask_parser.add_argument('arguments', nargs='*', help="The query's arguments as key=value, e.g. player=B actions=EMBLJ, or ids=5,17,1234.")
+	args = parser.parse_args()
+
+	key = service_key()
+	if args.command == 'serve':
+		if key is None and not isinstance(args.address, str):
+			print("Every local user can reach a TCP port, so set the QM_SERVICE_KEY environment variable to a shared key first (the same for serve and ask), or serve on a Unix socket path.")
+			exit()
+		try:
+			asyncio.run(GameService(key).serve(args.address))
+		except KeyboardInterrupt:
+			pass
+		return
+	try:
+		reply = ask(args.address, {'query': args.query, **query_arguments(args.arguments), **({'key': key} if key is not None else {})})
+	except OSError as error:
+		print(f"Couldn't reach the game service ({type(error).__name__}: {error}).")
+		exit()
+	print(json.dumps(reply, indent=1))
+
+if __name__ == "__main__":
+	main()
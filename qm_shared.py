@@ -1,14 +1,32 @@
 #for later - if a NK would kill an entangler, they can't have been the entangler, so mark those universes as contradictory (collapse them).
 
-import random, mmap, os
+import random, mmap, os, struct, itertools, bisect, json
+from operator import itemgetter
 from sys import exit, stdout
 from traceback import print_stack
+from math import log10, ceil
+import qm_permutations, qm_vector, qm_stream, qm_checkpoint
 
 universe_file = None
+orig_universe_file = None #the D1 file, for looking up original roles. may be the same object as universe_file
 player_names = None
 player_codewords = None
 flip_was_setup = False
 can_entangle_results = []
+liveness_counters = None #set by cascade once it starts flipping, or handed to it by the pass that made the buffer
+binary_universes = False #set when we read a phase file in. Output files are written in the same format as the input.
+canonical_universes = False #same, for canonical universe sets (universe_setup.py --canonical)
+checkpoint_phase = None #set by day.py/night.py to turn on checkpoints for the phase they're transitioning
+checkpoint_args = None #the arguments the transition was run with. A checkpoint is only resumed with the same ones.
+
+#binary phase file format:
+#header = magic, total players, players left, num scum, role flags (bit 0 detective, 1 entangler, 2 follower, 3 guard, 4 canonical universe set, 5 implicit D1 set), bytes per universe ID, digits per universe ID (for converting back to text), num universes, length of actions string
+#then the liveness string (2 bytes per player), then the actions string, then fixed width records: little-endian universe ID + 1 byte per player (same role letters as the text format)
+BINARY_MAGIC = b'QMU1'
+binary_header = struct.Struct('<4sBBBBBBQH')
+id_struct_codes = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+normalize_scum_roles = bytes.maketrans(qm_permutations.SCUM_ROLES[1:].encode('ascii'), b'A'*(len(qm_permutations.SCUM_ROLES)-1)) #for bytes.translate(). Flip can't tell scum apart.
+universe_chunk_size = 65536 #universes read from the phase file at a time
 
 def player_to_pos(letter):
 	if letter == '#':
@@ -20,9 +38,6 @@ def player_to_pos(letter):
 def pos_to_player(pos):
 	return chr(65+pos)
 	
-def parse_universe(universe):
-	return universe.decode('utf-8').rstrip("\n").split(sep="-", maxsplit=1)
-
 def oxford_comma(termlist, lastitem_prefix):
 	if len(termlist) == 1:
 		return termlist[0]
@@ -65,19 +80,16 @@ def read_game_info(day_num, is_day):
 		exit()
 		
 def read_current_info(day_num, is_day):
-	global universe_file, current_setup, player_liveness, num_universes
+	global universe_file, current_setup, player_liveness, num_universes, binary_universes, canonical_universes
 	
 	get_universe_file(day_num, is_day)
 	assert universe_file is not None
 	
-	universe_file.seek(0)
-	current_setup_string = universe_file.readline().decode('utf-8').rstrip('\n')
-	setup_string_list = current_setup_string.split(sep="-", maxsplit=2)
-	current_setup = [int(setup_string_list[0]), int(setup_string_list[1]), *[char == '1' for char in setup_string_list[2]]] #num players, num mafia, detective, entangler, follower, guard
-	player_liveness_string = universe_file.readline().decode('utf-8').rstrip('\n')
-	player_liveness = [player_liveness_string[x*2:(x+1)*2] for x in range(orig_setup[0])]
-	num_universes = int(universe_file.readline().decode('utf-8').rstrip('\n'))
-	universe_file.readline() #skip actions
+	current_setup = universe_file.setup[:] #num players, num mafia, detective, entangler, follower, guard
+	player_liveness = universe_file.liveness[:orig_setup[0]]
+	num_universes = universe_file.num_universes
+	binary_universes = universe_file.is_binary
+	canonical_universes = universe_file.is_canonical
 	return current_setup, player_liveness, num_universes		
 		
 def read_player_names():
@@ -116,36 +128,212 @@ def get_player_codeword(player_index):
 	codeword_index = player_board_order.index(pos_to_player(player_index))
 	return player_codewords[codeword_index]
 
+def phase_name(day_num, is_day):
+	return f"{'D' if is_day else 'N'}{day_num}"
+
+def universe_file_name(phase, binary=None): #phase is D1, N3, final, etc.
+	if binary is None:
+		binary = binary_universes #match whatever we read in
+	return f"universes-{phase}.{'bin' if binary else 'txt'}"
+
+def find_universe_file(phase): #prefer the binary file if both exist (i.e. after a conversion)
+	for binary in (True, False):
+		if os.path.exists(universe_file_name(phase, binary)):
+			return universe_file_name(phase, binary)
+	return universe_file_name(phase, False) #doesn't exist - let the open fail as it always has
+
+def universe_file_exists(phase):
+	return any(os.path.exists(universe_file_name(phase, binary)) for binary in (True, False))
+
+def id_bytes_for_digits(num_digits):
+	max_id_bits = (10**num_digits - 1).bit_length()
+	return min(size for size in id_struct_codes if size*8 >= max_id_bits)
+
+class UniverseFile:
+	#a phase file, text or binary, mmapped. Both formats have fixed width records, so we can read them a chunk at a time or jump straight to a record.
+	def __init__(self, filename):
+		self.filename = filename
+		self.filedesc = os.open(filename, os.O_RDONLY)	#NOT the same as regular open()
+		self.mm = mmap.mmap(self.filedesc, 0, access=mmap.ACCESS_READ)
+		self.is_binary = self.mm[:len(BINARY_MAGIC)] == BINARY_MAGIC
+		if self.is_binary:
+			_, self.num_players, players_left, num_scum, role_flags, self.id_bytes, self.num_digits, self.num_universes, actions_len = binary_header.unpack_from(self.mm, 0)
+			self.setup = [players_left, num_scum, *[bool(role_flags & (1 << bit)) for bit in range(4)]]
+			self.is_canonical = bool(role_flags & (1 << 4))
+			flagged_implicit = bool(role_flags & (1 << 5))
+			liveness_start = binary_header.size
+			liveness_string = self.mm[liveness_start:liveness_start + 2*self.num_players].decode('ascii')
+			self.actions = self.mm[liveness_start + 2*self.num_players:liveness_start + 2*self.num_players + actions_len].decode('ascii')
+			self.records_start = liveness_start + 2*self.num_players + actions_len
+			self.roles_offset = self.id_bytes
+			self.record_len = self.id_bytes + self.num_players
+			self.record_struct = struct.Struct(f'<{id_struct_codes[self.id_bytes]}{self.num_players}s')
+		else:
+			self.mm.seek(0)
+			setup_string_list = self.mm.readline().decode('utf-8').rstrip('\n').split(sep="-", maxsplit=2)
+			self.setup = [int(setup_string_list[0]), int(setup_string_list[1]), *[char == '1' for char in setup_string_list[2][:4]]]
+			self.is_canonical = setup_string_list[2][4:5] == '1' #optional 5th flag
+			flagged_implicit = setup_string_list[2][5:6] == '1' #optional 6th flag
+			liveness_string = self.mm.readline().decode('utf-8').rstrip('\n')
+			self.num_players = len(liveness_string) // 2
+			self.num_universes = int(self.mm.readline().decode('utf-8').rstrip('\n'))
+			self.actions = self.mm.readline().decode('utf-8').rstrip('\n')
+			self.records_start = self.mm.tell()
+			first_universe = self.mm.readline().decode('utf-8').rstrip('\n')
+			self.num_digits = len(first_universe.split(sep="-", maxsplit=1)[0])
+			self.roles_offset = self.num_digits + 1 #skip the dash too
+			self.record_len = self.roles_offset + self.num_players + 1 #include length of newline
+		self.liveness = [liveness_string[x*2:(x+1)*2] for x in range(self.num_players)]
+		#an implicit D1 file (universe_setup.py --implicit) is just the header, flagged as implicit. Its universes are generated from their IDs instead (see qm_permutations.py).
+		if not flagged_implicit and self.records_start >= len(self.mm) and self.num_universes > 0:
+			raise ValueError(f"{filename} says it has {self.num_universes} universes, but there are no universe records in it. It may be truncated, or still being written.")
+		if flagged_implicit and not self.is_whole_d1_set():
+			raise ValueError(f"{filename} is marked as an implicit Day 1 file, but its game state isn't the whole Day 1 set.")
+		self.is_implicit = flagged_implicit
+		if self.is_implicit:
+			self.power_roles = qm_permutations.power_roles(self.setup)
+			if not self.is_binary:
+				self.num_digits = ceil(log10(self.num_universes)) #no first record to measure
+				self.roles_offset = self.num_digits + 1
+				self.record_len = self.roles_offset + self.num_players + 1
+		
+	def is_whole_d1_set(self): #does the header describe the full D1 set: nobody dead, and every universe there
+		roles = qm_permutations.power_roles(self.setup)
+		return not self.is_canonical and all(item == '##' for item in self.liveness) and self.num_universes == qm_permutations.count_universes(self.num_players, len(roles))
+
+	def universes(self, start=0, stop=None): #yields (universe id, role string) for records [start, stop)
+		if self.is_implicit:
+			yield from qm_permutations.universes(self.num_players, self.power_roles, start, stop)
+			return
+		if stop is None or stop > self.num_universes:
+			stop = self.num_universes
+		record_len = self.record_len
+		roles_offset = self.roles_offset
+		roles_end = roles_offset + self.num_players
+		while start < stop:
+			chunk_universes = min(universe_chunk_size, stop - start)
+			chunk_start = self.records_start + start*record_len
+			chunk = self.mm[chunk_start:chunk_start + chunk_universes*record_len]
+			if self.is_binary:
+				for universe_id, roles in self.record_struct.iter_unpack(chunk):
+					yield universe_id, roles.decode('ascii')
+			else:
+				chunk = chunk.decode('ascii') #one decode per chunk rather than per line. last record has no newline, but we slice by offset so that's fine
+				for offset in range(0, chunk_universes*record_len, record_len):
+					yield int(chunk[offset:offset+roles_offset-1]), chunk[offset+roles_offset:offset+roles_end]
+			start += chunk_universes
+			
+	def role_at(self, record_idx, player_idx):
+		if self.is_implicit:
+			return qm_permutations.role_in_universe(record_idx, player_idx, self.num_players, self.power_roles)
+		return chr(self.mm[self.records_start + record_idx*self.record_len + self.roles_offset + player_idx])
+
+	def roles_at(self, record_idxs, player_idxs): #role_at for many records and players in one call. Returns bytes, record by record, one byte per player asked for.
+		num_wanted = len(player_idxs)
+		roles = bytearray(len(record_idxs) * num_wanted)
+		if self.is_implicit:
+			for out_idx, record_idx in enumerate(record_idxs):
+				universe = qm_permutations.universe_from_id(record_idx, self.num_players, self.power_roles)
+				roles[out_idx*num_wanted:(out_idx+1)*num_wanted] = "".join(universe[player_idx] for player_idx in player_idxs).encode('ascii')
+			return bytes(roles)
+		#read the records in file order, whatever order they were asked for in. Buffers are normally in ID order already, so usually there's nothing to sort.
+		if all(record_idxs[idx] <= record_idxs[idx+1] for idx in range(len(record_idxs)-1)):
+			read_order = range(len(record_idxs))
+		else:
+			read_order = sorted(range(len(record_idxs)), key=record_idxs.__getitem__)
+		mm = self.mm
+		roles_start = self.records_start + self.roles_offset
+		record_len = self.record_len
+		if num_wanted == 1:
+			player_offset = roles_start + player_idxs[0]
+			for out_idx in read_order:
+				roles[out_idx] = mm[player_offset + record_idxs[out_idx]*record_len]
+		else:
+			pick_players = itemgetter(*player_idxs)
+			for out_idx in read_order:
+				record_roles_start = roles_start + record_idxs[out_idx]*record_len
+				roles[out_idx*num_wanted:(out_idx+1)*num_wanted] = pick_players(mm[record_roles_start:record_roles_start + self.num_players])
+		return bytes(roles)
+			
+	def id_at(self, record_idx): #universe ID of a record
+		if self.is_implicit:
+			return record_idx #the implicit D1 set is every universe, in ID order
+		record_start = self.records_start + record_idx*self.record_len
+		if self.is_binary:
+			return int.from_bytes(self.mm[record_start:record_start + self.id_bytes], 'little')
+		return int(self.mm[record_start:record_start + self.roles_offset - 1])
+
+	def find_id(self, universe_id, lo=0): #index of the first record from lo on with an ID at least universe_id. Records are in ID order, so this is a binary search - galloping out from lo first, so walking forward through the file a few records at a time stays cheap.
+		step = 1
+		hi = lo
+		while hi < self.num_universes and self.id_at(hi) < universe_id:
+			lo = hi + 1
+			hi = lo + step
+			step *= 2
+		return bisect.bisect_left(range(self.num_universes), universe_id, lo, min(hi, self.num_universes), key=self.id_at)
+
+	def universe_at(self, record_idx): #(universe id, role string) of a record
+		if self.is_implicit:
+			return record_idx, "".join(qm_permutations.universe_from_id(record_idx, self.num_players, self.power_roles))
+		record_start = self.records_start + record_idx*self.record_len
+		if self.is_binary:
+			universe_id, roles = self.record_struct.unpack_from(self.mm, record_start)
+			return universe_id, roles.decode('ascii')
+		record = self.mm[record_start:record_start + self.roles_offset + self.num_players].decode('ascii')
+		return int(record[:self.roles_offset-1]), record[self.roles_offset:]
+
+	def universe_with_id(self, universe_id): #(universe id, role string), or None if there's no such universe (it never existed, or it's collapsed)
+		record_idx = self.find_id(universe_id)
+		if record_idx < self.num_universes and self.id_at(record_idx) == universe_id:
+			return self.universe_at(record_idx)
+		return None
+
+	def universes_with_ids(self, universe_ids): #universe_with_id for a batch of IDs, in the order given. IDs in ascending order (the usual) are found in one forward sweep.
+		if all(universe_ids[idx] <= universe_ids[idx+1] for idx in range(len(universe_ids)-1)):
+			lookup_order = range(len(universe_ids))
+		else:
+			lookup_order = sorted(range(len(universe_ids)), key=universe_ids.__getitem__)
+		found = [None for _ in universe_ids]
+		record_idx = 0
+		for out_idx in lookup_order:
+			record_idx = self.find_id(universe_ids[out_idx], record_idx)
+			if record_idx < self.num_universes and self.id_at(record_idx) == universe_ids[out_idx]:
+				found[out_idx] = self.universe_at(record_idx)
+		return found
+
+	def universes_by_id(self, start_id=0, stop_id=None): #yields (universe id, role string) for every universe with start_id <= ID < stop_id
+		yield from self.universes(self.find_id(start_id), self.find_id(stop_id) if stop_id is not None else None)
+
+	def multiplicity(self): #how many universes of the full set each universe here stands for. Always 1 unless it's a canonical set. Nothing tells the extra scum apart - not flips, and not promotion (see day.py's promote_scum) - so it's the same for every universe in every phase.
+		if not self.is_canonical:
+			return 1
+		num_dead_scum = sum(1 for item in self.liveness if item[0] in qm_permutations.SCUM_ROLES and item[1] in 'XV')
+		return qm_permutations.canonical_multiplicity(self.setup[1] + num_dead_scum)
+
+	def close(self):
+		self.mm.close()
+		os.close(self.filedesc)
+
 def get_universe_file(day_num, is_day, switch=False):
-	global universe_filedesc, universe_file, universe_file_num, universe_file_is_day #store state
+	global universe_file, universe_file_num, universe_file_is_day #store state
 	if universe_file is not None and switch and (universe_file_num != day_num or universe_file_is_day != is_day): #only switch if we want a different file from the one we already have open
 		close_universe_file()
 	if universe_file is None:
-		universe_filedesc = os.open(f"universes-{'D' if is_day else 'N'}{day_num}.txt", os.O_RDONLY)	#NOT the same as regular open()
-		universe_file = mmap.mmap(universe_filedesc, 0, access=mmap.ACCESS_READ)
+		universe_file = UniverseFile(find_universe_file(phase_name(day_num, is_day)))
 		universe_file_num = day_num
 		universe_file_is_day = is_day
 	return universe_file	
 
 def close_universe_file():
-	global universe_filedesc, universe_file #retrieve state
+	global universe_file #retrieve state
 	assert universe_file is not None
 	universe_file.close()
-	os.close(universe_filedesc)
 	universe_file = None
 
 def get_universe_file_metrics():
-	global universe_filedesc, universe_file, universe_line_chars, universe_num_digits, universe_records_start
-	assert universe_file is not None
-	universe_file.seek(0)		
-	universe_file.readline() #skip 4 lines to get to actual universes
-	universe_file.readline()
-	universe_file.readline()
-	universe_file.readline()
-	universe_records_start = universe_file.tell()
-	single_universe = universe_file.readline().decode('utf-8').rstrip("\n")
-	universe_line_chars = len(single_universe) + 1 #include length of newline
-	universe_num_digits = len(single_universe.split(sep="-", maxsplit=1)[0])
+	global orig_universe_file, universe_num_digits
+	assert orig_universe_file is not None
+	universe_num_digits = orig_universe_file.num_digits
 	
 def read_masonry_file(filename):
 	with open(filename, 'r') as masonrylist:
@@ -181,37 +369,156 @@ def write_masonry_file(masonries, filename):
 		exit()
 	#write masonry file
 	
-def write_universe_file(universes, filename, liveness, setup, actions):
+def write_universe_header(file_handle, binary, liveness, setup, num_universes, actions, num_digits, canonical=False, implicit=False):
+	if binary:
+		file_handle.write(binary_header.pack(BINARY_MAGIC, len(liveness), setup[0], setup[1], sum(1 << bit for bit, item in enumerate([*setup[2:6], canonical, implicit]) if item), id_bytes_for_digits(num_digits), num_digits, num_universes, len(actions)))
+		file_handle.write("".join(liveness).encode('ascii'))
+		file_handle.write(actions.encode('ascii'))
+	else:
+		file_handle.write("{}-{}-{}{}{}{}{}{}\n{}\n{}\n{}\n".format(
+			setup[0], setup[1], 
+			*(1 if item else 0 for item in setup[2:6]),
+			"1" if canonical else ("0" if implicit else ""), #only canonical sets get the 5th flag - unless there's a 6th after it
+			"1" if implicit else "", #and only implicit D1 sets get the 6th
+
+			"".join(liveness), 
+			num_universes, #number of universes
+			actions
+			))
+
+def new_universe_buffer(num_players, vectorized=False, stream=False): #the output buffer for a transition pass. A plain list unless we've been asked for something leaner.
+	if vectorized:
+		return qm_vector.UniverseBuilder(num_players)
+	if stream:
+		return qm_stream.SpillBuffer(num_players, universe_chunk_size)
+	return []
+
+def is_vectorized(universes): #True for a qm_vector.UniverseMatrix, which has its own versions of the buffer-scanning functions below
+	return getattr(universes, 'is_vectorized', False)
+
+def counted_universes(universes, counters): #passes the universes through, adding each to counters on the way (if there are any)
+	if counters is None:
+		yield from universes
+		return
+	for universe in universes:
+		counters.add(universe)
+		yield universe
+
+def write_universe_records(file_handle, universes, binary, num_digits, num_players, counters=None): #counters, if given, counts the universes as they're written. Not for vectorized buffers, which can count themselves.
+	if is_vectorized(universes):
+		universes.write_records(file_handle, binary, num_digits, id_bytes_for_digits(num_digits), universe_chunk_size)
+	elif binary:
+		record_struct = struct.Struct(f'<{id_struct_codes[id_bytes_for_digits(num_digits)]}{num_players}s')
+		chunk = []
+		for universe in counted_universes(universes, counters):
+			chunk.append(record_struct.pack(universe[0], "".join(universe[1]).encode('ascii')))
+			if len(chunk) >= universe_chunk_size:
+				file_handle.write(b"".join(chunk))
+				chunk = []
+		file_handle.write(b"".join(chunk))
+	else:
+		universe_format = "{:0"+str(num_digits)+"}-{}"
+		packed_universes = (universe_format.format(universe[0],"".join(universe[1])) for universe in counted_universes(universes, counters))
+		write_lines_to_file(file_handle, packed_universes)
+	
+def write_universe_file(universes, filename, liveness, setup, actions, binary=None):
 	global universe_num_digits
-	universe_format = "{:0"+str(universe_num_digits)+"}-{}"
+	if binary is None:
+		binary = binary_universes
+	counters = counters_for(universes) #the pass, cascade and flips may have counted everything already
+	if counters is None and is_vectorized(universes):
+		counters = LivenessCounters(universes)
+	counting_counters = LivenessCounters() if counters is None else None #otherwise we count as we write
 	try:
-		with open(filename, 'x') as output_universes:
-			output_universes.write("{}-{}-{}{}{}{}\n{}\n{}\n{}\n".format(
-				setup[0], setup[1], 
-				*(1 if item else 0 for item in setup[2:]),			
-				"".join(liveness), 
-				len(universes), #number of universes
-				actions
-				))
-				
-			packed_universes = (universe_format.format(universe[0],"".join(universe[1])) for universe in universes)
-			write_lines_to_file(output_universes, packed_universes)
+		with open(filename, 'xb' if binary else 'x') as output_universes:
+			write_universe_header(output_universes, binary, liveness, setup, len(universes), actions, universe_num_digits, canonical_universes)
+			write_universe_records(output_universes, universes, binary, universe_num_digits, len(liveness), counting_counters)
 	
 	except FileExistsError:
 		print(f"Error - Can't write to the universe file, {filename} - it already exists.")
 		exit()
 		#write universe file
+	write_universe_stats(filename, counters if counters is not None else counting_counters, len(universes), len(liveness))
+	clear_checkpoint() #the transition's done
+
+#phase file statistics (universes-D2.stats, say), written next to every phase file so the DM printer doesn't have to scan the whole file for per-player counts. Plain JSON: num_universes, then per player role_counts ({role letter or X/V: records}), alive_counts and entangler_counts. Counts are of records, so a canonical set still needs scaling by its multiplicity. The text and binary versions of a phase share one.
+def sidecar_file_name(universe_filename, extension): #a file that goes with a phase file, e.g. universes-D2.stats
+	return os.path.splitext(universe_filename)[0] + extension
+
+def read_sidecar(universe_file, extension): #a phase file's JSON sidecar, or None if it's missing or doesn't match the phase file
+	sidecar_filename = sidecar_file_name(universe_file.filename, extension)
+	if not os.path.exists(sidecar_filename) or os.path.getmtime(sidecar_filename) < os.path.getmtime(universe_file.filename): #they're written after the phase file, so older ones are left over from something else
+		return None
+	with open(sidecar_filename, 'r') as sidecar_file:
+		try:
+			sidecar = json.load(sidecar_file)
+		except ValueError:
+			return None
+	if sidecar.get('num_universes') != universe_file.num_universes:
+		return None
+	return sidecar
+
+def stats_file_name(universe_filename):
+	return sidecar_file_name(universe_filename, ".stats")
+
+def write_universe_stats(universe_filename, counters, num_universes, num_players):
+	role_counts = [{role: count for role, count in sorted(player_counts.items()) if count > 0} for player_counts in counters.role_counts] if counters.role_counts is not None else [{} for _ in range(num_players)]
+	with open(stats_file_name(universe_filename), 'w') as stats_file: #overwrite - anything already there is from an earlier run of this transition
+		json.dump({
+			'num_universes': num_universes,
+			'role_counts': role_counts,
+			'alive_counts': [sum(count for role, count in player_counts.items() if role not in 'XV') for player_counts in role_counts],
+			'entangler_counts': [player_counts.get('E', 0) for player_counts in role_counts],
+		}, stats_file)
+
+def read_universe_stats(universe_file): #the statistics for an open UniverseFile, or None if there aren't any we can trust
+	stats = read_sidecar(universe_file, ".stats")
+	if stats is None or len(stats.get('role_counts', [])) != universe_file.num_players:
+		return None
+	return stats
 		
-def write_final_universe_file(universes, filename):
+def write_final_universe_file(universes, filename, liveness=None, setup=None, binary=None):
+	global universe_num_digits
+	if binary is None:
+		binary = binary_universes
 	try:
-		with open(filename, 'x') as output_universes:
-			packed_universes = ("{}-{}".format(universe[0],"".join(universe[1])) for universe in universes)
-			write_lines_to_file(output_universes, packed_universes)
+		with open(filename, 'xb' if binary else 'x') as output_universes:
+			if binary:
+				#the binary format always has a header, so the final file can be read back in (and converted) like any other
+				write_universe_header(output_universes, binary, liveness if liveness is not None else player_liveness, setup if setup is not None else current_setup, len(universes), "", universe_num_digits, canonical_universes)
+			write_universe_records(output_universes, universes, binary, universe_num_digits, len(player_liveness))
 	
 	except FileExistsError:
 		print(f"Error - Can't write to the final universe file, {filename} - it already exists.")
 		exit()
 		#write universe file
+	clear_checkpoint()
+
+def save_checkpoint(stage, universe_buffer, **state):
+	global checkpoint_phase, checkpoint_args, random_source
+	if checkpoint_phase is None:
+		return
+	qm_checkpoint.write_checkpoint(qm_checkpoint.checkpoint_file_name(checkpoint_phase), {'phase': checkpoint_phase, 'args': checkpoint_args, 'stage': stage, 'rng_state': random_source.getstate(), **state}, universe_buffer, orig_setup[0], universe_chunk_size)
+
+def load_checkpoint(phase, transition_args, vectorized=False, stream=False): #returns the checkpoint's state dict and its universes as a buffer. Also restores the RNG.
+	global random_source
+	state, universes = qm_checkpoint.read_checkpoint(qm_checkpoint.checkpoint_file_name(phase))
+	if state['phase'] != phase or state['args'] != transition_args:
+		print(f"The checkpoint for {phase} was made with different arguments ({state['args']}). Run with those to resume, or run without --resume to start over.")
+		exit()
+	print(f"Resuming from the checkpoint after the {state['stage']} stage...")
+	universe_buffer = new_universe_buffer(state['num_players'], vectorized, stream)
+	for universe_id, roles in universes:
+		universe_buffer.append([universe_id, [*roles]])
+	if vectorized:
+		universe_buffer = universe_buffer.finish()
+	random_source.setstate(state['rng_state'])
+	return state, universe_buffer
+
+def clear_checkpoint():
+	global checkpoint_phase
+	if checkpoint_phase is not None:
+		qm_checkpoint.remove_checkpoint(qm_checkpoint.checkpoint_file_name(checkpoint_phase))
 
 def write_lines_to_file(file_handle, lines):
 	first_line = True
@@ -224,6 +531,8 @@ def write_lines_to_file(file_handle, lines):
 	
 def compare_livenesses(universe_buffer, original_liveness):
 	current_livenesses = [single_liveness[1] != '#' for single_liveness in original_liveness] #False means indeterminacy. True means either dead in all universes (previously reported) or alive in one or more universes.
+	if is_vectorized(universe_buffer):
+		return universe_buffer.compare_livenesses(current_livenesses)
 
 	for universe_chunk in universe_buffer:
 		for this_idx in (idx for idx, is_determinate in enumerate(current_livenesses) if not is_determinate): #only check if indeterminate players are alive
@@ -238,21 +547,42 @@ def transform_liveness_roles(universe_buffer, incoming_liveness): #this fn updat
 	updated_livenesses = incoming_liveness[:] #make a copy
 	needs_checking = [item[0] == '#' for item in incoming_liveness] #role
 	check_results = [None for item in incoming_liveness]
-
-	for universe_chunk in universe_buffer:
-		for this_idx in (idx for idx, check_this_player in enumerate(needs_checking) if check_this_player): #only check players who we're not sure about
-			role = universe_chunk[1][this_idx]
-			if role in 'ABC':
-				role = 'A' #normalize mafia roles
-			if role in 'XV': #get original state from dead
-				role = get_player_role_in_orig_universe(this_idx, int(universe_chunk[0]))
-			if check_results[this_idx] is None: #check if state is not yet seen in any universe
-				check_results[this_idx] = role
-			elif check_results[this_idx] != role: #...or check if state mismatches the last one we saw. 
-				needs_checking[this_idx] = False #this resets to none and disqualifies from further checking.
-				check_results[this_idx] = None
-		if not any(needs_checking): #end early if everyone who needs checking is indeterminate
-			break
+	counters = counters_for(universe_buffer)
+	if counters is not None: #we've already counted every role, which settles most players without a scan
+		needs_checking, check_results = counters.settle_roles(needs_checking)
+	if any(needs_checking): #otherwise the counts settled everyone
+		if is_vectorized(universe_buffer):
+			flip_setup() #for the original roles of dead players
+			scan_results = universe_buffer.liveness_roles(needs_checking, orig_universe_file)
+			check_results = [scan_results[idx] if check_this_player else check_results[idx] for idx, check_this_player in enumerate(needs_checking)]
+		else:
+			flip_setup() #for the original roles of dead players
+			universe_iter = iter(universe_buffer)
+			while any(needs_checking): #end early if everyone who needs checking is indeterminate
+				universe_chunk = list(itertools.islice(universe_iter, universe_chunk_size))
+				if len(universe_chunk) == 0:
+					break
+				#look up the original roles of every dead player we're checking, for the whole chunk at once
+				checking_players = [idx for idx, check_this_player in enumerate(needs_checking) if check_this_player]
+				dead_universe_ids = [int(universe[0]) for universe in universe_chunk if any(universe[1][idx] in 'XV' for idx in checking_players)]
+				dead_roles = orig_universe_file.roles_at(dead_universe_ids, checking_players).decode('ascii')
+				orig_roles = {universe_id: dead_roles[idx*len(checking_players):(idx+1)*len(checking_players)] for idx, universe_id in enumerate(dead_universe_ids)}
+				for universe in universe_chunk:
+					for check_idx, this_idx in enumerate(checking_players):
+						if not needs_checking[this_idx]: #only check players who we're not sure about
+							continue
+						role = universe[1][this_idx]
+						if role in qm_permutations.SCUM_ROLES:
+							role = 'A' #normalize mafia roles
+						if role in 'XV': #get original state from dead
+							role = orig_roles[int(universe[0])][check_idx]
+						if check_results[this_idx] is None: #check if state is not yet seen in any universe
+							check_results[this_idx] = role
+						elif check_results[this_idx] != role: #...or check if state mismatches the last one we saw. 
+							needs_checking[this_idx] = False #this resets to none and disqualifies from further checking.
+							check_results[this_idx] = None
+					if not any(needs_checking):
+						break
 
 	for player_id, state in enumerate(check_results):
 		if state is not None:
@@ -290,25 +620,161 @@ def get_can_entangle(liveness, universes):
 		return can_entangle_results
 	can_entangle_results  = [None if item[1] == '#' and item[0] == '#' else False for item in liveness] #if a single player is fixed as entangler they rather paradoxically can't entangle so...
 	#None means indeterminate btw
-	for universe in universes:
-		entangler_idx = universe[1].index('E')
-		if can_entangle_results[entangler_idx] is None:
-			can_entangle_results[entangler_idx] = True
-			if all(item is not None for item in can_entangle_results):
-				break
+	counters = counters_for(universes)
+	if counters is not None:
+		for entangler_idx, player_counts in enumerate(counters.role_counts):
+			if can_entangle_results[entangler_idx] is None and player_counts.get('E', 0) > 0:
+				can_entangle_results[entangler_idx] = True
+	elif is_vectorized(universes):
+		for entangler_idx in universes.entangler_positions():
+			if can_entangle_results[entangler_idx] is None:
+				can_entangle_results[entangler_idx] = True
+	else:
+		for universe in universes:
+			entangler_idx = universe[1].index('E')
+			if can_entangle_results[entangler_idx] is None:
+				can_entangle_results[entangler_idx] = True
+				if all(item is not None for item in can_entangle_results):
+					break
 	for idx, item in enumerate(can_entangle_results):
 		if item is None:
 			can_entangle_results[idx] = False #if we didn't find an entangler record for this player after scanning all universes, mark it as false
 	return can_entangle_results
 	
+class LivenessCounters:
+	#how many universes each player holds each role letter (or X/V) in, across the universe buffer, and how many universes have each number of living non-scum players (for check_scum_victory). Built once when cascade starts flipping - or gathered by the pass that made the buffer, through a CountedBuffer - then kept up to date as flip removes universes, so spotting newly 100% dead players, settling roles, checking for victory and the entangler tiebreaker don't need another full scan.
+	#it's a universe accumulator: add() and remove() a universe at a time, and merge() the counts of another run of universes (a shard, see qm_parallel.py). Anything else with those three can ride along in a CountedBuffer too.
+	def __init__(self, universe_buffer=None):
+		self.universe_buffer = universe_buffer #None until the buffer's finished, if we're being filled in by a pass
+		self.role_counts = None
+		self.nonscum_alive_counts = {} #number of living non-scum players -> universes. None if we've lost track (see subtract)
+		if universe_buffer is None:
+			return
+		if is_vectorized(universe_buffer):
+			self.role_counts = universe_buffer.role_counts()
+			self.nonscum_alive_counts = None #its own scum_victory_scan is fast enough
+			return
+		for universe in universe_buffer:
+			self.add(universe)
+
+	def add(self, universe):
+		if self.role_counts is None:
+			self.role_counts = [{} for _ in universe[1]]
+		num_nonscum_alive = 0
+		for player_counts, role in zip(self.role_counts, universe[1]):
+			player_counts[role] = player_counts.get(role, 0) + 1
+			if role not in qm_permutations.SCUM_ROLES + 'XV':
+				num_nonscum_alive += 1
+		if self.nonscum_alive_counts is not None:
+			self.nonscum_alive_counts[num_nonscum_alive] = self.nonscum_alive_counts.get(num_nonscum_alive, 0) + 1
+
+	def remove(self, universe): #call for each universe flip collapses
+		for player_counts, role in zip(self.role_counts, universe[1]):
+			player_counts[role] -= 1
+		if self.nonscum_alive_counts is not None:
+			self.nonscum_alive_counts[sum(1 for role in universe[1] if role not in qm_permutations.SCUM_ROLES + 'XV')] -= 1
+
+	def subtract(self, role_counts): #same, for a whole batch of universes at once. Per player counts can't tell us how many non-scum each universe had left, so we stop tracking that.
+		for player_counts, removed_counts in zip(self.role_counts, role_counts):
+			for role, count in removed_counts.items():
+				player_counts[role] -= count
+		self.nonscum_alive_counts = None
+
+	def merge(self, other):
+		if self.role_counts is None:
+			self.role_counts = other.role_counts
+		elif other.role_counts is not None:
+			for player_counts, other_counts in zip(self.role_counts, other.role_counts):
+				for role, count in other_counts.items():
+					player_counts[role] = player_counts.get(role, 0) + count
+		if self.nonscum_alive_counts is None or other.nonscum_alive_counts is None:
+			self.nonscum_alive_counts = None
+		else:
+			for num_nonscum_alive, count in other.nonscum_alive_counts.items():
+				self.nonscum_alive_counts[num_nonscum_alive] = self.nonscum_alive_counts.get(num_nonscum_alive, 0) + count
+
+	def alive_counts(self): #number of universes each player is alive in
+		return [sum(count for role, count in player_counts.items() if role not in 'XV') for player_counts in self.role_counts]
+
+	def scum_victory_scan(self, num_scum_left): #same results as check_scum_victory's scan, or None if we haven't kept track
+		if self.nonscum_alive_counts is None or self.role_counts is None:
+			return None
+		indeterminate_universe_found = any(count > 0 for num_nonscum_alive, count in self.nonscum_alive_counts.items() if num_nonscum_alive >= num_scum_left)
+		always_scum = [not any(count > 0 for role, count in player_counts.items() if role not in qm_permutations.SCUM_ROLES) for player_counts in self.role_counts]
+		sometimes_scum = [any(count > 0 for role, count in player_counts.items() if role in qm_permutations.SCUM_ROLES) for player_counts in self.role_counts]
+		return indeterminate_universe_found, always_scum, sometimes_scum
+
+	def compare_livenesses(self, original_liveness): #same result as compare_livenesses()
+		return [single_liveness[1] != '#' or any(count > 0 for role, count in player_counts.items() if role not in 'XV') for single_liveness, player_counts in zip(original_liveness, self.role_counts)]
+
+	def settle_roles(self, needs_checking): #transform_liveness_roles() for every player we can decide from the counts alone. Returns who still needs a scan (those dead in some universes), and the results so far.
+		still_needs_checking = needs_checking[:]
+		check_results = [None for _ in needs_checking]
+		for this_idx in (idx for idx, check_this_player in enumerate(needs_checking) if check_this_player):
+			player_counts = self.role_counts[this_idx]
+			living_roles = {'A' if role in qm_permutations.SCUM_ROLES else role for role, count in player_counts.items() if count > 0 and role not in 'XV'}
+			if len(living_roles) > 1: #more than one role already - indeterminate no matter what they were where they're dead
+				still_needs_checking[this_idx] = False
+			elif not any(player_counts.get(role, 0) > 0 for role in 'XV'): #alive everywhere, so the living roles are the whole story
+				still_needs_checking[this_idx] = False
+				if len(living_roles) == 1:
+					check_results[this_idx] = living_roles.pop()
+		return still_needs_checking, check_results
+
+class CountedBuffer: #stands in for a pass's output buffer, adding every universe appended to it to some accumulators (LivenessCounters, say) on the way through
+	def __init__(self, universe_buffer, accumulators):
+		self.universe_buffer = universe_buffer
+		self.accumulators = accumulators
+
+	def append(self, universe):
+		for accumulator in self.accumulators:
+			accumulator.add(universe)
+		self.universe_buffer.append(universe)
+
+	def __len__(self):
+		return len(self.universe_buffer)
+
+def counters_for(universe_buffer): #the LivenessCounters for this buffer, if anything has counted it
+	if liveness_counters is not None and liveness_counters.universe_buffer is universe_buffer:
+		return liveness_counters
+	return None
+
+def universes_changed(universe_buffer): #call after changing roles in the buffer in place (promoting scum, say), so nothing goes on trusting counts taken before
+	global liveness_counters
+	if counters_for(universe_buffer) is not None:
+		liveness_counters = None
+
+def alive_counts(universe_buffer): #number of universes each player is alive in
+	counters = counters_for(universe_buffer)
+	if counters is not None:
+		return counters.alive_counts()
+	if is_vectorized(universe_buffer):
+		return universe_buffer.alive_counts()
+	counts = None
+	for universe in universe_buffer:
+		if counts is None:
+			counts = [0 for _ in universe[1]]
+		for idx, player in enumerate(universe[1]):
+			if player in 'XV':
+				continue
+			counts[idx] += 1
+	return counts
+
 # [S] Cascade.
-def cascade(universe_buffer, incoming_player_livenesses, voted_player_id=None): #expects regular liveness format, not t/f
+def cascade(universe_buffer, incoming_player_livenesses, voted_player_id=None, counters=None): #expects regular liveness format, not t/f
+	#counters is LivenessCounters for universe_buffer if the pass that made it counted as it went, so we don't have to.
 	#this fn takes the universe buffer and pre-calculated liveness state. It determines if anyone is now 100% dead (voted out or NKed), and if so, flips them, comparing with day 1 universe if necessary. We use a classical for loop rather than for..in to allow mutating the universe buffer directly. (This is normally bad practice but I don't have another spare 8 GB of memory.)
+	#resuming from a cascade checkpoint just passes in the liveness it was taken with: each round's flips are all done by the time it's saved, so the next round starts from scratch either way.
+	global liveness_counters
 	flip_setup()
 	current_liveness = incoming_player_livenesses[:]
+	liveness_counters = counters
 	
 	while len(universe_buffer) > 0: 
-		liveness_result = compare_livenesses(universe_buffer, current_liveness)
+		if liveness_counters is None:
+			liveness_result = compare_livenesses(universe_buffer, current_liveness) #stops early once everyone's alive somewhere, so it's cheap when nobody died
+		else:
+			liveness_result = liveness_counters.compare_livenesses(current_liveness)
 	
 		if all(liveness_result):
 			print("Done determining dead players.")
@@ -316,140 +782,205 @@ def cascade(universe_buffer, incoming_player_livenesses, voted_player_id=None):
 			#flip() will mutate livenesses and we return the mutated liveness list
 			return current_liveness #we expect to mutate the buffer rather than 
 	
+		flips = [] #[player id, how they died], in flip order
 		if voted_player_id is not None and liveness_result[voted_player_id] == False:
 			#handle voted-out player first
-			print(f'{get_player_name(voted_player_id, include_marker=True)} is now 100% dead (voted out). Flipping...')
-			flip(voted_player_id, universe_buffer, current_liveness, True)
+			flips.append([voted_player_id, "(voted out)"])
 			liveness_result[voted_player_id] = True
 	
-		for player_id in (idx for idx, item in enumerate(liveness_result) if item == False): #for each dead player...
-			print(f'{get_player_name(player_id, include_marker=True)} is now 100% dead {"(voted out?)" if player_id == voted_player_id else "(nightkilled)"}. Flipping...')
-			flip(player_id, universe_buffer, current_liveness, voted_player_id == player_id)
+		flips += [[player_id, "(voted out?)" if player_id == voted_player_id else "(nightkilled)"] for player_id, item in enumerate(liveness_result) if item == False] #for each dead player...
+	
+		if liveness_counters is None: #someone's died, so it's worth counting everything once rather than rescanning after every round of flips
+			liveness_counters = LivenessCounters(universe_buffer)
+		flip(flips, universe_buffer, current_liveness, voted_player_id) #the whole round at once - newly dead players get picked up next time round
+		save_checkpoint("cascade", universe_buffer, liveness=current_liveness)
 
 	if len(universe_buffer) == 0: #SHOULD be impossible, but what do I know?
 		paradox("cascade")
 	
 def flip_setup():
-	global flip_was_setup
+	global flip_was_setup, orig_universe_file
 	if flip_was_setup:
 		return
-	get_universe_file(1, True, switch=True) #switch to orig universe, we'll need it
+	if universe_file is not None and universe_file_num == 1 and universe_file_is_day:
+		orig_universe_file = universe_file #already there
+	else:
+		orig_universe_file = UniverseFile(find_universe_file("D1"))
+		if not orig_universe_file.is_implicit: #an implicit D1 is just a header, so there's no need to switch - we can keep the current file open alongside it
+			orig_universe_file.close()
+			orig_universe_file = get_universe_file(1, True, switch=True) #switch to orig universe, we'll need it
 	get_universe_file_metrics()
 	flip_was_setup = True
 
 def get_player_role_in_orig_universe(player_idx, univ_id): #must call flip_setup first else expect calamity
-	global universe_file, universe_line_chars, universe_num_digits, universe_records_start
-	universe_file.seek(universe_records_start+univ_id*universe_line_chars+universe_num_digits+1+player_idx)
-	return chr(universe_file.read_byte())
+	global orig_universe_file
+	return orig_universe_file.role_at(univ_id, player_idx) #D1 universe IDs are the same as their record positions
 
 def get_probability_table_idx(player_idx):
 	global player_board_order
 	return player_board_order.index(pos_to_player(player_idx))
 
-def flip(player_id, universe_buffer, current_liveness, is_vote): #will mutate universe_buffer and current_liveness
-	global random_source
-	
-	entangler_seen = False
-	entangler_only = True 
-	
-	nonentangler_universe_ids = []
-	
-	#in the first pass, we just assess the player's state in the still living universes.
-	for universe in universe_buffer:
-		universe_id = int(universe[0])
-		player_role_in_that_universe = get_player_role_in_orig_universe(player_id, int(universe[0]))
-		#print(f"Player is {player_role_in_that_universe} in universe {int(universe[0])}.") #debug
-		if player_role_in_that_universe in 'BC':
-			player_role_in_that_universe = 'A'
+class FlipTags: #every flipping player's original role (scum normalized to A) in every universe, taken in one pass over the buffer. For a stream buffer, the tags are spilled to disk as well (see qm_stream.spilled_bytes).
+	def __init__(self, universe_buffer, player_ids):
+		self.universe_buffer = universe_buffer
+		self.num_flips = len(player_ids)
+		self.num_universes = len(universe_buffer)
+		self.num_kept = self.num_universes
+		if isinstance(universe_buffer, qm_stream.SpillBuffer):
+			self.roles = qm_stream.spilled_bytes(self.role_tags(player_ids), universe_buffer.spill_dir) #universe by universe, one byte per flipping player
+			self.keep = qm_stream.spilled_bytes((b'\x01' * (stop - start) for start, stop in self.chunk_ranges()), universe_buffer.spill_dir) #universes that agree with every flip so far
+		else:
+			self.roles = bytearray().join(self.role_tags(player_ids))
+			self.keep = bytearray(b'\x01') * self.num_universes
 
-		universe.append(player_role_in_that_universe)
-		
-		if player_role_in_that_universe == 'E':
-			entangler_seen = True
-			continue
-			
-		entangler_only = False
-		nonentangler_universe_ids.append(universe_id)
+	def role_tags(self, player_ids): #the tags, a chunk of universes at a time
+		universe_iter = iter(self.universe_buffer)
+		while True:
+			universe_chunk = list(itertools.islice(universe_iter, universe_chunk_size))
+			if len(universe_chunk) == 0:
+				break
+			yield orig_universe_file.roles_at([int(universe[0]) for universe in universe_chunk], player_ids).translate(normalize_scum_roles)
+
+	def chunk_ranges(self):
+		return ((start, min(start + universe_chunk_size, self.num_universes)) for start in range(0, self.num_universes, universe_chunk_size))
+
+	def step_chunks(self, step): #yields the first universe index, this flip's roles and the keep flags, a chunk of universes at a time - so we never copy anything the size of the buffer
+		for start, stop in self.chunk_ranges():
+			yield start, self.roles[start*self.num_flips + step:stop*self.num_flips:self.num_flips], self.keep[start:stop]
 
-	#now, we pick a flip. There are a few ways to do this depending on if the entangler is present or not
+	def candidates(self, step): #returns entangler_seen, entangler_only, nonentangler_universe_ids - among the universes still standing
+		entangler_count = sum(sum(1 for kept, role in zip(keep, roles) if kept and role == ord('E')) for _, roles, keep in self.step_chunks(step))
+		return entangler_count > 0, entangler_count == self.num_kept, FlipCandidates(self, step, self.num_kept - entangler_count)
+
+	def constrain(self, step, final_player_role): #drops the universes where this flip's player wasn't final_player_role. Returns how many that was.
+		num_kept_before = self.num_kept
+		final_role_byte = ord(final_player_role)
+		for start, roles, keep in self.step_chunks(step):
+			keep = bytearray(keep)
+			for idx, role in enumerate(roles):
+				if keep[idx] and role != final_role_byte:
+					keep[idx] = 0
+					self.num_kept -= 1
+			self.keep[start:start + len(keep)] = keep
+		return num_kept_before - self.num_kept
+
+class FlipCandidates: #the IDs of the standing universes where a flip's player isn't the entangler, found by scanning rather than stored. random.choice() only needs len and one lookup.
+	def __init__(self, flip_tags, step, count):
+		self.flip_tags = flip_tags
+		self.step = step
+		self.count = count
+
+	def __len__(self):
+		return self.count
+
+	def __getitem__(self, wanted):
+		if wanted < 0:
+			wanted += self.count
+		seen = -1
+		for start, roles, keep in self.flip_tags.step_chunks(self.step):
+			for idx, role in enumerate(roles):
+				if keep[idx] and role != ord('E'):
+					seen += 1
+					if seen == wanted:
+						return int(self.flip_tags.universe_buffer[start + idx][0])
+		raise IndexError("universe index out of range")
+
+def flip(flips, universe_buffer, current_liveness, voted_player_id=None): #flips is [player id, how they died] for everyone cascade found 100% dead this round, in order. Will mutate universe_buffer and current_liveness
+	#each player's flip is picked from the universes that agree with the flips before theirs, same as flipping them one at a time, but the buffer itself only gets rebuilt once for the whole round.
+	global random_source
 	
-	if entangler_only:
-		#every possibility is the entangler. Also leads to a non-collapse situation.
-		print(f"{get_player_name(player_id)} was the ENTANGLER.")
-		assert len(nonentangler_universe_ids) == 0
-		print("No universes have collapsed.")
-		current_liveness[player_id] = f"E{'V' if is_vote else 'X'}"
-		return #no mutation needed, no collapses from this event
-	elif entangler_seen:
-		#pick a random choice from the combined list of all the non-entangler universes.
-		chosen_universe_id = random_source.choice([*town_universe_idxs, *scum_universe_idxs, *det_universe_idxs, *follower_universe_idxs, *guard_universe_idxs])
-		print(f"Chosen universe ID = {chosen_universe_id}")
+	#in the first pass, we just assess each player's state in the still living universes.
+	player_ids = [player_id for player_id, how_they_died in flips]
+	if is_vectorized(universe_buffer):
+		flip_tags = universe_buffer.flip_tags(player_ids, orig_universe_file, normalize_scum_roles)
 	else:
-		#easy way to do it
-		#we could probably just do this a few times at the start and it'd serve for most cases, but whatever. we spend an extra rng flip that way
-		chosen_universe_id = int(random_source.choice(universe_buffer)[0])
-		print(f"Chosen universe ID = {chosen_universe_id}")
-	final_player_role = get_player_role_in_orig_universe(player_id, chosen_universe_id)
-	
-	current_liveness[player_id] = f"{final_player_role}{'V' if is_vote else 'X'}"
-	
-	if final_player_role == 'T':
-		print(f"{get_player_name(player_id)} was TOWN.")
+		flip_tags = FlipTags(universe_buffer, player_ids)
 
-	if final_player_role in 'ABC':
-		print(f"{get_player_name(player_id)} was SCUM.")
-		final_player_role = 'A' #normalize scum roles for upcoming use in removal
+	for step, (player_id, how_they_died) in enumerate(flips):
+		is_vote = player_id == voted_player_id
+		print(f'{get_player_name(player_id, include_marker=True)} is now 100% dead {how_they_died}. Flipping...')
+
+		#now, we pick a flip. If the entangler's possible, we pick from the universes where they aren't the entangler
+		entangler_seen, entangler_only, nonentangler_universe_ids = flip_tags.candidates(step)
+		if entangler_only:
+			#every possibility is the entangler. Also leads to a non-collapse situation.
+			print(f"{get_player_name(player_id)} was the ENTANGLER.")
+			assert len(nonentangler_universe_ids) == 0
+			print("No universes have collapsed.")
+			current_liveness[player_id] = f"E{'V' if is_vote else 'X'}"
+			continue #no collapses from this event
+		chosen_universe_id = int(random_source.choice(nonentangler_universe_ids)) #with no entangler around, that's every standing universe
+		print(f"Chosen universe ID = {chosen_universe_id}")
+		final_player_role = get_player_role_in_orig_universe(player_id, chosen_universe_id)
 		
-	if final_player_role == 'D':
-		print(f"{get_player_name(player_id)} was the DETECTIVE.")
+		current_liveness[player_id] = f"{final_player_role}{'V' if is_vote else 'X'}"
 		
-	if final_player_role == 'F':
-		print(f"{get_player_name(player_id)} was the FOLLOWER.")
+		if final_player_role == 'T':
+			print(f"{get_player_name(player_id)} was TOWN.")
 
-	if final_player_role == 'G':
-		print(f"{get_player_name(player_id)} was the GUARD.")
-	
-	universes_before = len(universe_buffer)
-	
-	print(f"About to collapse universes...")
-	#we have an interesting problem here: we can't actually use 'del' to delete all these universes. Not really. Each 'del' is an O(n) operation. It'll take forever.
-	#instead, we write over the list using a list comprehension, and strip off the temporary data we wrote to each universe.
+		if final_player_role in qm_permutations.SCUM_ROLES:
+			print(f"{get_player_name(player_id)} was SCUM.")
+			final_player_role = 'A' #normalize scum roles for upcoming use in removal
+			
+		if final_player_role == 'D':
+			print(f"{get_player_name(player_id)} was the DETECTIVE.")
+			
+		if final_player_role == 'F':
+			print(f"{get_player_name(player_id)} was the FOLLOWER.")
+
+		if final_player_role == 'G':
+			print(f"{get_player_name(player_id)} was the GUARD.")
 		
-	universe_buffer[:] = [universe[0:2] for universe in universe_buffer if universe[2] == final_player_role]  #this may take a very long time. up to 30 minutes for D1
-	
-	universes_after = len(universe_buffer)
+		print(f"About to collapse universes...")
+		print(f"{flip_tags.constrain(step, final_player_role)} universes collapse.")
+			
+		if flip_tags.num_kept == 0:
+			#this should be impossible, but we check anyway
+			paradox(f"flip of {get_player_name(player_id, include_marker=True)}") #will exit
 	
-	print(f"{universes_before - universes_after} universes collapse.")
-		
-	if len(universe_buffer) == 0:
-		#this should be impossible, but we check anyway
-		paradox(f"flip of {get_player_name(player_id, include_marker=True)}") #will exit
+	#we have an interesting problem here: we can't actually use 'del' to delete all these universes. Not really. Each 'del' is an O(n) operation. It'll take forever.
+	#instead, we write over the list using a list comprehension, once for every flip this round.
+	if hasattr(universe_buffer, 'keep_universes'):
+		universe_buffer.keep_universes(flip_tags.keep, liveness_counters)
+	else:
+		if liveness_counters is not None:
+			for universe, kept in zip(universe_buffer, flip_tags.keep):
+				if not kept:
+					liveness_counters.remove(universe)
+		universe_buffer[:] = [universe for universe, kept in zip(universe_buffer, flip_tags.keep) if kept]  #this may take a very long time. up to 30 minutes for D1
 	
-def check_scum_victory(universe_buffer, num_scum_left):
+def check_scum_victory(universe_buffer, num_scum_left, liveness=None, setup=None):
 	global player_liveness
 	indeterminate_universe_found = False
 	always_scum = [True for _ in player_liveness]
 	sometimes_scum = [False for _ in player_liveness]
 
-	for universe in universe_buffer:
-		num_nonscum_players = 0
-		for idx, player in enumerate(universe[1]):
-			if player in 'ABC':
-				sometimes_scum[idx] = True
-				continue
-			else:
-				always_scum[idx] = False
-			if player in 'XV': 
-				continue
-			num_nonscum_players += 1
-			if num_nonscum_players >= num_scum_left:
-				indeterminate_universe_found = True
+	counters = counters_for(universe_buffer)
+	counted_scan = counters.scum_victory_scan(num_scum_left) if counters is not None else None
+	if counted_scan is not None:
+		indeterminate_universe_found, always_scum, sometimes_scum = counted_scan
+	elif is_vectorized(universe_buffer):
+		indeterminate_universe_found, always_scum, sometimes_scum = universe_buffer.scum_victory_scan(num_scum_left)
+	else:
+		for universe in universe_buffer:
+			num_nonscum_players = 0
+			for idx, player in enumerate(universe[1]):
+				if player in qm_permutations.SCUM_ROLES:
+					sometimes_scum[idx] = True
+					continue
+				else:
+					always_scum[idx] = False
+				if player in 'XV': 
+					continue
+				num_nonscum_players += 1
+				if num_nonscum_players >= num_scum_left:
+					indeterminate_universe_found = True
+					break
+			if indeterminate_universe_found:
 				break
-		if indeterminate_universe_found:
-			break
 	
 	if not indeterminate_universe_found:
-		write_final_universe_file(universe_buffer, "universes-final.txt")
+		write_final_universe_file(universe_buffer, universe_file_name("final"), liveness, setup)
 		print("*** SCUM VICTORY ***")
 		always_scum_indexes = [idx for idx, item in enumerate(always_scum) if item]
 		sometimes_scum_indexes = [idx for idx, item in enumerate(sometimes_scum) if item and not always_scum[idx]]
@@ -0,0 +1,69 @@
+#speculative day transitions (day.py --speculate). The day's RNG only depends on the game seed and the day, so a day transition for a given vote comes out the same whenever it's run. While voting is still open, we run the whole transition for each likely candidate, each in its own cache directory (speculate-D2/B, say). When day.py is then run for one of those votes, it moves the cached results into place instead of doing the transition again.
+#a cache directory has a link to each of the files the transition reads (see input_key), and nothing else, so whatever it writes is left in there as a real file rather than going through a link into the game directory. speculation.json is written last, once the run has finished: the inputs it was made from (see input_key), the vote, and everything the run printed.
+
+import json, os, shutil, subprocess, sys
+from concurrent.futures import ThreadPoolExecutor
+import qm_shared
+
+speculation_file_name = "speculation.json"
+sidecar_extensions = (".stats", ".outcomes", ".targets") #written with 'w' next to a phase file
+
+def speculation_dir(day_num, vote=None):
+	return f"speculate-D{day_num}" if vote is None else os.path.join(f"speculate-D{day_num}", vote)
+
+def input_key(day_num): #the files a day transition reads, and their sizes and modification times. A cached result is only used if none of them have changed since.
+	key = []
+	for filename in dict.fromkeys(["gameinfo.txt", "players.txt", qm_shared.find_universe_file("D1"), qm_shared.find_universe_file(f"D{day_num}"), f"masonries-D{day_num}.txt"]): #D1 is only there once on Day 1
+		if os.path.exists(filename):
+			key.append([filename, os.path.getsize(filename), os.stat(filename).st_mtime_ns])
+	return key
+
+def speculate_vote(day_num, vote, transition_args): #runs the day transition for one vote in its cache directory. Returns whether it finished.
+	directory = speculation_dir(day_num, vote)
+	shutil.rmtree(directory, ignore_errors=True) #anything already there is stale
+	os.makedirs(directory)
+	key = input_key(day_num)
+	for filename, _, _ in key:
+		os.symlink(os.path.abspath(filename), os.path.join(directory, filename))
+	day_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "day.py")
+	result = subprocess.run([sys.executable, day_script, str(day_num), vote, "--yes", *transition_args], cwd=directory, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+	if result.returncode != 0:
+		print(f"The speculative day for {vote} failed:")
+		print(result.stdout)
+		return False
+	with open(os.path.join(directory, speculation_file_name), 'w') as speculation_file:
+		json.dump({'key': key, 'vote': [vote], 'output': result.stdout}, speculation_file)
+	return True
+
+def speculate(day_num, votes, transition_args, jobs): #runs the day transition for each vote, jobs at a time, in the background of voting
+	print(f"Working out Day {day_num} for {qm_shared.oxford_comma(votes, 'and')}, {jobs} at a time...")
+	with ThreadPoolExecutor(jobs) as executor: #the threads just wait on the day.py processes
+		for vote, finished in zip(votes, executor.map(lambda vote: speculate_vote(day_num, vote, transition_args), votes)):
+			if finished:
+				print(f"{vote} is ready.")
+	print(f"Done. Run day.py for Day {day_num} as usual once the vote is in - if it's one of these, the results are already worked out.")
+
+def cached_speculation(day_num, votes): #the cache directory and speculation for this vote, or None if there isn't one we can use
+	if len(votes) != 1: #a random pick between several votes draws from the RNG first, so it wouldn't match any single vote's run
+		return None
+	directory = speculation_dir(day_num, votes[0])
+	try:
+		with open(os.path.join(directory, speculation_file_name), 'r') as speculation_file:
+			speculation = json.load(speculation_file)
+	except (OSError, ValueError):
+		return None
+	if speculation['vote'] != votes or speculation['key'] != input_key(day_num):
+		return None
+	if any(os.path.exists(filename) and not filename.endswith(sidecar_extensions) for filename in speculation_outputs(directory)): #a phase or masonry file that's already there - let the transition complain about it as usual. Sidecars just get overwritten, as the transition would.
+		return None
+	return directory, speculation
+
+def speculation_outputs(directory): #the files the speculative run wrote
+	return [entry.name for entry in os.scandir(directory) if entry.is_file(follow_symlinks=False) and not entry.is_symlink() and entry.name != speculation_file_name]
+
+def commit_speculation(day_num, directory): #moves a speculative run's files into place, and clears out the day's cache. Returns the names of the files.
+	outputs = speculation_outputs(directory)
+	for filename in outputs:
+		os.replace(os.path.join(directory, filename), filename)
+	shutil.rmtree(speculation_dir(day_num))
+	return outputs
@@ -0,0 +1,95 @@
+#bounded-memory universe buffer. Universes are spilled to a temporary file of fixed width records (int64 universe ID + 1 byte per player) and read back a chunk at a time, so a transition never holds the whole buffer in RAM.
+#it stands in for the output list in day.py and night.py when run with --stream. Anything that just loops over the buffer works unchanged; flip and the scum promotion rewrite the file with a streaming filter/map pass instead.
+#flip's per-universe tags (see qm_shared.FlipTags) are spilled too, with spilled_bytes, so nothing the transition keeps grows with the number of universes.
+
+import mmap, os, struct, tempfile
+
+class SpillBuffer:
+	def __init__(self, num_players, chunk_size, spill_dir='.'):
+		self.num_players = num_players
+		self.chunk_size = chunk_size
+		self.spill_dir = spill_dir
+		self.record_struct = struct.Struct(f'<q{num_players}s')
+		self.spill_file = tempfile.TemporaryFile(prefix='universes-spill-', dir=spill_dir) #goes next to the phase files by default - /tmp is often RAM-backed
+		self.num_universes = 0
+		self.pending = []
+
+	def append(self, universe): #universe is [id, roles], same as the output lists
+		self.pending.append(self.record_struct.pack(universe[0], "".join(universe[1]).encode('ascii')))
+		self.num_universes += 1
+		if len(self.pending) >= self.chunk_size:
+			self.flush()
+
+	def append_records(self, records): #records already packed in our format (see qm_parallel.PackedUniverses)
+		self.pending.append(bytes(records))
+		self.num_universes += len(records) // self.record_struct.size
+		self.flush()
+
+	def flush(self):
+		if len(self.pending) > 0:
+			self.spill_file.write(b"".join(self.pending))
+			self.pending = []
+		self.spill_file.flush()
+
+	def __len__(self):
+		return self.num_universes
+
+	def read_chunk(self, start, count): #raw records [start, start+count)
+		return os.pread(self.spill_file.fileno(), count*self.record_struct.size, start*self.record_struct.size)
+
+	def __getitem__(self, idx): #random.choice() needs this
+		if idx < 0:
+			idx += self.num_universes
+		if not 0 <= idx < self.num_universes:
+			raise IndexError("spill buffer index out of range")
+		self.flush()
+		universe_id, roles = self.record_struct.unpack(self.read_chunk(idx, 1))
+		return universe_id, roles.decode('ascii')
+
+	def __iter__(self): #yields (id, role string) pairs, like UniverseFile.universes()
+		self.flush()
+		for start in range(0, self.num_universes, self.chunk_size):
+			for universe_id, roles in self.record_struct.iter_unpack(self.read_chunk(start, min(self.chunk_size, self.num_universes - start))):
+				yield universe_id, roles.decode('ascii')
+
+	def replace_with(self, universes): #streams universes (any iterable of [id, roles]) into a fresh spill file, which then replaces this one. Safe to pass a generator over this buffer.
+		new_buffer = SpillBuffer(self.num_players, self.chunk_size, self.spill_dir)
+		for universe in universes:
+			new_buffer.append(universe)
+		new_buffer.flush()
+		self.spill_file.close()
+		self.spill_file, self.num_universes, self.pending = new_buffer.spill_file, new_buffer.num_universes, []
+
+	def filter(self, keep): #keep(idx, universe) -> bool
+		self.replace_with(universe for idx, universe in enumerate(self) if keep(idx, universe))
+
+	def transform(self, transform_universe): #transform_universe gets [id, [roles]] and mutates the roles list in place
+		def transformed_universes():
+			for universe_id, roles in self:
+				universe = [universe_id, [*roles]]
+				transform_universe(universe)
+				yield universe
+		self.replace_with(transformed_universes())
+
+	def keep_universes(self, keep, liveness_counters=None): #flip's collapse filter. keep has a truthy entry per universe.
+		def keep_universe(idx, universe):
+			if keep[idx]:
+				return True
+			if liveness_counters is not None:
+				liveness_counters.remove(universe)
+			return False
+		self.filter(keep_universe)
+
+	def close(self):
+		self.spill_file.close()
+
+def spilled_bytes(chunks, spill_dir='.'): #a byte array kept in a temporary file instead of RAM: an mmap over it, filled from chunks (an iterable of bytes). It can be indexed, sliced and assigned to like a bytearray, but not resized.
+	with tempfile.TemporaryFile(prefix='flip-tags-spill-', dir=spill_dir) as spill_file:
+		size = 0
+		for chunk in chunks:
+			spill_file.write(chunk)
+			size += len(chunk)
+		spill_file.flush()
+		if size == 0: #can't mmap nothing
+			return bytearray()
+		return mmap.mmap(spill_file.fileno(), size) #the mapping holds on to the file after we close it
@@ -0,0 +1,153 @@
+#night target validity for a phase file, worked out once and saved next to it (universes-N1.targets, say), so check_night_targets.py and night.py's target check don't each scan the whole file.
+#a target is valid if, in some universe where the player holds the role, the target is alive. That only depends on where the acting roles sit and who's dead, and there are far fewer of those patterns than universes - so we boil the file down to its distinct patterns first, and work the answers out from those.
+#file format: plain JSON. num_universes; holds, {role: per player, whether they hold the role in any universe}; targets, {role: per player, per target, whether the target is alive in some universe where the player holds the role}.
+
+import json
+import qm_shared
+
+acting_roles = 'ADEFG' #alpha scum (the nightkill), detective, entangler, follower, guard
+targeting_roles = 'ADG' #the ones whose target has to be alive
+
+pattern_table = str.maketrans({chr(letter): '.' for letter in range(ord('A'), ord('Z')+1) if chr(letter) not in acting_roles + 'XV'} | {'V': 'X'}) #keeps the acting roles and deaths, blanks out the rest
+
+def build_target_matrix(universe_file):
+	num_players = universe_file.num_players
+	patterns = set()
+	for _, roles in universe_file.universes():
+		patterns.add(roles.translate(pattern_table))
+	holds = {role: [False for _ in range(num_players)] for role in acting_roles}
+	targets = {role: [[False for _ in range(num_players)] for _ in range(num_players)] for role in targeting_roles}
+	for pattern in patterns:
+		alive = [idx for idx, role in enumerate(pattern) if role != 'X']
+		for role in acting_roles:
+			player_idx = pattern.find(role)
+			if player_idx < 0:
+				continue
+			holds[role][player_idx] = True
+			if role in targets:
+				player_targets = targets[role][player_idx]
+				for target_idx in alive:
+					player_targets[target_idx] = True
+	return {'num_universes': universe_file.num_universes, 'holds': holds, 'targets': targets}
+
+def saved_target_matrix(universe_file): #the saved matrix for an open phase file, or None if there isn't one we can trust
+	matrix = qm_shared.read_sidecar(universe_file, ".targets")
+	if matrix is None or len(matrix['holds']['A']) != universe_file.num_players:
+		return None
+	return matrix
+
+def target_matrix(universe_file): #the saved matrix, or a fresh one (which we save for next time)
+	matrix = saved_target_matrix(universe_file)
+	if matrix is not None:
+		return matrix
+	matrix = build_target_matrix(universe_file)
+	with open(qm_shared.sidecar_file_name(universe_file.filename, ".targets"), 'w') as matrix_file: #overwrite - anything already there is stale
+		json.dump(matrix, matrix_file)
+	return matrix
+
+def holds_role(matrix, player_idx, role): #does the player hold the role in any universe
+	return matrix['holds'][role][player_idx]
+
+def target_valid(matrix, player_idx, role, target_idx): #is the target alive in some universe where the player holds the role
+	return matrix['targets'][role][player_idx][target_idx]
+
+def check_submission(player_letter, actions, num_players, player_liveness, current_setup, player_names, matrix): #returns what's wrong with one player's submission, to print - empty if it's OK
+	has_detective_right_now = current_setup[2]
+	has_entangler_right_now = current_setup[3]
+	has_follower_right_now = current_setup[4]
+	has_guard_right_now = current_setup[5]
+	
+	active_player_idx = qm_shared.player_to_pos(player_letter)
+	
+	if active_player_idx >= num_players:
+		return [f"Invalid player letter. Must be A-{qm_shared.pos_to_player(num_players-1)}."]
+	
+	if player_liveness[active_player_idx][1] != '#':
+		return ["This player is dead."]
+	
+	#everything appears at least _nominally_ in order - now let's do the actual night stuff.
+
+	if not all(ord(char) == 35 or (char.isalpha() and char.isascii()) for char in actions):
+		return ["Invalid character in actions string. Accepts only A-Z for targets, or # for 'no target'."]
+		
+	aa_upper = actions.upper()
+		
+	invalid_targets_list = [qm_shared.pos_to_player(idx) for idx, item in enumerate(player_liveness) if item[1] != '#']
+	invalid_targets = "".join(invalid_targets_list)
+	invalid_targets_2 = "".join([qm_shared.pos_to_player(item) for item in range(num_players, 27)])
+	
+	if any(elem in aa_upper for elem in invalid_targets):
+		return [f'This actions string has an invalid target somewhere in it. Players {", ".join(invalid_targets_list)} are 100% dead and cannot be targeted.']
+	
+	if any(elem in aa_upper for elem in invalid_targets_2):
+		return [f"This actions string has an invalid target somewhere in it. The highest valid player letter is {qm_shared.pos_to_player(num_players-1)}, but I've found one beyond that."]
+	
+	expected_bloc_len = 1 + sum([1 if item else 0 for item in current_setup[2:]])
+	
+	if len(aa_upper) != expected_bloc_len:
+		error = "The action block is the wrong length. "
+		if expected_bloc_len == 1:
+			error += "It must be 1 character long, corresponding to their nightkill. "
+		else:
+			error += f"It must be {expected_bloc_len} characters long, corresponding to their "
+			verbs = ["nightkill"]
+			if has_detective_right_now:
+				verbs.append("investigation")
+			if has_entangler_right_now:
+				verbs.append("entanglement")
+			if has_follower_right_now:
+				verbs.append("watch")
+			if has_guard_right_now:
+				verbs.append("protect")
+			error += f'{qm_shared.oxford_comma(verbs, "and")}. '
+		error += "If a player is guaranteed not to be able to use a role, you can set that role's target letter to '#'."
+		return [error]
+	
+	#STEP -1: PARSE OUT EVERYONE'S REQUESTS.
+	
+
+	scum_index = 0
+	detective_index = scum_index + (1 if has_detective_right_now else 0)
+	entangler_index = detective_index + (1 if has_entangler_right_now else 0) 
+	follower_index = entangler_index + (1 if has_follower_right_now else 0) 
+	guard_index = follower_index + (1 if has_guard_right_now else 0) 
+	
+	#role letter -> target (None for roles without one), for each action they've submitted
+	requests = {}
+	if aa_upper[scum_index] != '#':
+		requests['A'] = aa_upper[scum_index]
+	if has_detective_right_now and aa_upper[detective_index] != '#':
+		requests['D'] = aa_upper[detective_index]
+	if has_entangler_right_now and aa_upper[entangler_index] != '#':
+		requests['E'] = None
+	if has_follower_right_now and aa_upper[follower_index] != '#':
+		requests['F'] = None
+	if has_guard_right_now and aa_upper[guard_index] != '#':
+		requests['G'] = aa_upper[guard_index]
+				
+	#Step 0B - track targets
+	#for each action, the player must hold the role in some universe. For each nightkill, detective, or guard, their target must be alive in one of those universes. The target matrix has both answers.
+	
+	never_holds = [role for role in requests if not holds_role(matrix, active_player_idx, role)]
+	if len(never_holds) > 0:
+		messages = ["This player has an one or more actions for which they are not alive in any universe. They are:"]
+		if 'A' in never_holds:
+			messages.append("* Nightkill (alpha scum)")
+		if 'D' in never_holds:
+			messages.append("* Investigation (detective)")
+		if 'E' in never_holds:
+			messages.append("* Entanglement")
+		if 'F' in never_holds:
+			messages.append("* Follow")
+		if 'G' in never_holds:
+			messages.append("* Guard")
+		return messages
+	
+	dead_targets = [(role, target) for role, target in requests.items() if target is not None and not target_valid(matrix, active_player_idx, role, qm_shared.player_to_pos(target))]
+	if len(dead_targets) > 0:
+		messages = ["This player is targeting other players who are dead in every universe where this player holds a role. They are:"]
+		for (key, value) in dead_targets:
+			messages.append(f"{player_names[active_player_idx]} {('nightkilling' if key == 'A' else ('investigating' if key == 'D' else ('guarding' if key == 'G' else 'ERROR!!!!!')))} {player_names[qm_shared.player_to_pos(value)]}.")
+		return messages
+	
+	return []
@@ -0,0 +1,346 @@
+#numpy-backed universe buffer. Rather than a list of [id, [role, role, role...]] lists, universes are held as an int64 ID vector plus an N x players uint8 matrix of role letters.
+#numpy is optional - only the --vectorized modes need it.
+
+import itertools
+from array import array
+from sys import exit
+import qm_permutations
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+ROLE_X = ord('X')
+ROLE_V = ord('V')
+ROLE_E = ord('E')
+ROLE_DEAD = (ROLE_X, ROLE_V)
+ROLE_SCUM = tuple(qm_permutations.SCUM_ROLES.encode('ascii'))
+ROLE_EXTRA_SCUM = tuple(qm_permutations.EXTRA_SCUM_ROLES.encode('ascii'))
+
+#nightkill outcomes, shared with night.py's NightkillDecisions. The collapses match the slots of night's universes_collapsed.
+NK_SCUM_TARGETS_SCUM = 0
+NK_HITS_ENTANGLER = 1 #goes to the entangler subsidiary list, or collapses
+NK_DET_MEETS_GUARD = 2
+NK_SURVIVES = 3
+NK_SURVIVES_KILLED = 4 #survives with the nightkill target marked X
+NK_BAD_TARGET = 5
+
+ROLE_VOTE_NONENTANGLER = ROLE_SCUM + tuple(b'DFGT') #living roles a vote can hit, bar the entangler
+ROLE_VOTE_KNOWN = ROLE_VOTE_NONENTANGLER + (ROLE_E, ROLE_X)
+
+def require_numpy():
+	if np is None:
+		print("Vectorized mode needs numpy, which isn't installed. Install it (pip install numpy) or run without --vectorized.")
+		exit()
+
+def role_bytes(roles): #'ABC' -> uint8 array
+	return np.frombuffer(roles.encode('ascii'), dtype=np.uint8)
+
+def record_view(universe_file): #zero-copy structured view over a phase file's records. Holds a reference to the file's mmap, so drop it before closing the file.
+	if universe_file.is_binary:
+		record_dtype = np.dtype([('id', f'<u{universe_file.id_bytes}'), ('roles', np.uint8, (universe_file.num_players,))])
+	else:
+		record_dtype = np.dtype([('id', np.uint8, (universe_file.num_digits,)), ('dash', np.uint8), ('roles', np.uint8, (universe_file.num_players,))]) #newline isn't part of the record, so the last line (which doesn't have one) fits too
+	return np.ndarray((universe_file.num_universes,), dtype=record_dtype, buffer=universe_file.mm, offset=universe_file.records_start, strides=(universe_file.record_len,))
+
+def record_ids(universe_file, records):
+	if universe_file.is_binary:
+		return records['id'].astype(np.int64)
+	digit_values = 10 ** np.arange(universe_file.num_digits-1, -1, -1, dtype=np.int64)
+	return (records['id'] - 48).astype(np.int64) @ digit_values
+
+def implicit_universes(num_players, roles): #every D1 universe, in ID order (see qm_permutations.py)
+	num_universes = qm_permutations.count_universes(num_players, len(roles))
+	packed = np.fromiter(itertools.chain.from_iterable(itertools.permutations(range(num_players), len(roles))), dtype=np.uint8, count=num_universes*len(roles)).reshape(num_universes, len(roles))
+	matrix = np.full((num_universes, num_players), ord('T'), dtype=np.uint8)
+	matrix[np.arange(num_universes)[:, None], packed] = role_bytes(roles)
+	return np.arange(num_universes, dtype=np.int64), matrix
+
+def implicit_roles(univ_ids, player_idxs, num_players, roles): #vectorized qm_permutations.role_in_universe, for several players at once. Returns universes x players.
+	player_roles = np.full((len(univ_ids), len(player_idxs)), ord('T'), dtype=np.uint8)
+	rank_left = univ_ids.copy()
+	taken = np.zeros((len(univ_ids), num_players), dtype=bool)
+	rows = np.arange(len(univ_ids))
+	for role, weight in zip(role_bytes(roles), qm_permutations.rank_weights(num_players, len(roles))):
+		choice, rank_left = np.divmod(rank_left, weight)
+		free_rank = np.cumsum(~taken, axis=1) - 1 #the chosen player is the choice-th player not yet assigned a role
+		chosen = np.argmax((free_rank == choice[:, None]) & ~taken, axis=1)
+		taken[rows, chosen] = True
+		for col, player_idx in enumerate(player_idxs):
+			player_roles[chosen == player_idx, col] = role
+	return player_roles
+
+def orig_roles(orig_universe_file, univ_ids, player_idxs): #D1 roles for a vector of universe IDs and a list of players, in one gather. Returns universes x players.
+	if orig_universe_file.is_implicit:
+		return implicit_roles(univ_ids, player_idxs, orig_universe_file.num_players, orig_universe_file.power_roles)
+	records = record_view(orig_universe_file)['roles']
+	player_idxs = np.asarray(player_idxs)
+	if np.all(univ_ids[1:] >= univ_ids[:-1]): #already in file order, as buffers normally are
+		return records[univ_ids[:, None], player_idxs] #D1 universe IDs are the same as their record positions
+	read_order = np.argsort(univ_ids, kind='stable') #gather in file order so the reads through the mmap are sequential, then put them back
+	player_roles = np.empty((len(univ_ids), len(player_idxs)), dtype=np.uint8)
+	player_roles[read_order] = records[univ_ids[read_order][:, None], player_idxs]
+	return player_roles
+
+class UniverseMatrix:
+	is_vectorized = True
+
+	def __init__(self, ids, roles):
+		self.ids = ids #int64, one per universe
+		self.roles = roles #uint8, universes x players
+
+	@classmethod
+	def from_universe_file(cls, universe_file): #zero-copy for the roles. The IDs are decoded into their own vector.
+		if universe_file.is_implicit:
+			return cls(*implicit_universes(universe_file.num_players, universe_file.power_roles))
+		records = record_view(universe_file)
+		return cls(record_ids(universe_file, records), records['roles'])
+
+	def __len__(self):
+		return len(self.ids)
+
+	def __getitem__(self, idx): #same (id, roles) pairs the phase file readers give us. random.choice() needs this.
+		return int(self.ids[idx]), self.roles[idx].tobytes().decode('ascii')
+
+	def __iter__(self):
+		for idx in range(len(self.ids)):
+			yield self[idx]
+
+	def compare_livenesses(self, current_livenesses):
+		alive_somewhere = (~np.isin(self.roles, ROLE_DEAD)).any(axis=0)
+		return [is_determinate or bool(alive_somewhere[idx]) for idx, is_determinate in enumerate(current_livenesses)]
+
+	def liveness_roles(self, needs_checking, orig_universe_file): #the vectorized inner half of transform_liveness_roles
+		check_results = [None for _ in needs_checking]
+		if len(self.ids) == 0:
+			return check_results
+		checking_players = [idx for idx, check_this_player in enumerate(needs_checking) if check_this_player]
+		dead = np.isin(self.roles[:, checking_players], ROLE_DEAD)
+		dead_rows = np.flatnonzero(dead.any(axis=1))
+		dead_roles = orig_roles(orig_universe_file, self.ids[dead_rows], checking_players) #original state of every dead player we're checking, in one gather
+		for check_idx, this_idx in enumerate(checking_players):
+			player_roles = self.roles[:, this_idx].copy()
+			player_roles[np.isin(player_roles, ROLE_SCUM)] = ord('A') #normalize mafia roles
+			player_dead = dead[dead_rows, check_idx]
+			player_roles[dead_rows[player_dead]] = dead_roles[player_dead, check_idx] #get original state from dead
+			first_role = player_roles[0]
+			if (player_roles == first_role).all():
+				check_results[this_idx] = chr(first_role)
+		return check_results
+
+	def flip_tags(self, player_ids, orig_universe_file, role_normalization): #flip's first pass
+		return FlipTags(self, player_ids, orig_universe_file, role_normalization)
+
+	def keep_universes(self, keep, liveness_counters=None): #flip's collapse filter
+		if liveness_counters is not None:
+			liveness_counters.subtract(self.role_counts(~keep))
+		self.ids = self.ids[keep]
+		self.roles = self.roles[keep]
+
+	def scum_victory_scan(self, num_scum_left): #returns indeterminate_universe_found, always_scum, sometimes_scum
+		is_scum = np.isin(self.roles, ROLE_SCUM)
+		nonscum_alive = (~is_scum & ~np.isin(self.roles, ROLE_DEAD)).sum(axis=1)
+		return bool((nonscum_alive >= max(num_scum_left, 1)).any()), is_scum.all(axis=0).tolist(), is_scum.any(axis=0).tolist()
+
+	def alive_scan(self, num_players_left): #returns always_alive, sometimes_alive, min_living_players, max_living_players
+		alive = ~np.isin(self.roles, ROLE_DEAD)
+		living_players = alive.sum(axis=1)
+		return alive.all(axis=0).tolist(), alive.any(axis=0).tolist(), int(living_players.min(initial=num_players_left)), int(living_players.max(initial=0))
+
+	def role_counts(self, rows=None): #per player, {role letter: number of universes}, for all universes or just the rows selected
+		roles = self.roles if rows is None else self.roles[rows]
+		role_counts = []
+		for this_idx in range(roles.shape[1]):
+			counts = np.bincount(roles[:, this_idx], minlength=256)
+			role_counts.append({chr(role): int(counts[role]) for role in np.flatnonzero(counts)})
+		return role_counts
+
+	def alive_counts(self): #number of universes each player is alive in
+		return (~np.isin(self.roles, ROLE_DEAD)).sum(axis=0).tolist()
+
+	def entangler_positions(self): #players who are the entangler in at least one universe
+		return np.flatnonzero((self.roles == ROLE_E).any(axis=0)).tolist()
+
+	def promote_scum(self): #in universes with no alpha scum left, B becomes A and C becomes B (or C becomes A if there's no B, or the lowest-seated extra scum becomes A if there's neither)
+		no_alpha = ~(self.roles == ord('A')).any(axis=1)
+		if not no_alpha.any():
+			return
+		promoting = self.roles[no_alpha]
+		has_b = (promoting == ord('B')).any(axis=1)
+		is_c = promoting == ord('C')
+		only_extra = ~has_b & ~is_c.any(axis=1)
+		promoting[promoting == ord('B')] = ord('A')
+		promoting[is_c & has_b[:, None]] = ord('B')
+		promoting[is_c & ~has_b[:, None]] = ord('A')
+		is_extra = np.isin(promoting, ROLE_EXTRA_SCUM) & only_extra[:, None]
+		has_extra = is_extra.any(axis=1)
+		promoting[np.flatnonzero(has_extra), np.argmax(is_extra, axis=1)[has_extra]] = ord('A')
+		self.roles[no_alpha] = promoting
+
+	def write_records(self, file_handle, binary, num_digits, id_bytes, chunk_size): #writes the same bytes write_universe_records would
+		num_players = self.roles.shape[1]
+		record_dtype = np.dtype([('id', f'<u{id_bytes}'), ('roles', np.uint8, (num_players,))])
+		digit_values = 10 ** np.arange(num_digits-1, -1, -1, dtype=np.int64)
+		for start in range(0, len(self.ids), chunk_size):
+			chunk_ids = self.ids[start:start+chunk_size]
+			chunk_roles = self.roles[start:start+chunk_size]
+			if binary:
+				record = np.empty(len(chunk_ids), dtype=record_dtype)
+				record['id'] = chunk_ids
+				record['roles'] = chunk_roles
+				file_handle.write(record.tobytes())
+			else:
+				lines = np.empty((len(chunk_ids), num_digits + 1 + num_players + 1), dtype=np.uint8)
+				lines[:, :num_digits] = (chunk_ids[:, None] // digit_values) % 10 + 48
+				lines[:, num_digits] = ord('-')
+				lines[:, num_digits+1:-1] = chunk_roles
+				lines[:, -1] = ord('\n')
+				text = lines.tobytes().decode('ascii')
+				if start + chunk_size >= len(self.ids):
+					text = text[:-1] #no newline after the last universe
+				file_handle.write(text)
+
+class FlipTags: #qm_shared.FlipTags for a UniverseMatrix - each flipping player's original role as a column
+	def __init__(self, universe_matrix, player_ids, orig_universe_file, role_normalization): #role_normalization is a bytes.translate() table, used here as a lookup table
+		self.ids = universe_matrix.ids
+		self.roles = np.frombuffer(role_normalization, dtype=np.uint8)[orig_roles(orig_universe_file, self.ids, player_ids).T] #one row per flipping player
+		self.keep = np.ones(len(self.ids), dtype=bool)
+		self.num_kept = len(self.ids)
+
+	def candidates(self, step): #returns entangler_seen, entangler_only, nonentangler_universe_ids
+		is_entangler = self.roles[step] == ROLE_E
+		entangler_count = int(np.count_nonzero(is_entangler & self.keep))
+		return entangler_count > 0, entangler_count == self.num_kept, self.ids[self.keep & ~is_entangler]
+
+	def constrain(self, step, final_player_role):
+		num_kept_before = self.num_kept
+		self.keep &= self.roles[step] == ord(final_player_role)
+		self.num_kept = int(np.count_nonzero(self.keep))
+		return num_kept_before - self.num_kept
+
+def nightkill_pass(universe_file, decide, universes_collapsed, chunk_size):
+	#night.py's nightkill pass, a chunk of universes at a time. Universes are grouped by where the alpha scum, detective and guard sit, decide(scum_pos, detective_pos, guard_pos) is called once per new seating (see night.NightkillDecisions), and its outcomes are applied to the whole group as a table lookup.
+	#returns the surviving universes, the entangler subsidiary universes (those where the nightkill hit the entangler before any universe where it didn't), and the first bad target found ('#' or its role letter), or None. Adds to universes_collapsed.
+	all_universes = UniverseMatrix.from_universe_file(universe_file)
+	num_players = all_universes.roles.shape[1]
+	num_seatings = num_players * (num_players+1) * (num_players+1) #detective and guard positions can also be -1 - not in the universe
+	seating_decided = np.zeros(num_seatings, dtype=bool)
+	seating_no_target = np.zeros(num_seatings, dtype=bool) #one of the actions is '#'
+	seating_target = np.zeros(num_seatings, dtype=np.intp)
+	seating_outcomes = np.full((num_seatings, 256), NK_BAD_TARGET, dtype=np.uint8) #by nightkill target role
+	output_parts = []
+	subsidiary_parts = []
+	nk_hit_nonentangler_in_some_universe = False
+	for start in range(0, len(all_universes), chunk_size):
+		ids = all_universes.ids[start:start+chunk_size]
+		roles = all_universes.roles[start:start+chunk_size]
+		rows = np.arange(len(ids))
+		seating = (np.argmax(roles == ord('A'), axis=1) * (num_players+1) + role_positions(roles, ord('D')) + 1) * (num_players+1) + role_positions(roles, ord('G')) + 1
+		for new_seating in np.unique(seating[~seating_decided[seating]]).tolist():
+			decision = decide(new_seating // ((num_players+1) * (num_players+1)), new_seating // (num_players+1) % (num_players+1) - 1, new_seating % (num_players+1) - 1)
+			seating_decided[new_seating] = True
+			if decision is None:
+				seating_no_target[new_seating] = True
+				continue
+			seating_target[new_seating] = decision[0]
+			for role, outcome in decision[1].items():
+				seating_outcomes[new_seating, ord(role)] = outcome
+
+		scum_target = seating_target[seating]
+		target_role = roles[rows, scum_target]
+		outcome = seating_outcomes[seating, target_role]
+		no_target = seating_no_target[seating]
+		bad_target = no_target | (outcome == NK_BAD_TARGET)
+		if bad_target.any(): #the loop gives up at the first one
+			first_bad = int(np.argmax(bad_target))
+			return None, None, '#' if no_target[first_bad] else chr(target_role[first_bad])
+
+		survives = (outcome == NK_SURVIVES) | (outcome == NK_SURVIVES_KILLED)
+		kills_entangler = outcome == NK_HITS_ENTANGLER
+		universes_collapsed[NK_SCUM_TARGETS_SCUM] += int(np.count_nonzero(outcome == NK_SCUM_TARGETS_SCUM))
+		universes_collapsed[NK_DET_MEETS_GUARD] += int(np.count_nonzero(outcome == NK_DET_MEETS_GUARD))
+
+		#dead-entangler universes only go to the subsidiary list until the first universe where the nightkill didn't hit them. Every one after that collapses.
+		if nk_hit_nonentangler_in_some_universe:
+			subsidiary = np.zeros(len(ids), dtype=bool)
+		elif survives.any():
+			subsidiary = kills_entangler & (rows < np.argmax(survives))
+			nk_hit_nonentangler_in_some_universe = True
+		else:
+			subsidiary = kills_entangler
+		universes_collapsed[NK_HITS_ENTANGLER] += int(np.count_nonzero(kills_entangler & ~subsidiary))
+
+		marks_kill = (outcome == NK_SURVIVES_KILLED) | subsidiary #does nothing if player already NKd in this universe
+		for keep, parts in ((survives, output_parts), (subsidiary, subsidiary_parts)):
+			kept_rows = np.flatnonzero(keep)
+			kept_roles = roles[kept_rows] #a copy, so marking doesn't touch the file
+			killed = np.flatnonzero(marks_kill[kept_rows])
+			kept_roles[killed, scum_target[kept_rows[killed]]] = ROLE_X
+			parts.append((ids[kept_rows], kept_roles))
+	return join_universes(output_parts, num_players), join_universes(subsidiary_parts, num_players), None
+
+def vote_pass(universe_file, vote, chunk_size):
+	#day.py's vote pass, column by column. The voted player's role decides everything, so we scan just their column, then copy out only the universes that survive with the V marked in bulk.
+	#returns the surviving universes, the entangler subsidiary universes (those where the vote hit the entangler before any universe where it didn't), universes_collapsed [already dead, vote entangler], and the first unknown role found, or None.
+	voted_roles = player_column(universe_file, vote, chunk_size)
+	unknown_role = ~np.isin(voted_roles, ROLE_VOTE_KNOWN)
+	if unknown_role.any(): #the loop gives up at the first one
+		return None, None, None, chr(voted_roles[np.argmax(unknown_role)])
+	hits_nonentangler = np.isin(voted_roles, ROLE_VOTE_NONENTANGLER)
+	subsidiary = voted_roles == ROLE_E
+	universes_collapsed = [int(np.count_nonzero(voted_roles == ROLE_X)), 0]
+	if hits_nonentangler.any(): #dead-entangler universes only go to the subsidiary list until the first universe where the vote didn't hit them. Every one after that collapses.
+		first_hit = int(np.argmax(hits_nonentangler))
+		universes_collapsed[1] = int(np.count_nonzero(subsidiary[first_hit:]))
+		subsidiary[first_hit:] = False
+	return marked_universes(universe_file, np.flatnonzero(hits_nonentangler), vote, ROLE_V, chunk_size), marked_universes(universe_file, np.flatnonzero(subsidiary), vote, ROLE_V, chunk_size), universes_collapsed, None
+
+def player_column(universe_file, player_idx, chunk_size): #one player's role in every universe of a phase file
+	if not universe_file.is_implicit:
+		return record_view(universe_file)['roles'][:, player_idx] #strided, but no copy
+	column = np.empty(universe_file.num_universes, dtype=np.uint8)
+	for start in range(0, universe_file.num_universes, chunk_size): #unranking needs a few players-wide temporaries, so don't do it all at once
+		stop = min(start + chunk_size, universe_file.num_universes)
+		column[start:stop] = implicit_roles(np.arange(start, stop, dtype=np.int64), [player_idx], universe_file.num_players, universe_file.power_roles)[:, 0]
+	return column
+
+def marked_universes(universe_file, record_idxs, player_idx, role, chunk_size): #copies just the records given out of a phase file, with one player's role overwritten
+	if universe_file.is_implicit:
+		ids = record_idxs.astype(np.int64)
+		roles = np.empty((len(ids), universe_file.num_players), dtype=np.uint8)
+		for start in range(0, len(ids), chunk_size):
+			roles[start:start+chunk_size] = implicit_roles(ids[start:start+chunk_size], range(universe_file.num_players), universe_file.num_players, universe_file.power_roles)
+	else:
+		records = record_view(universe_file)[record_idxs]
+		ids = record_ids(universe_file, records)
+		roles = records['roles']
+	roles[:, player_idx] = role
+	return UniverseMatrix(ids, roles)
+
+def role_positions(roles, role): #where each universe has that role, -1 if it doesn't
+	is_role = roles == role
+	return np.where(is_role.any(axis=1), np.argmax(is_role, axis=1), -1)
+
+def join_universes(parts, num_players): #list of (ids, roles) chunks -> UniverseMatrix
+	if len(parts) == 0:
+		return UniverseMatrix(np.zeros(0, dtype=np.int64), np.zeros((0, num_players), dtype=np.uint8))
+	return UniverseMatrix(np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts]))
+
+class UniverseBuilder: #stands in for the output list while a transition pass appends [id, [roles]] pairs, without keeping a Python object per universe
+	is_vectorized = False #not until finish()
+
+	def __init__(self, num_players):
+		self.num_players = num_players
+		self.ids = array('q')
+		self.roles = bytearray()
+
+	def append(self, universe):
+		self.ids.append(universe[0])
+		self.roles += "".join(universe[1]).encode('ascii')
+
+	def __len__(self):
+		return len(self.ids)
+
+	def finish(self):
+		return UniverseMatrix(np.frombuffer(self.ids, dtype=np.int64), np.frombuffer(self.roles, dtype=np.uint8).reshape(len(self.ids), self.num_players))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import argparse, contextlib, day, night, print_dms
+from sys import exit
+from os.path import exists
+
+#PHASE RUNNER - runs a transition and then prints the DMs for the phase it made, in one go.
+#the DM step doesn't rescan the new phase file: the transition writes its stats (and, for a night, its outcomes) next to it, and print_dms.py reads those.
+#the phase file is written out in full before any DMs are printed, so if anything goes wrong after that, the phase is safely on disk and print_dms.py can be rerun by itself.
+
+def run_phase():
+	parser = argparse.ArgumentParser(
+						prog='Quantumafia Phase Runner',
+						description="This runs day.py or night.py, then print_dms.py for the phase it made, in one process. Anything after the phase number is passed on to the transition, e.g. run_phase.py night 2 EMBLJ-... --vectorized --yes.",
+						epilog="If the game ends, the transition stops with an error, or it doesn't write a phase file (day.py --what-if, say), no DMs are printed.")
+
+	parser.add_argument('daynight', choices=['day', 'night'], help="Which transition to run: 'day' (then the night DMs) or 'night' (then the day DMs).")
+	parser.add_argument('num', type=int, help="The day (or night) to transition.")
+	parser.add_argument('--dms', help="Write the DMs to this file instead of printing them after the transition's output.")
+	args, transition_args = parser.parse_known_args()
+
+	if args.dms is not None and exists(args.dms):
+		print(f"The DMs file I'd have to write to, {args.dms}, already exists. Delete the old file if you want me to overwrite it.")
+		exit()
+
+	if args.daynight == 'day':
+		transitioned = day.day([str(args.num), *transition_args])
+		dms_args = ['night', str(args.num)]
+	else:
+		transitioned = night.night([str(args.num), *transition_args])
+		dms_args = ['day', str(args.num + 1)]
+	if not transitioned: #nothing was written (day.py --what-if or --speculate, say), so there are no DMs to print - even if an earlier run left that phase's file behind
+		return
+
+	if args.dms is None:
+		print()
+		print_dms.print_dms(dms_args)
+		return
+	print(f"Writing DMs to {args.dms}...")
+	with open(args.dms, 'x') as dms_file, contextlib.redirect_stdout(dms_file):
+		print_dms.print_dms(dms_args)
+	print("Done.")
+
+if __name__ == "__main__":
+	run_phase()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import argparse, qm_shared
+from sys import exit
+from os.path import exists
+
+#UNIVERSE VIEWER - look up universes in a phase file by ID
+
+def universe_ids(string): #type checker for argparse. Comma separated IDs, or ranges like 100:200 (the second ID not included)
+	ids = []
+	for item in string.split(','):
+		if ':' in item:
+			start, stop = item.split(':', maxsplit=1)
+			ids.append((int(start) if start != "" else 0, int(stop) if stop != "" else None))
+		else:
+			ids.append(int(item))
+	return ids
+
+def print_universe(universe): #one player per line, with their role letter (X dead, V voted out)
+	universe_id, roles = universe
+	print(f"Universe {universe_id}:")
+	for player_idx, role in enumerate(roles):
+		print(f"{tab()}{qm_shared.pos_to_player(player_idx)} {qm_shared.get_player_name(player_idx)}: {role}")
+
+def tab():
+	return "        " #8 spaces
+
+def show():
+	parser = argparse.ArgumentParser(
+						prog='Quantumafia Universe Viewer',
+						description="This prints universes from a phase's universe file by ID, e.g. to answer 'what's in universe 12345?'. Lookups are binary searches, so they're quick however big the file is.")
+
+	parser.add_argument('phase', help="The phase whose universe file to read: D1, N1, D2... or final. Or the universe file's name.")
+	parser.add_argument('ids', type=universe_ids, help="The universe IDs to show, comma separated. start:stop shows every universe with an ID from start up to (but not including) stop, and either end can be left off.")
+	parser.add_argument('--limit', type=int, default=100, help="Show at most this many universes from each range (default 100).")
+	args = parser.parse_args()
+
+	filename = args.phase if exists(args.phase) else qm_shared.find_universe_file(args.phase)
+	if not exists(filename):
+		print(f"Can't find a universe file for {args.phase}.")
+		exit()
+
+	qm_shared.read_game_info(0, True) #for the player names
+	universe_file = qm_shared.UniverseFile(filename)
+	print(f"{filename}: {universe_file.num_universes:,} universes.")
+	wanted_ids = [item for item in args.ids if not isinstance(item, tuple)]
+	found = dict(zip(wanted_ids, universe_file.universes_with_ids(wanted_ids)))
+	for item in args.ids:
+		if isinstance(item, tuple):
+			num_shown = 0
+			for universe in universe_file.universes_by_id(*item):
+				if num_shown >= args.limit:
+					print("...and more. Use --limit to see more of them.")
+					break
+				print_universe(universe)
+				num_shown += 1
+			if num_shown == 0:
+				print(f"No universes with IDs from {item[0]}{f' to {item[1]}' if item[1] is not None else ' on'}.")
+		elif found[item] is None:
+			print(f"Universe {item} isn't in {filename}. It's collapsed, or was never there.")
+		else:
+			print_universe(found[item])
+	universe_file.close()
+
+if __name__ == "__main__":
+	show()
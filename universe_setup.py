@@ -1,23 +1,22 @@
 #!/usr/bin/env python3
 
-import itertools
+import argparse
 from sys import exit
-from math import factorial, log10, ceil
-import qm_shared
-
-
-### FUNCTIONS
-
-def gen_universe_as_list(base_list, packed_universe, power_roles):
-	universe_list = base_list[:]
-	for power_role_id, player_id in enumerate(packed_universe): #index, item
-		universe_list[player_id] = power_roles[power_role_id] #so if players 3, 6, 2 are set to be the first three power roles, slot [3] in universe_list would be set to power_roles[0], and so on.
-	return universe_list
+from math import log10, ceil
+import qm_shared, qm_permutations
 
 
 def setup():
 	#QUANTUMAFIA SETUP
-		
+	parser = argparse.ArgumentParser(
+						prog='Quantumafia Universe Setup',
+						description='This generates the Day 1 universe file for a match of Quantumafia.')
+	
+	parser.add_argument('--binary', action='store_true', help="Write the universe files in the compact binary format instead of text. Every later phase file will follow suit. (You can switch formats later with convert_universes.py.)")
+	parser.add_argument('--implicit', action='store_true', help="Don't write out the Day 1 universes at all - just the header. Day 1 universes are generated from their IDs whenever they're needed, which saves a lot of disk space (and the time it takes to write it).")
+	parser.add_argument('--canonical', action='store_true', help="Hand out the extra scum (the 4th mafia member onwards) as a set rather than one ordering at a time. They're interchangeable, so each universe stands for every ordering of them - k extra scum means k! times fewer universes. Ignored with 3 mafia or fewer, where there are no extra scum. DMs and the probability table still count universes as if every ordering was there. Can't be combined with --implicit.")
+	args = parser.parse_args()
+	
 	game_setup, _, _ = qm_shared.read_game_info(0, True) #arguments aren't important
 	#game_setup is # players, # mafia, power role T/Fs
 	num_players = game_setup[0] #aliases
@@ -27,37 +26,50 @@ def setup():
 	has_follower = game_setup[4]
 	has_guard = game_setup[5]
 	
-	input("This will set up the universes for Quantum Mafia. The resulting universe file will be a VERY LARGE text file (gigabytes large). Press ENTER to continue.")
+	if args.canonical and num_scum <= 3:
+		print(f"There are only {num_scum} mafia, so there are no extra scum to hand out as a set - ignoring --canonical. The universe file will be the usual full set.")
+		args.canonical = False
+	if args.canonical and args.implicit:
+		print("Error - --canonical and --implicit can't be used together. Implicit universes are generated from their IDs, which only works for the full universe set.")
+		exit()
+	
+	if args.implicit:
+		input(f"This will set up the universes for Quantum Mafia. The Day 1 universes will be generated as needed, so the resulting {'binary' if args.binary else 'text'} universe file will only hold the game state. Press ENTER to continue.")
+	else:
+		input(f"This will set up the universes for Quantum Mafia. The resulting universe file will be a VERY LARGE {'binary' if args.binary else 'text'} file (gigabytes large). Press ENTER to continue.")
+	
+	universe_filename = qm_shared.universe_file_name("D1", args.binary)
+	if qm_shared.universe_file_exists("D1"):
+		print(f"Error - the starting universe file, {qm_shared.find_universe_file('D1')}, already exists. I won't overwrite this file, in case you have a game in progress. If you want to start a new game, delete these files then try running setup again.")
+		exit()
 	
 	try:
-		with open("universes-D1.txt", 'x') as universelist:
-			powerroles = 'ABC'[0:min(3,num_scum)]  \
-				+ ('D' if has_detective else '') 	\
-				+ ('E' if has_entangler else '') 	\
-				+ ('F' if has_follower else '') 	\
-				+ ('G' if has_guard else '') 		\
-				+ ''.join([chr(72+x) for x in range(num_scum-3)]) #HIJKetc
+		with open(universe_filename, 'xb' if args.binary else 'x') as universelist:
+			powerroles = qm_permutations.power_roles(game_setup)
 			
 			print("Creating permutations...")
-			possible_universes_packed = itertools.permutations(range(num_players),len(powerroles))
-			
-			expected_universes = factorial(num_players)//factorial(num_players-len(powerroles))
+			if args.canonical:
+				expected_universes = qm_permutations.count_canonical_universes(num_players, powerroles)
+			else:
+				expected_universes = qm_permutations.count_universes(num_players, len(powerroles))
 			print("Ready to create {} universes...".format(expected_universes))
 			num_digits = ceil(log10(expected_universes))
-			universe_format = "{:0"+str(num_digits)+"}-{}"
-			#with this, we pick players for the power roles - every possible permutation of players, in fact.
-			universe_base = ['T' for _ in range(num_players)]
-			universes = (universe_format.format(idx, "".join(gen_universe_as_list(universe_base, packed_universe, powerroles))) for idx, packed_universe in enumerate(possible_universes_packed))
+			#with this, we pick players for the power roles - every possible permutation of players, in fact. Universe IDs are the permutations' lexicographic ranks.
 			
-			print("{} universes created. Writing to disk...".format(expected_universes))
-			universelist.write("{}-{}-{}{}{}{}\n{}\n{}\n\n".format(
-				num_players, num_scum, 			#initial state
-				(1 if has_detective else 0), (1 if has_entangler else 0), (1 if has_follower else 0), (1 if has_guard else 0),
-				"".join("##" for _ in range(num_players)), #player global liveness - format = player role [# = indeterminate, A = scum, DEFG = role, T = town] + player liveness [# = alive in some universe X = dead in every universe V = voted out in every universe]
-				expected_universes #len(universes) #number of universes
-				#and a blank line for the last night's action string.
-				))
-			qm_shared.write_lines_to_file(universelist, universes)
+			if not args.implicit:
+				print("{} universes created. Writing to disk...".format(expected_universes))
+			qm_shared.write_universe_header(universelist, args.binary,
+				["##" for _ in range(num_players)], #player global liveness - format = player role [# = indeterminate, A = scum, DEFG = role, T = town] + player liveness [# = alive in some universe X = dead in every universe V = voted out in every universe]
+				game_setup, #initial state
+				expected_universes, #len(universes) #number of universes
+				"", #and a blank line for the last night's action string.
+				num_digits,
+				args.canonical,
+				args.implicit)
+			if args.canonical:
+				qm_shared.write_universe_records(universelist, qm_permutations.canonical_universes(num_players, powerroles), args.binary, num_digits, num_players)
+			elif not args.implicit:
+				qm_shared.write_universe_records(universelist, qm_permutations.universes(num_players, powerroles), args.binary, num_digits, num_players)
 			
 			print("Day 1 Universe file saved.")
 			
@@ -65,7 +77,7 @@ def setup():
 			#	print("WARNING - An unexpected number of universes was created. This may indicate a coding error. Proceed at your own risk!")
 		
 	except FileExistsError:
-		print("Error - the starting universe file, universes-D1.txt, already exists. I won't overwrite this file, in case you have a game in progress. If you want to start a new game, delete these files then try running setup again.")
+		print(f"Error - the starting universe file, {universe_filename}, already exists. I won't overwrite this file, in case you have a game in progress. If you want to start a new game, delete these files then try running setup again.")
 		exit()
 	
 	if has_entangler: